@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+为 /api/v1 的游标分页创建索引
+
+任务记录、兑换记录、获得的勋章和连续记录按 (孩子, ID) 分页读取，新建的数据库由db.create_all创建这些索引，
+已有数据库运行一次本脚本补建（已存在的索引会跳过）。分片模式下依次处理每个家庭分片。
+运行方式: python add_api_indexes.py
+"""
+
+import glob
+import logging
+import os
+import sys
+
+from sqlalchemy import inspect
+
+from app import create_app, db, shard_router
+from app.models import ChildBadge, RewardRecord, TaskRecord, TaskStreak
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('add_api_indexes')
+
+MODELS = (TaskRecord, RewardRecord, ChildBadge, TaskStreak)
+
+
+def migrate_engine(engine, label):
+    inspector = inspect(engine)
+    created = 0
+    with engine.begin() as conn:
+        for model in MODELS:
+            table = model.__table__
+            if not inspector.has_table(table.name):
+                continue
+            existing = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name in existing:
+                    continue
+                index.create(conn)
+                created += 1
+                logger.info(f'{label}: 已创建索引 {index.name}')
+    logger.info(f'{label}: 新建 {created} 个索引')
+
+
+def main():
+    app = create_app()
+    with app.app_context():
+        if shard_router.enabled:
+            paths = sorted(glob.glob(os.path.join(shard_router.shard_dir, '*.sqlite')))
+            for path in paths:
+                shard_key = os.path.splitext(os.path.basename(path))[0]
+                migrate_engine(shard_router.get_engine(shard_key), f'分片 {shard_key}')
+            logger.info(f'共处理 {len(paths)} 个家庭分片')
+        else:
+            migrate_engine(db.engine, '主数据库')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
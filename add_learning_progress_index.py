@@ -0,0 +1,60 @@
+from app import create_app, db
+import logging
+
+# 配置日志
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 创建应用实例
+app = create_app()
+
+with app.app_context():
+    try:
+        # 获取数据库连接
+        conn = db.engine.connect()
+        trans = conn.begin()
+
+        # 查找重复的学习进度记录（同一孩子、同一资源存在多条）
+        duplicates = conn.execute(db.text(
+            'SELECT child_id, resource_id FROM learning_progress '
+            'GROUP BY child_id, resource_id HAVING COUNT(id) > 1'
+        )).fetchall()
+
+        removed = 0
+        for child_id, resource_id in duplicates:
+            rows = conn.execute(db.text(
+                'SELECT id, progress, is_completed, last_accessed, access_count FROM learning_progress '
+                'WHERE child_id = :child_id AND resource_id = :resource_id'
+            ), {'child_id': child_id, 'resource_id': resource_id}).fetchall()
+
+            # 保留进度最高的记录，并合并访问次数
+            keep = max(rows, key=lambda r: (bool(r.is_completed), r.progress or 0, r.last_accessed or '', r.id))
+            total_access = sum(r.access_count or 0 for r in rows)
+            conn.execute(db.text(
+                'UPDATE learning_progress SET access_count = :access_count WHERE id = :id'
+            ), {'access_count': total_access, 'id': keep.id})
+
+            for row in rows:
+                if row.id != keep.id:
+                    conn.execute(db.text('DELETE FROM learning_progress WHERE id = :id'), {'id': row.id})
+                    removed += 1
+
+        logger.info(f'合并了{len(duplicates)}组重复记录，删除{removed}条')
+
+        # 创建(孩子, 资源)唯一复合索引
+        conn.execute(db.text(
+            'CREATE UNIQUE INDEX IF NOT EXISTS ix_learning_progress_child_resource '
+            'ON learning_progress(child_id, resource_id)'
+        ))
+
+        trans.commit()
+        logger.info('数据库更新成功')
+
+    except Exception as e:
+        logger.error(f'数据库更新失败: {str(e)}')
+        if 'trans' in locals():
+            trans.rollback()
+        raise
+    finally:
+        if 'conn' in locals():
+            conn.close()
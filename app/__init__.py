@@ -6,20 +6,18 @@ import logging
 import traceback
 from datetime import datetime
 
-# 配置日志
-log_level = os.environ.get('LOG_LEVEL', 'DEBUG')
-try:
-    logging.basicConfig(
-        level=getattr(logging, log_level),
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-except (AttributeError, ValueError):
-    # 如果日志级别无效，回退到DEBUG
-    logging.basicConfig(level=logging.DEBUG)
+from app.logging_config import setup_logging, init_request_logging
+from app.json_provider import init_json
+
+# 配置日志（异步队列输出，默认级别INFO，详见app/logging_config.py）
+setup_logging()
 logger = logging.getLogger(__name__)
 
+from app.sharding import ShardedSession, shard_router
+
 # 初始化扩展
-db = SQLAlchemy()
+# 使用支持家庭分片的会话类；未启用分片时行为与默认会话一致
+db = SQLAlchemy(session_options={'class_': ShardedSession})
 login_manager = LoginManager()
 login_manager.login_view = 'main.login'
 login_manager.session_protection = 'strong'  # 增强会话保护
@@ -32,14 +30,22 @@ def load_user(user_id):
         from app.models import User
         return User.query.get(int(user_id))
     except Exception as e:
-        logger.error(f'加载用户时发生错误: {str(e)}')
-        logger.error(traceback.format_exc())
+        logger.exception('加载用户时发生错误: %s', e)
         return None
 
-def create_app(config_name=None):
-    """创建应用实例的工厂函数"""
+def create_app(config_name=None, create_schema=None):
+    """创建应用实例的工厂函数
+
+    Args:
+        config_name: 保留参数
+        create_schema: 是否执行db.create_all()，默认读取环境变量AUTO_CREATE_SCHEMA
+    """
     logger.debug('正在创建Flask应用实例')
     app = Flask(__name__)
+    # JSON编码（安装了orjson时使用orjson），需在模板环境创建之前设置
+    init_json(app)
+    # 结构化访问日志：请求ID、端点、状态码、耗时、SQL条数
+    init_request_logging(app)
     
     # 配置 - 支持从环境变量加载配置
     # 从环境变量获取SECRET_KEY，如果没有则使用默认值
@@ -48,8 +54,21 @@ def create_app(config_name=None):
     # 数据库配置 - 支持从环境变量覆盖
     basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
     db_path = os.environ.get('DATABASE_URL', f'sqlite:///{os.path.join(basedir, "data.sqlite")}')
+    # 兼容部分托管平台提供的postgres://格式
+    if db_path.startswith('postgres://'):
+        db_path = db_path.replace('postgres://', 'postgresql://', 1)
     app.config['SQLALCHEMY_DATABASE_URI'] = db_path
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    if not db_path.startswith('sqlite'):
+        # 服务器数据库（如PostgreSQL）使用连接池：
+        # 默认每个进程的连接数与gunicorn/uWSGI的线程数相当，并允许少量溢出
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 4)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 2)),
+            'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+            'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+            'pool_pre_ping': True
+        }
     app.config['SQLALCHEMY_ECHO'] = os.environ.get('SQLALCHEMY_ECHO', 'False').lower() == 'true'
     
     # 会话配置
@@ -63,15 +82,31 @@ def create_app(config_name=None):
     db.init_app(app)
     logger.debug('初始化登录扩展')
     login_manager.init_app(app)
+    logger.debug('初始化分片路由')
+    shard_router.init_app(app)
+    from app.analytics.snapshot import analytics_snapshot
+    analytics_snapshot.init_app(app)
+    from app.assets import assets
+    assets.init_app(app)
+    from app.compression import compress
+    compress.init_app(app)
     
     # 添加Python内置函数到Jinja2模板全局上下文
     app.jinja_env.globals.update(hasattr=hasattr)
+    from app.templating import init_templates, warm_templates
+    init_templates(app)
+    from app.cache import caches
+    caches.init_app(app)
+    from app.fragment_cache import init_fragment_cache
+    init_fragment_cache(app)
+    from app.analytics.cache import analytics_cache
+    analytics_cache.init_app(app)
+    from app.analytics.widgets import widget_batch
+    widget_batch.init_app(app)
     
     # 添加简单的健康检查路由
     @app.route('/health')
     def health_check():
-        logger.debug('健康检查路由被访问')
-        logger.info('健康检查请求')
         
         # 简化版本：只返回基本状态信息，不进行数据库检查
         # 这样即使数据库有问题，健康检查也能响应
@@ -83,8 +118,7 @@ def create_app(config_name=None):
                 'timestamp': datetime.utcnow().isoformat()
             })
         except Exception as e:
-            logger.error(f'健康检查路由异常: {str(e)}')
-            logger.error(traceback.format_exc())
+            logger.exception('健康检查路由异常: %s', e)
             # 返回一个最基本的成功响应
             return jsonify({
                 'status': 'unknown',
@@ -98,8 +132,7 @@ def create_app(config_name=None):
     # 添加全局错误处理 - 捕获所有异常
     @app.errorhandler(Exception)
     def handle_all_exceptions(error):
-        logger.error(f'捕获到未处理的异常: {str(error)}')
-        logger.error(traceback.format_exc())
+        logger.error('捕获到未处理的异常: %s', error, exc_info=True)
           
         # 确定错误码，确保是整数类型
         error_code = getattr(error, 'code', None)
@@ -126,14 +159,9 @@ def create_app(config_name=None):
     # 404错误处理
     @app.errorhandler(404)
     def not_found(error):
-        logger.warning(f'404错误: 路径 {request.path} 不存在')
+        logger.warning('404错误: 路径 %s 不存在', request.path)
         return jsonify({'error': '页面不存在', 'path': request.path}), 404
     
-    # 添加全局请求处理
-    @app.before_request
-    def before_request():
-        logger.debug(f'请求: {request.method} {request.path}')
-    
     # 添加strftime过滤器
     @app.template_filter('strftime')
     def strftime_filter(date, format_str='%Y-%m-%d %H:%M:%S'):
@@ -151,36 +179,48 @@ def create_app(config_name=None):
             from app.analytics import analytics as analytics_blueprint
             logger.debug('注册analytics蓝图')
             app.register_blueprint(analytics_blueprint)
+            
+            from app.api import api as api_blueprint
+            logger.debug('注册api蓝图')
+            app.register_blueprint(api_blueprint)
         logger.debug('蓝图注册成功')
     except Exception as e:
-        logger.error(f'注册蓝图时发生错误: {str(e)}')
-        logger.error(traceback.format_exc())
+        logger.exception('注册蓝图时发生错误: %s', e)
         # 继续执行，让应用能够启动，即使蓝图注册失败
+
+    # 预编译全部模板（包括蓝图的模板目录），首个请求不再编译模板
+    if app.config['TEMPLATE_WARMUP']:
+        warm_templates(app)
     
-    # 直接初始化数据库，而不依赖before_first_request（在Flask新版本中已移除）
-    try:
-        with app.app_context():
-            # 确保数据库表存在
-            db.create_all()
-            logger.info('数据库表创建成功')
-    except Exception as e:
-        logger.error(f'数据库初始化失败: {str(e)}')
-        logger.error(traceback.format_exc())
+    # 表结构只在显式要求时创建（init_db.py、run.py或AUTO_CREATE_SCHEMA=true），
+    # 避免每个worker启动时都访问数据库
+    if create_schema is None:
+        create_schema = os.environ.get('AUTO_CREATE_SCHEMA', 'False').lower() == 'true'
+    if create_schema:
+        try:
+            with app.app_context():
+                db.create_all()
+                logger.info('数据库表创建成功')
+        except Exception as e:
+            logger.exception('数据库初始化失败: %s', e)
     
-    logger.debug(f'应用实例创建完成，数据库URI: {app.config["SQLALCHEMY_DATABASE_URI"]}')
+    logger.debug('应用实例创建完成，数据库URI: %s', app.config['SQLALCHEMY_DATABASE_URI'])
     return app
 
-# 创建应用实例
-try:
-    app = create_app()
-    logger.info('应用实例创建成功')
-except Exception as e:
-    logger.critical(f'应用实例创建失败: {str(e)}')
-    logger.critical(traceback.format_exc())
-    raise
+def dispose_engines(app):
+    """
+    释放应用持有的数据库连接（在gunicorn/uWSGI fork出worker之后调用）
 
-# 导出必要的变量
-__all__ = ['app', 'db', 'login_manager', 'create_app']
+    预加载模式下应用在主进程中创建，fork后的worker不能复用继承来的连接，
+    使用close=False只丢弃连接池而不关闭父进程仍在使用的连接。
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+    shard_router.dispose_all()
+    from app.analytics.snapshot import analytics_snapshot
+    if analytics_snapshot._engine is not None:
+        analytics_snapshot._engine.dispose(close=False)
 
-# 导入request对象用于请求处理
-from flask import request
\ No newline at end of file
+# 导出必要的变量
+__all__ = ['db', 'login_manager', 'shard_router', 'create_app', 'dispose_engines']
\ No newline at end of file
@@ -0,0 +1,269 @@
+"""
+分析结果缓存
+
+数据分析仪表盘中的Child.get_*聚合结果按 (孩子, 方法, 时间窗口) 缓存在共享缓存
+（caches.get('analytics')，由CACHE_URL或ANALYTICS_CACHE_URL配置）中，多个worker共用，
+worker回收后依然有效。缓存键包含孩子和全局数据的版本号，数据写入后自动失效；
+由于“最近N天”的窗口随时间推移，另外设置过期时间 ANALYTICS_CACHE_TIMEOUT（默认300秒）。
+
+缓存未命中时按相同的键合并并发计算（例如在两台设备上同时打开仪表盘，或第一次加载未完成时刷新）：
+同一进程内的请求等待正在进行的计算；ANALYTICS_SINGLE_FLIGHT 可选跨进程的互斥方式：
+    process   只合并同一进程内的请求（默认）
+    file      同一主机上的worker使用文件锁互斥，其他worker在锁释放后从共享缓存读取
+    database  使用PostgreSQL咨询锁（其他数据库退化为process）
+跨进程合并需要共享的缓存后端（CACHE_URL为sqlite或redis）。
+
+过期数据与熔断：
+每个 (孩子, 方法, 时间窗口) 另外保存最近一次成功计算的结果及其计算时间（不含版本号，
+保留 ANALYTICS_STALE_MAX_AGE 秒，默认一天）。版本号变化后：
+    ANALYTICS_STALE_WHILE_REVALIDATE=True（默认）时立即返回上次的结果，并在后台线程中重新计算；
+    查询耗时超过 ANALYTICS_SLOW_QUERY_MS（默认2000毫秒）或数据库出错（如批量导入、
+    重建连续记录时数据库被锁定）累计 ANALYTICS_BREAKER_THRESHOLD 次（默认3次）后熔断，
+    ANALYTICS_BREAKER_COOLDOWN 秒（默认30秒）内不再查询，直接返回上次的结果；
+    没有可用的旧结果时仍然同步计算。
+返回旧结果时 g.data_as_of 记录数据的计算时间（UTC），页面据此显示“数据截至”，
+conditional_get 也不会为这样的响应生成ETag。
+"""
+import logging
+import os
+import threading
+import time
+from datetime import date, datetime
+
+from flask import current_app, g
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.cache import caches
+from app.models import Child
+from app.singleflight import SingleFlight, advisory_lock, file_lock
+from app.versioning import child_scope, template_fingerprint, version_key
+
+logger = logging.getLogger(__name__)
+
+# 后台重新计算时需要带到新应用上下文中的数据库绑定（分片、分析快照）
+_BIND_ATTRS = ('shard_key', 'shard_engine', 'snapshot_engine')
+
+
+class CircuitBreaker:
+    """查询连续过慢或出错时熔断，冷却期内直接使用旧数据"""
+
+    def __init__(self, threshold=3, cooldown=30):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        with self._lock:
+            if self.opened_at is None:
+                return False
+            if time.monotonic() - self.opened_at >= self.cooldown:
+                # 冷却结束（半开）：允许再次查询，失败后重新熔断
+                self.opened_at = None
+                self.failures = self.threshold - 1
+                return False
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold and self.opened_at is None:
+                self.opened_at = time.monotonic()
+                logger.warning('分析查询熔断，%s 秒内使用缓存的旧数据', self.cooldown)
+
+
+class AnalyticsCache:
+    """分析结果缓存"""
+
+    def __init__(self, app=None):
+        self.cache = None
+        self.timeout = 300
+        self.mode = 'process'
+        self.lock_dir = None
+        self.stale_while_revalidate = True
+        self.stale_max_age = 86400
+        self.slow_query_ms = 2000
+        self.flight = SingleFlight()
+        self.breaker = CircuitBreaker()
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        basedir = os.path.abspath(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+        app.config.setdefault('ANALYTICS_CACHE_TIMEOUT', int(os.environ.get('ANALYTICS_CACHE_TIMEOUT', 300)))
+        app.config.setdefault('ANALYTICS_SINGLE_FLIGHT', os.environ.get('ANALYTICS_SINGLE_FLIGHT', 'process'))
+        app.config.setdefault('ANALYTICS_LOCK_DIR',
+                              os.environ.get('ANALYTICS_LOCK_DIR', os.path.join(basedir, 'locks')))
+        app.config.setdefault('ANALYTICS_LOCK_TIMEOUT', int(os.environ.get('ANALYTICS_LOCK_TIMEOUT', 30)))
+        app.config.setdefault('ANALYTICS_STALE_WHILE_REVALIDATE',
+                              os.environ.get('ANALYTICS_STALE_WHILE_REVALIDATE', 'True').lower() == 'true')
+        app.config.setdefault('ANALYTICS_STALE_MAX_AGE', int(os.environ.get('ANALYTICS_STALE_MAX_AGE', 86400)))
+        app.config.setdefault('ANALYTICS_SLOW_QUERY_MS', int(os.environ.get('ANALYTICS_SLOW_QUERY_MS', 2000)))
+        app.config.setdefault('ANALYTICS_BREAKER_THRESHOLD', int(os.environ.get('ANALYTICS_BREAKER_THRESHOLD', 3)))
+        app.config.setdefault('ANALYTICS_BREAKER_COOLDOWN', int(os.environ.get('ANALYTICS_BREAKER_COOLDOWN', 30)))
+        self.timeout = app.config['ANALYTICS_CACHE_TIMEOUT']
+        self.mode = app.config['ANALYTICS_SINGLE_FLIGHT']
+        self.lock_dir = app.config['ANALYTICS_LOCK_DIR']
+        self.flight.timeout = app.config['ANALYTICS_LOCK_TIMEOUT']
+        self.stale_while_revalidate = app.config['ANALYTICS_STALE_WHILE_REVALIDATE']
+        self.stale_max_age = app.config['ANALYTICS_STALE_MAX_AGE']
+        self.slow_query_ms = app.config['ANALYTICS_SLOW_QUERY_MS']
+        self.breaker.threshold = app.config['ANALYTICS_BREAKER_THRESHOLD']
+        self.breaker.cooldown = app.config['ANALYTICS_BREAKER_COOLDOWN']
+        self.cache = caches.get('analytics')
+
+    def key(self, method, child_id, window):
+        return '{}:{}:{}:{}:{}'.format(
+            child_id, method, window, date.today().isoformat(), version_key(child_scope(child_id))
+        )
+
+    def stale_key(self, method, child_id, window):
+        # 不含数据版本号和日期，但包含代码版本（结果结构可能随代码变化）
+        return 'stale:{}:{}:{}:{}:{}'.format(
+            template_fingerprint(current_app._get_current_object()),
+            g.get('shard_key', ''), child_id, method, window
+        )
+
+    def peek(self, method, child_id, window):
+        """只读取当前版本的缓存结果，未命中（或缓存未启用）时返回None，不计算"""
+        if self.cache is None or self.timeout <= 0:
+            return None
+        try:
+            return self.cache.get(self.key(method, child_id, window))
+        except SQLAlchemyError:
+            db.session.rollback()
+            return None
+
+    def call(self, method, child_id, window, *args):
+        """
+        调用 Child.<method>(child_id, *args)，结果按 (孩子, 方法, 时间窗口) 缓存
+
+        Args:
+            method: Child上的分析方法名称，如 'get_points_trend'
+            child_id: 孩子ID
+            window: 时间窗口（天数），不依赖时间窗口的方法传None
+            args: 传给分析方法的其他参数
+        """
+        if self.cache is None or self.timeout <= 0:
+            return getattr(Child, method)(child_id, *args)
+
+        stale_key = self.stale_key(method, child_id, window)
+        try:
+            key = self.key(method, child_id, window)
+        except SQLAlchemyError:
+            # 读取数据版本号失败（数据库被锁定等），有旧数据时直接使用
+            db.session.rollback()
+            self.breaker.record_failure()
+            stale = self._get_stale(stale_key)
+            if stale is None:
+                raise
+            return self._serve_stale(stale)
+
+        value = self.cache.get(key)
+        if value is not None:
+            return value
+
+        stale = self._get_stale(stale_key)
+        if stale is not None:
+            if self.breaker.is_open:
+                return self._serve_stale(stale)
+            if self.stale_while_revalidate:
+                self._refresh_async(key, stale_key, method, child_id, args)
+                return self._serve_stale(stale)
+
+        try:
+            return self.flight.do(key, lambda: self._compute(key, stale_key, method, child_id, args))
+        except SQLAlchemyError:
+            if stale is None:
+                raise
+            db.session.rollback()
+            return self._serve_stale(stale)
+
+    def _get_stale(self, stale_key):
+        if self.stale_max_age <= 0:
+            return None
+        return self.cache.get(stale_key)
+
+    def _serve_stale(self, stale):
+        computed_at, value = stale
+        # 页面上显示最早的一项数据的计算时间
+        if g.get('data_as_of') is None or computed_at < g.data_as_of:
+            g.data_as_of = computed_at
+        return value
+
+    def _cross_process_lock(self, key):
+        if self.mode == 'file':
+            return file_lock(self.lock_dir, key, self.flight.timeout)
+        if self.mode == 'database':
+            return advisory_lock(db.session, key, self.flight.timeout)
+        return None
+
+    def _compute(self, key, stale_key, method, child_id, args):
+        lock = self._cross_process_lock(key)
+        if lock is None:
+            return self._run(key, stale_key, method, child_id, args)
+
+        with lock:
+            # 其他进程可能已在持有锁期间完成计算
+            value = self.cache.get(key)
+            if value is None:
+                value = self._run(key, stale_key, method, child_id, args)
+        return value
+
+    def _run(self, key, stale_key, method, child_id, args):
+        """执行分析查询并记录耗时，结果同时保存为新的旧数据"""
+        started = time.monotonic()
+        try:
+            value = getattr(Child, method)(child_id, *args)
+        except SQLAlchemyError:
+            self.breaker.record_failure()
+            raise
+        elapsed_ms = (time.monotonic() - started) * 1000
+        if elapsed_ms > self.slow_query_ms:
+            logger.warning('分析查询 %s(child=%s) 耗时 %.0f 毫秒', method, child_id, elapsed_ms)
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+        self.cache.set(key, value, self.timeout)
+        if self.stale_max_age > 0:
+            self.cache.set(stale_key, (datetime.utcnow(), value), self.stale_max_age)
+        return value
+
+    def _refresh_async(self, key, stale_key, method, child_id, args):
+        """在后台线程中重新计算（同一键同时只有一个刷新线程）"""
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        app = current_app._get_current_object()
+        binds = {name: g.get(name) for name in _BIND_ATTRS if g.get(name) is not None}
+
+        def run():
+            with app.app_context():
+                for name, value in binds.items():
+                    setattr(g, name, value)
+                try:
+                    self.flight.do(key, lambda: self._compute(key, stale_key, method, child_id, args))
+                except Exception:
+                    logger.exception('后台刷新分析数据失败: %s(child=%s)', method, child_id)
+                finally:
+                    db.session.remove()
+                    with self._lock:
+                        self._refreshing.discard(key)
+
+        threading.Thread(target=run, name='analytics-refresh', daemon=True).start()
+
+
+analytics_cache = AnalyticsCache()
@@ -0,0 +1,277 @@
+"""
+向量化分析引擎
+
+把一个孩子的全部已确认任务记录一次性加载为紧凑的NumPy数组（完成时间、日序号、任务序号、
+积分、分类序号），时间线、滚动完成率、连续天数和按分类汇总都用数组运算得到。
+加载只需一次查询，之后的计算与时间窗口长短基本无关，365天或多年的窗口与7天的开销相当。
+
+NumPy是可选依赖（pip install numpy），未安装时 available 为False，
+Child上的分析方法使用原有的逐行实现；recompute_streak 两种情况下都可以使用。
+同一请求内的加载结果保存在 g 中，数据库会话flush（有写入）后自动丢弃。
+"""
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+from flask import g, has_app_context
+from sqlalchemy import event, func
+
+try:
+    import numpy as np
+except ImportError:  # 可选依赖
+    np = None
+
+from app import db
+from app.models import Task, TaskCategory, TaskRecord
+from app.sharding import ShardedSession
+
+available = np is not None
+
+# 日序号为距1970-01-01的天数（与numpy的datetime64[D]一致）
+EPOCH = date(1970, 1, 1)
+
+# 某个任务的连续完成情况：当前连续天数（截至最后完成日期）、最长连续天数、最后完成日期
+StreakRun = namedtuple('StreakRun', 'current longest last_date')
+# 与按天/按分类分组查询返回的行具有相同的字段
+DailyPoints = namedtuple('DailyPoints', 'date daily_points')
+CategoryCount = namedtuple('CategoryCount', 'task_count category_id category_name')
+
+
+def day_index(value):
+    """日期（或日期时间）对应的日序号"""
+    if isinstance(value, datetime):
+        value = value.date()
+    return (value - EPOCH).days
+
+
+def index_date(index):
+    return EPOCH + timedelta(days=int(index))
+
+
+class ChildHistory:
+    """一个孩子已确认任务记录的数组表示"""
+
+    __slots__ = ('child_id', 'stamps', 'days', 'task_ids', 'tasks', 'points',
+                 'category_ids', 'category_names', 'categories')
+
+    def __init__(self, child_id, rows):
+        self.child_id = child_id
+        if rows:
+            completed_at, task_ids, points, category_ids, category_names = zip(*rows)
+        else:
+            completed_at = task_ids = points = category_ids = category_names = ()
+        self.stamps = np.array(completed_at, dtype='datetime64[us]')
+        self.days = self.stamps.astype('datetime64[D]').astype(np.int64)
+        # 任务和分类映射为从0开始的连续序号，便于bincount
+        self.task_ids, self.tasks = np.unique(np.array(task_ids, dtype=np.int64), return_inverse=True)
+        self.points = np.array(points, dtype=np.int64)
+        self.category_ids, first, self.categories = np.unique(
+            np.array(category_ids, dtype=np.int64), return_index=True, return_inverse=True
+        )
+        self.category_names = [category_names[i] for i in first]
+
+    @classmethod
+    def load(cls, child_id, task_id=None):
+        """加载孩子的已确认记录（可只加载某个任务）"""
+        query = db.session.query(
+            TaskRecord.completed_at,
+            TaskRecord.task_id,
+            func.coalesce(TaskRecord.actual_points, Task.points),
+            Task.category_id,
+            TaskCategory.name
+        ).join(
+            TaskRecord.task
+        ).join(
+            Task.task_category
+        ).filter(
+            TaskRecord.child_id == child_id,
+            TaskRecord.is_confirmed == True
+        )
+        if task_id is not None:
+            query = query.filter(TaskRecord.task_id == task_id)
+        return cls(child_id, query.all())
+
+    def __len__(self):
+        return len(self.days)
+
+    def mask(self, start=None, end=None):
+        """完成时间在 [start, end] 内的记录"""
+        mask = np.ones(len(self.stamps), dtype=bool)
+        if start is not None:
+            mask &= self.stamps >= np.datetime64(start, 'us')
+        if end is not None:
+            mask &= self.stamps <= np.datetime64(end, 'us')
+        return mask
+
+    def daily(self, start_day, end_day):
+        """[start_day, end_day] 内每天的完成次数和不同任务数"""
+        length = end_day - start_day + 1
+        in_range = (self.days >= start_day) & (self.days <= end_day)
+        offsets = self.days[in_range] - start_day
+        completed = np.bincount(offsets, minlength=length)
+        # 同一天同一任务只算一次
+        width = max(len(self.task_ids), 1)
+        pairs = np.unique(offsets * width + self.tasks[in_range])
+        unique_tasks = np.bincount(pairs // width, minlength=length)
+        return completed, unique_tasks
+
+    def rolling_rate(self, start_day, end_day, window=7):
+        """截至每天的最近window天中有完成记录的天数比例"""
+        active = self.daily(start_day - window + 1, end_day)[0] > 0
+        totals = np.concatenate(([0], np.cumsum(active)))
+        return (totals[window:] - totals[:-window]) / window
+
+    def daily_points(self, mask):
+        """按天汇总积分，只包含有记录的日期"""
+        days, inverse = np.unique(self.days[mask], return_inverse=True)
+        sums = np.bincount(inverse, weights=self.points[mask], minlength=len(days))
+        return days, sums.astype(np.int64)
+
+    def category_counts(self, mask):
+        """按分类统计记录数"""
+        return np.bincount(self.categories[mask], minlength=len(self.category_ids))
+
+    def distinct_tasks(self, mask):
+        return len(np.unique(self.tasks[mask]))
+
+    def streak_runs(self):
+        """每个任务的连续完成情况 {任务ID: StreakRun}"""
+        if not len(self.days):
+            return {}
+        base = self.days.min()
+        span = int(self.days.max() - base) + 1
+        # (任务, 日期) 去重后按任务、日期排序
+        keys = np.unique(self.tasks * span + (self.days - base))
+        tasks, days = keys // span, keys % span
+
+        # 任务变化或日期不连续的位置开始新的一段
+        new_run = np.ones(len(keys), dtype=bool)
+        new_run[1:] = (tasks[1:] != tasks[:-1]) | (np.diff(days) != 1)
+        run_lengths = np.bincount(np.cumsum(new_run) - 1)
+        run_tasks = tasks[new_run]
+
+        longest = np.zeros(len(self.task_ids), dtype=np.int64)
+        np.maximum.at(longest, run_tasks, run_lengths)
+        # 每个任务的最后一段即当前连续天数
+        last_run = np.append(run_tasks[1:] != run_tasks[:-1], True)
+        current = run_lengths[last_run]
+        last_day = days[np.append(tasks[1:] != tasks[:-1], True)] + base
+
+        return {
+            int(task_id): StreakRun(int(current[i]), int(longest[i]), index_date(last_day[i]))
+            for i, task_id in enumerate(self.task_ids)
+        }
+
+
+def child_history(child_id):
+    """当前请求中孩子的记录数组（同一请求内只加载一次）"""
+    child_id = int(child_id)
+    if not has_app_context():
+        return ChildHistory.load(child_id)
+    histories = g.setdefault('_child_histories', {})
+    history = histories.get(child_id)
+    if history is None:
+        history = histories[child_id] = ChildHistory.load(child_id)
+    return history
+
+
+@event.listens_for(ShardedSession, 'after_flush')
+def _forget_histories(session, flush_context):
+    if has_app_context():
+        g.pop('_child_histories', None)
+
+
+def recompute_streak(child_id, task_id):
+    """
+    根据该任务的全部已确认记录重新计算连续天数
+
+    Returns:
+        StreakRun，没有已确认记录时返回None
+    """
+    if available:
+        return ChildHistory.load(child_id, task_id=task_id).streak_runs().get(task_id)
+
+    rows = db.session.query(TaskRecord.completed_at).filter(
+        TaskRecord.child_id == child_id,
+        TaskRecord.task_id == task_id,
+        TaskRecord.is_confirmed == True
+    ).all()
+    days = sorted({completed_at.date() for completed_at, in rows})
+    if not days:
+        return None
+    current = longest = 1
+    for previous, day in zip(days, days[1:]):
+        current = current + 1 if (day - previous).days == 1 else 1
+        longest = max(longest, current)
+    return StreakRun(current, longest, days[-1])
+
+
+# 以下函数与Child上对应分析方法的返回格式一致
+
+def task_completion_by_period(child_id, start_date=None, end_date=None):
+    history = child_history(child_id)
+    counts = history.category_counts(history.mask(start_date, end_date))
+    return [
+        CategoryCount(int(counts[i]), int(history.category_ids[i]), history.category_names[i])
+        for i in np.flatnonzero(counts)
+    ]
+
+
+def points_trend(child_id, days=30):
+    history = child_history(child_id)
+    start_date = datetime.utcnow() - timedelta(days=days)
+    day_indexes, sums = history.daily_points(history.mask(start_date))
+    return [
+        DailyPoints(index_date(day).isoformat(), int(points))
+        for day, points in zip(day_indexes, sums)
+    ]
+
+
+def streak_summary(child_id):
+    """活跃（当前连续天数大于0）的任务数和最长连续天数"""
+    runs = child_history(child_id).streak_runs()
+    if not runs:
+        return 0, 0
+    current = np.fromiter((run.current for run in runs.values()), dtype=np.int64, count=len(runs))
+    longest = np.fromiter((run.longest for run in runs.values()), dtype=np.int64, count=len(runs))
+    return int(np.count_nonzero(current)), int(longest.max())
+
+
+def completed_task_count(child_id, days):
+    """最近days天内完成过的不同任务数"""
+    history = child_history(child_id)
+    start_date = datetime.utcnow() - timedelta(days=days)
+    return history.distinct_tasks(history.mask(start_date))
+
+
+def task_category_distribution(child_id, start_date, end_date=None):
+    history = child_history(child_id)
+    counts = history.category_counts(history.mask(start_date, end_date))
+    result = [
+        {'category_name': history.category_names[i], 'count': int(counts[i])}
+        for i in np.flatnonzero(counts)
+    ]
+    # 与按分类名称分组的查询结果顺序一致
+    result.sort(key=lambda item: item['category_name'])
+    return result
+
+
+def habit_timeline(child_id, days=30):
+    end_date = date.today()
+    start_date = end_date - timedelta(days=days)
+    start_day, end_day = day_index(start_date), day_index(end_date)
+
+    history = child_history(child_id)
+    completed, unique_tasks = history.daily(start_day, end_day)
+    rates = history.rolling_rate(start_day, end_day)
+    return [
+        {
+            'date': start_date + timedelta(days=offset),
+            'completed_count': count,
+            'unique_tasks': tasks,
+            'has_completions': count > 0,
+            'rolling_rate': rate
+        }
+        for offset, (count, tasks, rate) in enumerate(zip(
+            completed.tolist(), unique_tasks.tolist(), rates.tolist()
+        ))
+    ]
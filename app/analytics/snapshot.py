@@ -0,0 +1,188 @@
+"""
+数据分析只读快照
+
+长时间的分析查询（如365天的勋章分析）与打卡写入共用同一个数据库文件。
+启用快照后，analytics蓝图的查询改为读取定期刷新的快照文件：
+快照通过sqlite3.Connection.backup分页复制生成，每复制一批页面就释放读锁，
+不会长时间阻塞写入；复制完成后原子替换旧快照，正在进行的读取不受影响。
+其他进程的连接池仍指向被替换的旧文件，绑定请求时发现快照文件已变化就重新打开。
+"""
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from flask import g
+from flask_login import current_user
+from sqlalchemy import create_engine
+
+try:
+    import fcntl
+except ImportError:  # Windows下没有fcntl，退化为仅进程内加锁
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# 分页备份期间主数据库被其他连接写入时会从头开始，超过该次数后改为一次复制完成
+MAX_BACKUP_RESTARTS = 3
+
+
+class _BackupRestarted(Exception):
+    pass
+
+
+class AnalyticsSnapshot:
+    """管理分析快照的刷新及请求绑定"""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.source_path = None
+        self.path = None
+        self.interval = 300
+        self.pages = 256
+        self._engine = None
+        # 引擎打开时快照文件的 (inode, 修改时间)
+        self._opened = None
+        self._lock = threading.Lock()
+        self._refreshing = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        basedir = os.path.abspath(os.path.dirname(os.path.dirname(os.path.dirname(__file__))))
+        app.config.setdefault('ANALYTICS_SNAPSHOT_ENABLED',
+                              os.environ.get('ANALYTICS_SNAPSHOT_ENABLED', 'False').lower() == 'true')
+        app.config.setdefault('ANALYTICS_SNAPSHOT_PATH',
+                              os.environ.get('ANALYTICS_SNAPSHOT_PATH', os.path.join(basedir, 'analytics_snapshot.sqlite')))
+        app.config.setdefault('ANALYTICS_SNAPSHOT_INTERVAL', int(os.environ.get('ANALYTICS_SNAPSHOT_INTERVAL', 300)))
+        app.config.setdefault('ANALYTICS_SNAPSHOT_PAGES', int(os.environ.get('ANALYTICS_SNAPSHOT_PAGES', 256)))
+        app.extensions['analytics_snapshot'] = self
+
+        self.path = app.config['ANALYTICS_SNAPSHOT_PATH']
+        self.interval = app.config['ANALYTICS_SNAPSHOT_INTERVAL']
+        self.pages = app.config['ANALYTICS_SNAPSHOT_PAGES']
+        self.enabled = False
+
+        if not app.config['ANALYTICS_SNAPSHOT_ENABLED']:
+            return
+        uri = app.config['SQLALCHEMY_DATABASE_URI']
+        if not uri.startswith('sqlite:///') or app.config.get('SHARDING_ENABLED'):
+            logger.warning('分析快照仅支持单个SQLite数据库文件，已忽略ANALYTICS_SNAPSHOT_ENABLED')
+            return
+        self.source_path = uri[len('sqlite:///'):]
+        self.enabled = True
+
+    @property
+    def engine(self):
+        try:
+            stat = os.stat(self.path)
+            current = (stat.st_ino, stat.st_mtime_ns)
+        except OSError:
+            current = None
+        with self._lock:
+            if self._engine is not None and current != self._opened:
+                # 快照已被（本进程或其他进程）替换，连接池中的连接还指向旧文件
+                self._engine.dispose()
+                self._engine = None
+            if self._engine is None:
+                self._engine = create_engine(f'sqlite:///file:{self.path}?mode=ro&uri=true')
+                self._opened = current
+            return self._engine
+
+    def refreshed_at(self):
+        """快照的生成时间（UTC），快照不存在时返回None"""
+        try:
+            return datetime.utcfromtimestamp(os.path.getmtime(self.path))
+        except OSError:
+            return None
+
+    def is_stale(self):
+        try:
+            return time.time() - os.path.getmtime(self.path) >= self.interval
+        except OSError:
+            return True
+
+    def refresh(self):
+        """分页备份主数据库到快照文件；其他进程正在刷新时直接返回False"""
+        lock_file = open(f'{self.path}.lock', 'w')
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    return False
+
+            tmp_path = f'{self.path}.tmp'
+            started = time.time()
+            src = sqlite3.connect(self.source_path)
+            dst = sqlite3.connect(tmp_path)
+            try:
+                try:
+                    # 每步复制self.pages页，步间让出读锁，写入方可以继续提交
+                    src.backup(dst, pages=self.pages, sleep=0.005, progress=self._restart_guard())
+                except _BackupRestarted:
+                    # 写入频繁时分页复制可能一直无法完成，改为一次复制（复制期间写入方等待）
+                    logger.warning('分析快照分页复制重新开始超过%d次，改为一次复制', MAX_BACKUP_RESTARTS)
+                    src.backup(dst)
+                # 快照以只读方式打开，不使用WAL日志
+                dst.execute('PRAGMA journal_mode=DELETE')
+            finally:
+                dst.close()
+                src.close()
+            os.replace(tmp_path, self.path)
+            # 下次使用engine时发现文件已变化，重新打开连接池
+            logger.info('分析快照已刷新，耗时 %.2fs', time.time() - started)
+            return True
+        finally:
+            lock_file.close()
+
+    @staticmethod
+    def _restart_guard():
+        """备份进度回调：剩余页数变多说明源数据库被写入、备份从头开始，次数过多时中止"""
+        state = {'remaining': None, 'restarts': 0}
+
+        def progress(status, remaining, total):
+            if state['remaining'] is not None and remaining > state['remaining']:
+                state['restarts'] += 1
+                if state['restarts'] > MAX_BACKUP_RESTARTS:
+                    raise _BackupRestarted()
+            state['remaining'] = remaining
+
+        return progress
+
+    def refresh_async(self):
+        """在后台线程中刷新快照（同一进程内同时只有一个刷新线程）"""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('分析快照刷新失败')
+            finally:
+                self._refreshing = False
+
+        threading.Thread(target=run, name='analytics-snapshot', daemon=True).start()
+
+    def bind(self):
+        """把当前请求的数据库查询绑定到快照（analytics蓝图的before_request中调用）"""
+        if not self.enabled:
+            return
+        if not os.path.exists(self.path):
+            # 首次使用时同步生成快照
+            self.refresh()
+        elif self.is_stale():
+            self.refresh_async()
+        if not os.path.exists(self.path):
+            return
+        # 先从主数据库加载当前用户，避免快照生成后新建的账户被当作未登录
+        current_user._get_current_object()
+        g.snapshot_engine = self.engine
+
+
+analytics_snapshot = AnalyticsSnapshot()
@@ -1,13 +1,37 @@
-from flask import render_template, request, redirect, url_for, flash, jsonify
+from flask import render_template, request, redirect, url_for, flash, jsonify, g
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
 from app.analytics import analytics
-from app.models import Child, TaskRecord, TaskCategory, Task, Reward, RewardRecord, ChildBadge, Badge, TaskStreak
-from app import db
+from app.models import Child, TaskCategory, Reward, Badge, TaskStreak
+from app import read_models
+from app.analytics.snapshot import analytics_snapshot
+from app.analytics.cache import analytics_cache
+from app.analytics import widgets
+from app.analytics.widgets import widget_batch
+from app.versioning import conditional_get, user_scopes, visible_child_scopes
 from sqlalchemy import func, and_
 
+@analytics.before_request
+def use_analytics_snapshot():
+    """启用快照时，分析页面的查询读取只读快照而不是主数据库"""
+    analytics_snapshot.bind()
+
+@analytics.context_processor
+def inject_snapshot_time():
+    # 使用快照时在页面上显示数据的生成时间
+    # 分析缓存返回上次的结果（后台重新计算中）时显示这些数据的计算时间
+    return {
+        'snapshot_time': analytics_snapshot.refreshed_at() if analytics_snapshot.enabled else None,
+        'data_as_of': g.get('data_as_of')
+    }
+
+def _snapshot_version():
+    # 使用快照时，页面内容取决于快照的生成时间
+    return str(analytics_snapshot.refreshed_at()) if analytics_snapshot.enabled else ''
+
 @analytics.route('/analytics')
 @login_required
+@conditional_get(user_scopes, vary=_snapshot_version)
 def analytics_dashboard():
     """数据分析仪表盘"""
     # 家长用户可以查看所有孩子的数据分析
@@ -38,31 +62,36 @@ def analytics_dashboard():
     end_date = datetime.utcnow()
     start_date = end_date - timedelta(days=days)
     
+    # 以下聚合结果按 (孩子, 方法, 时间窗口) 缓存，见app/analytics/cache.py
+    child_id = selected_child.id
+    
     # 获取任务完成统计数据
-    task_completion_data = Child.get_task_completion_by_period(
-        selected_child.id, start_date, end_date
+    task_completion_data = analytics_cache.call(
+        'get_task_completion_by_period', child_id, days, start_date, end_date
     )
     
     # 获取积分趋势数据
-    points_trend_data = Child.get_points_trend(selected_child.id, days)
+    points_trend_data = analytics_cache.call('get_points_trend', child_id, days, days)
     
     # 获取连续完成统计
-    streak_stats = Child.get_streak_statistics(selected_child.id)
+    streak_stats = analytics_cache.call('get_streak_statistics', child_id, None)
     
     # 获取勋章统计
-    badge_stats = Child.get_badge_statistics(selected_child.id)
+    badge_stats = analytics_cache.call('get_badge_statistics', child_id, None)
     
     # 获取任务完成率
-    completion_rate_data = Child.get_task_completion_rate(selected_child.id, days)
+    completion_rate_data = analytics_cache.call('get_task_completion_rate', child_id, days, days)
     
     # 获取任务分类分布数据
-    category_distribution = Child.get_task_category_distribution(selected_child.id, start_date, end_date)
+    category_distribution = analytics_cache.call(
+        'get_task_category_distribution', child_id, days, start_date, end_date
+    )
     
     # 获取习惯养成时间线数据（使用用户选择的时间范围）
-    habit_timeline = Child.get_habit_timeline(selected_child.id, days=days)
+    habit_timeline = analytics_cache.call('get_habit_timeline', child_id, days, days)
     
     # 获取详细连续天数统计
-    detailed_streak_stats = Child.get_detailed_streak_statistics(selected_child.id)
+    detailed_streak_stats = analytics_cache.call('get_detailed_streak_statistics', child_id, None)
     
     # 添加当前时间
     current_time = datetime.utcnow()
@@ -85,6 +114,7 @@ def analytics_dashboard():
 
 @analytics.route('/analytics/detail/<child_id>/<metric>')
 @login_required
+@conditional_get(lambda child_id, metric: visible_child_scopes(child_id), vary=_snapshot_version)
 def analytics_detail(child_id, metric):
     """详细的数据分析页面"""
     # 获取指定的孩子
@@ -104,12 +134,8 @@ def analytics_detail(child_id, metric):
     # 根据不同的指标加载不同的数据
     if metric == 'tasks':
         # 任务完成详情
-        task_records = TaskRecord.query.filter_by(
-            child_id=child.id,
-            is_confirmed=True
-        ).filter(
-            TaskRecord.completed_at >= start_date
-        ).order_by(TaskRecord.completed_at.desc()).all()
+        # 按列查询并带出任务和分类名称
+        task_records = read_models.task_records(child.id, confirmed=True, since=start_date)
         
         # 获取任务分类完成情况统计
         category_completion_stats = Child.get_category_completion_stats(child.id, start_date, end_date)
@@ -125,24 +151,10 @@ def analytics_detail(child_id, metric):
     
     elif metric == 'points':
         # 积分获取详情
-        points_records = db.session.query(
-            TaskRecord,
-            Task.name.label('task_name'),
-            Task.points.label('task_points')
-        ).join(
-            Task
-        ).filter(
-            TaskRecord.child_id == child.id,
-            TaskRecord.is_confirmed == True,
-            TaskRecord.completed_at >= start_date
-        ).order_by(TaskRecord.completed_at.desc()).all()
+        points_records = read_models.task_records(child.id, confirmed=True, since=start_date)
         
         # 积分消耗记录
-        reward_claims = RewardRecord.query.filter_by(
-            child_id=child.id
-        ).filter(
-            RewardRecord.redeemed_at >= start_date
-        ).order_by(RewardRecord.redeemed_at.desc()).all()
+        reward_claims = read_models.reward_records(child.id, since=start_date)
         
         return render_template(
             'analytics/detail/points.html',
@@ -155,11 +167,7 @@ def analytics_detail(child_id, metric):
     
     elif metric == 'badges':
         # 勋章获取详情
-        earned_badges = ChildBadge.query.filter_by(
-            child_id=child.id
-        ).filter(
-            ChildBadge.earned_at >= start_date
-        ).order_by(ChildBadge.earned_at.desc()).all()
+        earned_badges = read_models.earned_badges(child.id, since=start_date)
         
         # 获取详细的勋章分析数据
         badge_analysis = Child.get_detailed_badge_analysis(child_id, days)
@@ -212,6 +220,7 @@ def analytics_detail(child_id, metric):
 
 @analytics.route('/analytics/api/task-category-data/<child_id>')
 @login_required
+@conditional_get(visible_child_scopes, vary=_snapshot_version)
 def task_category_data(child_id):
     """获取任务分类数据的API端点"""
     # 获取指定的孩子
@@ -231,23 +240,28 @@ def task_category_data(child_id):
     category_data = Child.get_task_category_distribution(child.id, start_date, end_date)
     
     # 转换为Chart.js需要的格式
-    labels = [item['category_name'] for item in category_data]
-    data = [item['count'] for item in category_data]
-    backgroundColors = [
-        'rgba(255, 99, 132, 0.6)',
-        'rgba(54, 162, 235, 0.6)',
-        'rgba(255, 206, 86, 0.6)',
-        'rgba(75, 192, 192, 0.6)',
-        'rgba(153, 102, 255, 0.6)',
-        'rgba(255, 159, 64, 0.6)'
-    ]
+    return jsonify(widgets.category_chart(category_data))
+
+@analytics.route('/analytics/api/widgets', methods=['POST'])
+@login_required
+def batch_widgets():
+    """
+    一次返回多个图表的数据（见app/analytics/widgets.py）
+
+    请求体: {"widgets": [{"metric": "points_trend", "child_id": 1, "window": 30, "id": "可选"}, ...]}
+    返回: {"widgets": [与请求顺序一致的结果，每项包含data或error], "generated_at": ..., "data_as_of": ...}
+    """
+    payload = request.get_json(silent=True)
+    items = payload.get('widgets') if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': '请求格式错误'}), 400
+    if len(items) > widget_batch.max_widgets:
+        return jsonify({'error': f'每次最多请求{widget_batch.max_widgets}个图表'}), 400
     
+    results = widget_batch.run(items)
     return jsonify({
-        'labels': labels,
-        'datasets': [{
-            'data': data,
-            'backgroundColor': backgroundColors[:len(labels)],
-            'borderColor': backgroundColors[:len(labels)],
-            'borderWidth': 1
-        }]
-    })
\ No newline at end of file
+        'widgets': results,
+        'generated_at': datetime.utcnow(),
+        # 使用了缓存的旧数据（后台重新计算中）时为这些数据的计算时间
+        'data_as_of': g.get('data_as_of')
+    })
@@ -0,0 +1,326 @@
+"""
+仪表盘图表的批量数据接口
+
+每个图表（widget）由指标、孩子和时间窗口（天数）描述，例如
+    {"metric": "points_trend", "child_id": 3, "window": 30}
+POST /analytics/api/widgets 一次提交多个图表，返回与请求顺序一致的结果列表，
+代替每个图表单独请求一次（每次都要重新验证登录、加载孩子和检查权限）。
+
+同一批次中共享的数据只准备一次：
+- 一次查询加载涉及的全部孩子并检查权限，一次查询读取这些孩子的数据版本号
+- 多个图表使用同一个分析结果（例如分类分布）时只计算一次
+- 结果按 (孩子, 方法, 时间窗口) 缓存（app/analytics/cache.py），命中的直接在请求线程中返回
+- 未命中的分析查询在线程池中并发执行；安装了NumPy时孩子的记录数组先在请求线程中加载一次，
+  各个查询共用（app/analytics/engine.py）
+
+ANALYTICS_BATCH_WORKERS 为线程池大小（默认4，设为1时在请求线程中依次计算，
+内存SQLite数据库只有一个共享连接，也总是依次计算）；ANALYTICS_BATCH_MAX_WIDGETS 为每批最多的图表数（默认20）。
+"""
+import logging
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from flask import current_app, g
+from flask_login import current_user
+
+from app import db
+from app.analytics import engine
+from app.analytics.cache import _BIND_ATTRS, analytics_cache
+from app.models import Child
+from app.versioning import GLOBAL_SCOPE, child_scope, get_versions
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WINDOW = 7
+MAX_WINDOW = 3650
+
+# 分类图表的颜色（与仪表盘一致）
+CHART_COLORS = [
+    'rgba(255, 99, 132, 0.6)',
+    'rgba(54, 162, 235, 0.6)',
+    'rgba(255, 206, 86, 0.6)',
+    'rgba(75, 192, 192, 0.6)',
+    'rgba(153, 102, 255, 0.6)',
+    'rgba(255, 159, 64, 0.6)'
+]
+
+# 图表定义：Child上的分析方法、参数形式（range为起止时间，days为天数，None表示与时间窗口无关）、结果格式化函数
+Widget = namedtuple('Widget', 'method params format')
+WidgetRequest = namedtuple('WidgetRequest', 'index key metric child_id window')
+
+
+def _records(rows):
+    """查询结果行或命名元组转换为字典"""
+    result = []
+    for row in rows:
+        if hasattr(row, '_mapping'):
+            result.append(dict(row._mapping))
+        elif hasattr(row, '_asdict'):
+            result.append(row._asdict())
+        else:
+            result.append(dict(row))
+    return result
+
+
+def category_chart(category_data):
+    """任务分类分布转换为Chart.js饼图的数据格式"""
+    labels = [item['category_name'] for item in category_data]
+    colors = CHART_COLORS[:len(labels)]
+    return {
+        'labels': labels,
+        'datasets': [{
+            'data': [item['count'] for item in category_data],
+            'backgroundColor': colors,
+            'borderColor': colors,
+            'borderWidth': 1
+        }]
+    }
+
+
+def _points_trend(rows):
+    return {
+        'labels': [str(row.date) for row in rows],
+        'data': [int(row.daily_points or 0) for row in rows]
+    }
+
+
+def _streaks(stats):
+    return {
+        'active_streaks_count': stats['active_streaks_count'],
+        'max_streak': stats['max_streak'],
+        'streaks': [
+            {
+                'task_id': streak.task_id,
+                'task_name': streak.task.name if streak.task else '',
+                'current_streak': streak.current_streak,
+                'longest_streak': streak.longest_streak,
+                'last_completed_date': streak.last_completed_date
+            }
+            for streak in stats['streaks']
+        ]
+    }
+
+
+def _badges(stats):
+    return {
+        'total_badges': stats['total_badges'],
+        'badges_by_level': [{'level': level, 'count': count} for level, count in stats['badges_by_level']],
+        'recent_badges': [
+            {
+                'badge_id': child_badge.badge_id,
+                'name': child_badge.badge.name,
+                'icon': child_badge.badge.icon,
+                'level': child_badge.badge.level,
+                'earned_at': child_badge.earned_at
+            }
+            for child_badge in stats['recent_badges']
+        ]
+    }
+
+
+WIDGETS = {
+    'task_completion': Widget('get_task_completion_by_period', 'range', _records),
+    'task_category': Widget('get_task_category_distribution', 'range', category_chart),
+    'points_trend': Widget('get_points_trend', 'days', _points_trend),
+    'completion_rate': Widget('get_task_completion_rate', 'days', dict),
+    'habit_timeline': Widget('get_habit_timeline', 'days', list),
+    'streaks': Widget('get_streak_statistics', None, _streaks),
+    'detailed_streaks': Widget('get_detailed_streak_statistics', None, dict),
+    'badges': Widget('get_badge_statistics', None, _badges),
+}
+
+
+def can_view(child):
+    """家长只能查看自己的孩子，孩子只能查看自己"""
+    if hasattr(current_user, 'children'):
+        return child.user_id == current_user.id
+    return child.id == current_user.id
+
+
+def _parse(index, item):
+    """校验单个图表请求，返回 (WidgetRequest, None) 或 (None, 错误信息)"""
+    if not isinstance(item, dict):
+        return None, '请求格式错误'
+    metric = item.get('metric')
+    if metric not in WIDGETS:
+        return None, f'未知的指标: {metric}'
+    try:
+        child_id = int(item.get('child_id'))
+        window = int(item.get('window') or DEFAULT_WINDOW)
+    except (TypeError, ValueError):
+        return None, '参数格式错误'
+    if not 1 <= window <= MAX_WINDOW:
+        return None, f'时间窗口应在1到{MAX_WINDOW}天之间'
+    if WIDGETS[metric].params is None:
+        window = None
+    return WidgetRequest(index, item.get('id', index), metric, child_id, window), None
+
+
+def _source_args(params, window, now):
+    if params == 'range':
+        return now - timedelta(days=window), now
+    if params == 'days':
+        return (window,)
+    return ()
+
+
+def _run_source(app, binds, histories, source, args):
+    """在线程池中计算一个分析结果（使用独立的应用上下文和数据库会话）"""
+    method, child_id, window = source
+    with app.app_context():
+        for name, value in binds.items():
+            setattr(g, name, value)
+        if histories is not None:
+            g._child_histories = histories
+        try:
+            value = analytics_cache.call(method, child_id, window, *args)
+            return value, g.get('data_as_of')
+        finally:
+            db.session.remove()
+
+
+class WidgetBatch:
+    """批量计算仪表盘图表数据"""
+
+    def __init__(self, app=None):
+        self.workers = 4
+        self.max_widgets = 20
+        self._executor = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ANALYTICS_BATCH_WORKERS', int(os.environ.get('ANALYTICS_BATCH_WORKERS', 4)))
+        app.config.setdefault('ANALYTICS_BATCH_MAX_WIDGETS', int(os.environ.get('ANALYTICS_BATCH_MAX_WIDGETS', 20)))
+        self.workers = app.config['ANALYTICS_BATCH_WORKERS']
+        self.max_widgets = app.config['ANALYTICS_BATCH_MAX_WIDGETS']
+        uri = app.config['SQLALCHEMY_DATABASE_URI']
+        if uri.startswith('sqlite') and (uri in ('sqlite://', 'sqlite:///') or ':memory:' in uri):
+            # 内存数据库在线程间共享同一个连接，不能并发查询
+            self.workers = 1
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix='analytics-widget')
+        return self._executor
+
+    def run(self, items):
+        """
+        计算一批图表
+
+        Args:
+            items: 图表请求列表，每项为 {"metric", "child_id", "window", "id"（可选，原样返回）}
+
+        Returns:
+            与请求顺序一致的结果列表，每项包含 data 或 error
+        """
+        now = datetime.utcnow()
+        results = [None] * len(items)
+        requests = []
+        for index, item in enumerate(items):
+            widget_request, error = _parse(index, item)
+            if error:
+                key = item.get('id', index) if isinstance(item, dict) else index
+                results[index] = {'id': key, 'error': error}
+            else:
+                requests.append(widget_request)
+
+        # 一次加载全部孩子并检查权限
+        child_ids = sorted({widget_request.child_id for widget_request in requests})
+        children = {child.id: child for child in Child.query.filter(Child.id.in_(child_ids))} if child_ids else {}
+        allowed = []
+        for widget_request in requests:
+            child = children.get(widget_request.child_id)
+            if child is None or not can_view(child):
+                results[widget_request.index] = {'id': widget_request.key, 'error': '无权访问此数据'}
+            else:
+                allowed.append(widget_request)
+
+        # 相同的分析结果只计算一次
+        sources = {}
+        for widget_request in allowed:
+            widget = WIDGETS[widget_request.metric]
+            source = (widget.method, widget_request.child_id, widget_request.window)
+            sources.setdefault(source, _source_args(widget.params, widget_request.window, now))
+
+        values, errors = self._resolve(sources)
+
+        for widget_request in allowed:
+            widget = WIDGETS[widget_request.metric]
+            source = (widget.method, widget_request.child_id, widget_request.window)
+            result = {
+                'id': widget_request.key,
+                'metric': widget_request.metric,
+                'child_id': widget_request.child_id,
+                'window': widget_request.window,
+            }
+            if source in errors:
+                result['error'] = '数据加载失败'
+            else:
+                result['data'] = widget.format(values[source])
+            results[widget_request.index] = result
+        return results
+
+    def _resolve(self, sources):
+        """读取或计算分析结果，返回 ({来源: 结果}, 失败的来源集合)"""
+        values = {}
+        errors = set()
+        if not sources:
+            return values, errors
+
+        # 一次查询读取所有孩子的版本号，之后的缓存查找不再访问数据库
+        child_ids = sorted({child_id for _, child_id, _ in sources})
+        get_versions([GLOBAL_SCOPE] + [child_scope(child_id) for child_id in child_ids])
+        misses = []
+        for source in sources:
+            value = analytics_cache.peek(*source)
+            if value is None:
+                misses.append(source)
+            else:
+                values[source] = value
+
+        if len(misses) <= 1 or self.workers <= 1:
+            for source in misses:
+                method, child_id, window = source
+                try:
+                    values[source] = analytics_cache.call(method, child_id, window, *sources[source])
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('计算图表数据失败: %s(child=%s)', method, child_id)
+                    errors.add(source)
+            return values, errors
+
+        histories = None
+        if engine.available:
+            # 记录数组在请求线程中每个孩子加载一次，线程池中的查询共用
+            for child_id in {child_id for _, child_id, _ in misses}:
+                engine.child_history(child_id)
+            histories = g.get('_child_histories')
+
+        app = current_app._get_current_object()
+        binds = {name: g.get(name) for name in _BIND_ATTRS if g.get(name) is not None}
+        futures = {
+            source: self.executor.submit(_run_source, app, binds, histories, source, sources[source])
+            for source in misses
+        }
+        for source, future in futures.items():
+            try:
+                values[source], data_as_of = future.result()
+            except Exception:
+                logger.exception('计算图表数据失败: %s(child=%s)', source[0], source[1])
+                errors.add(source)
+                continue
+            if data_as_of is not None and (g.get('data_as_of') is None or data_as_of < g.data_as_of):
+                g.data_as_of = data_as_of
+        return values, errors
+
+
+widget_batch = WidgetBatch()
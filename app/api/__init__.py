@@ -0,0 +1,7 @@
+from flask import Blueprint
+
+# 创建JSON API蓝图（版本1）
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+# 导入视图模块，确保路由被注册
+from app.api import views
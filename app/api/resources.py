@@ -0,0 +1,292 @@
+"""
+API资源定义
+
+每个资源列出可返回的字段：字段名 -> (SQL列表达式, 需要连接的表)。
+请求中的 fields=id,name 只查询这些列，并且只连接这些字段需要的表，不加载ORM对象。
+
+分页使用游标（keyset）：按有索引的键（主键，或学习进度的 (孩子, 资源) 唯一索引中的资源ID）排序，
+下一页从上一页最后一行的键之后开始，与偏移分页不同，翻到后面的页面不会变慢，
+翻页期间插入新数据也不会重复或遗漏。游标对客户端是不透明的字符串。
+"""
+import base64
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import func
+
+from app import db
+from app.models import (Badge, Child, ChildBadge, LearningProgress, LearningResource, Reward, RewardRecord, Task,
+                        TaskCategory, TaskRecord, TaskStreak)
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+# 字段：SQL列表达式和需要连接的表（按资源中声明的连接名称）
+Field = namedtuple('Field', 'column joins')
+# 过滤参数：列、取值转换函数、是否为下限（>=，否则为等于）
+Filter = namedtuple('Filter', 'column convert minimum')
+
+
+def _bool(value):
+    if value.lower() in ('1', 'true', 'yes'):
+        return True
+    if value.lower() in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f'无效的布尔值: {value}')
+
+
+def _datetime(value):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'无效的时间: {value}') from None
+
+
+def encode_cursor(value):
+    raw = json.dumps([value], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, = json.loads(raw)
+    except (ValueError, TypeError):
+        raise ValueError('无效的游标') from None
+    if not isinstance(value, int):
+        raise ValueError('无效的游标')
+    return value
+
+
+class Resource:
+    """
+    一个可分页、可选择字段的列表资源
+
+    Args:
+        fields: {字段名: Field}，声明顺序即默认的输出顺序
+        key: 排序和游标使用的键（需要有索引）
+        joins: {连接名称: (表, 连接条件)}，按声明顺序外连接
+        child_column: 按孩子过滤的列，为None时为所有家庭共享的目录数据
+        descending: 是否按键降序（新记录在前）
+        filters: {查询参数名: Filter}
+    """
+
+    def __init__(self, model, fields, key, joins=None, child_column=None, descending=False, filters=None):
+        self.model = model
+        self.fields = fields
+        self.key = key
+        self.joins = joins or {}
+        self.child_column = child_column
+        self.descending = descending
+        self.filters = filters or {}
+
+    def select_fields(self, fields_param):
+        """解析 fields 参数，未指定时返回全部字段"""
+        if not fields_param:
+            return list(self.fields)
+        names = []
+        for name in fields_param.split(','):
+            name = name.strip()
+            if not name:
+                continue
+            if name not in self.fields:
+                raise ValueError(f'未知的字段: {name}')
+            if name not in names:
+                names.append(name)
+        if not names:
+            raise ValueError('fields参数为空')
+        return names
+
+    def page(self, args, child_ids=None):
+        """
+        查询一页数据
+
+        Args:
+            args: 请求的查询参数（fields、limit、cursor及过滤参数）
+            child_ids: 只返回这些孩子的数据（孩子资源必须提供）
+
+        Returns:
+            (行字典列表, 下一页游标或None)
+        """
+        names = self.select_fields(args.get('fields'))
+        try:
+            limit = int(args.get('limit', DEFAULT_LIMIT))
+        except ValueError:
+            raise ValueError('无效的limit') from None
+        if not 1 <= limit <= MAX_LIMIT:
+            raise ValueError(f'limit应在1到{MAX_LIMIT}之间')
+
+        # 游标需要键列，未请求时也要查询
+        key_label = '_key'
+        query = self._select(names, self.key.label(key_label))
+        if self.child_column is not None:
+            query = query.filter(self.child_column.in_(list(child_ids or ())))
+        for param, (column, convert, minimum) in self.filters.items():
+            value = args.get(param)
+            if value:
+                value = convert(value)
+                query = query.filter(column >= value if minimum else column == value)
+
+        cursor = args.get('cursor')
+        if cursor:
+            last = decode_cursor(cursor)
+            query = query.filter(self.key < last if self.descending else self.key > last)
+        query = query.order_by(self.key.desc() if self.descending else self.key.asc())
+
+        rows = query.limit(limit + 1).all()
+        next_cursor = encode_cursor(getattr(rows[limit - 1], key_label)) if len(rows) > limit else None
+        return [{name: getattr(row, name) for name in names} for row in rows[:limit]], next_cursor
+
+    def fetch(self, ids, child_ids=None):
+        """按主键读取行的当前值（全部字段），返回 {ID: 行字典}，不存在的ID不在结果中"""
+        names = list(self.fields)
+        query = self._select(names, self.model.id.label('_id')).filter(self.model.id.in_(list(ids)))
+        if self.child_column is not None and child_ids is not None:
+            query = query.filter(self.child_column.in_(list(child_ids)))
+        return {row._id: {name: getattr(row, name) for name in names} for row in query}
+
+    def _select(self, names, *extra):
+        """只查询指定字段的列，并且只连接这些字段需要的表"""
+        columns = [self.fields[name].column.label(name) for name in names]
+        query = db.session.query(*columns, *extra).select_from(self.model)
+        needed = {join for name in names for join in self.fields[name].joins}
+        for join_name, (target, onclause) in self.joins.items():
+            if join_name in needed:
+                query = query.outerjoin(target, onclause)
+        return query
+
+
+# 目录数据（所有家庭共享）
+
+tasks = Resource(Task, {
+    'id': Field(Task.id, ()),
+    'name': Field(Task.name, ()),
+    'description': Field(Task.description, ()),
+    'points': Field(Task.points, ()),
+    'category_id': Field(Task.category_id, ()),
+    'category_name': Field(TaskCategory.name, ('category',)),
+    'is_active': Field(Task.is_active, ()),
+}, key=Task.id, joins={
+    'category': (TaskCategory, TaskCategory.id == Task.category_id),
+}, filters={'active': Filter(Task.is_active, _bool, False)})
+
+rewards = Resource(Reward, {
+    'id': Field(Reward.id, ()),
+    'name': Field(Reward.name, ()),
+    'description': Field(Reward.description, ()),
+    'cost': Field(Reward.cost, ()),
+    'level': Field(Reward.level, ()),
+    'is_active': Field(Reward.is_active, ()),
+}, key=Reward.id, filters={'active': Filter(Reward.is_active, _bool, False)})
+
+badges = Resource(Badge, {
+    'id': Field(Badge.id, ()),
+    'name': Field(Badge.name, ()),
+    'description': Field(Badge.description, ()),
+    'icon': Field(Badge.icon, ()),
+    'level': Field(Badge.level, ()),
+    'points_reward': Field(Badge.points_reward, ()),
+    'task_id': Field(Badge.task_id, ()),
+    'task_name': Field(Task.name, ('task',)),
+    'days_required': Field(Badge.days_required, ()),
+    'completions_required': Field(Badge.completions_required, ()),
+    'rule_type': Field(Badge.rule_type, ()),
+    'rule_threshold': Field(Badge.rule_threshold, ()),
+    'rule_period': Field(Badge.rule_period, ()),
+    'category_id': Field(Badge.category_id, ()),
+    'learning_category_id': Field(Badge.learning_category_id, ()),
+}, key=Badge.id, joins={
+    'task': (Task, Task.id == Badge.task_id),
+})
+
+# 孩子
+
+children = Resource(Child, {
+    'id': Field(Child.id, ()),
+    'name': Field(Child.name, ()),
+    'age': Field(Child.age, ()),
+    'points': Field(Child.points, ()),
+    'username': Field(Child.username, ()),
+}, key=Child.id, child_column=Child.id)
+
+# 孩子的数据（按 (孩子, ID) 索引，新记录在前）
+
+records = Resource(TaskRecord, {
+    'id': Field(TaskRecord.id, ()),
+    'child_id': Field(TaskRecord.child_id, ()),
+    'task_id': Field(TaskRecord.task_id, ()),
+    'task_name': Field(Task.name, ('task',)),
+    'category_name': Field(TaskCategory.name, ('task', 'category')),
+    'completed_at': Field(TaskRecord.completed_at, ()),
+    'is_confirmed': Field(TaskRecord.is_confirmed, ()),
+    'actual_points': Field(TaskRecord.actual_points, ()),
+    # 实际获得的积分（未单独设置时为任务积分）
+    'points': Field(func.coalesce(TaskRecord.actual_points, Task.points), ('task',)),
+}, key=TaskRecord.id, joins={
+    'task': (Task, Task.id == TaskRecord.task_id),
+    'category': (TaskCategory, TaskCategory.id == Task.category_id),
+}, child_column=TaskRecord.child_id, descending=True, filters={
+    'confirmed': Filter(TaskRecord.is_confirmed, _bool, False),
+    'since': Filter(TaskRecord.completed_at, _datetime, True),
+})
+
+redemptions = Resource(RewardRecord, {
+    'id': Field(RewardRecord.id, ()),
+    'child_id': Field(RewardRecord.child_id, ()),
+    'reward_id': Field(RewardRecord.reward_id, ()),
+    'reward_name': Field(Reward.name, ('reward',)),
+    'cost': Field(Reward.cost, ('reward',)),
+    'redeemed_at': Field(RewardRecord.redeemed_at, ()),
+    'is_fulfilled': Field(RewardRecord.is_fulfilled, ()),
+}, key=RewardRecord.id, joins={
+    'reward': (Reward, Reward.id == RewardRecord.reward_id),
+}, child_column=RewardRecord.child_id, descending=True, filters={
+    'fulfilled': Filter(RewardRecord.is_fulfilled, _bool, False),
+    'since': Filter(RewardRecord.redeemed_at, _datetime, True),
+})
+
+earned_badges = Resource(ChildBadge, {
+    'id': Field(ChildBadge.id, ()),
+    'child_id': Field(ChildBadge.child_id, ()),
+    'badge_id': Field(ChildBadge.badge_id, ()),
+    'badge_name': Field(Badge.name, ('badge',)),
+    'icon': Field(Badge.icon, ('badge',)),
+    'level': Field(Badge.level, ('badge',)),
+    'earned_at': Field(ChildBadge.earned_at, ()),
+}, key=ChildBadge.id, joins={
+    'badge': (Badge, Badge.id == ChildBadge.badge_id),
+}, child_column=ChildBadge.child_id, descending=True, filters={
+    'since': Filter(ChildBadge.earned_at, _datetime, True),
+})
+
+streaks = Resource(TaskStreak, {
+    'id': Field(TaskStreak.id, ()),
+    'child_id': Field(TaskStreak.child_id, ()),
+    'task_id': Field(TaskStreak.task_id, ()),
+    'task_name': Field(Task.name, ('task',)),
+    'current_streak': Field(TaskStreak.current_streak, ()),
+    'longest_streak': Field(TaskStreak.longest_streak, ()),
+    'last_completed_date': Field(TaskStreak.last_completed_date, ()),
+    'total_completions': Field(TaskStreak.total_completions, ()),
+}, key=TaskStreak.id, joins={
+    'task': (Task, Task.id == TaskStreak.task_id),
+}, child_column=TaskStreak.child_id)
+
+# 学习进度按 (孩子, 资源) 唯一索引中的资源ID分页
+learning_progress = Resource(LearningProgress, {
+    'resource_id': Field(LearningProgress.resource_id, ()),
+    'id': Field(LearningProgress.id, ()),
+    'child_id': Field(LearningProgress.child_id, ()),
+    'title': Field(LearningResource.title, ('resource',)),
+    'category_id': Field(LearningResource.category_id, ('resource',)),
+    'progress': Field(LearningProgress.progress, ()),
+    'last_watched_time': Field(LearningProgress.last_watched_time, ()),
+    'is_completed': Field(LearningProgress.is_completed, ()),
+    'last_accessed': Field(LearningProgress.last_accessed, ()),
+    'access_count': Field(LearningProgress.access_count, ()),
+}, key=LearningProgress.resource_id, joins={
+    'resource': (LearningResource, LearningResource.id == LearningProgress.resource_id),
+}, child_column=LearningProgress.child_id, filters={
+    'completed': Filter(LearningProgress.is_completed, _bool, False),
+})
@@ -0,0 +1,268 @@
+"""
+JSON API（版本1）
+
+供手机等客户端使用的接口，列表接口都返回 {"data": [...], "next_cursor": 下一页游标或null}：
+    GET /api/v1/children                                孩子（家长为全部孩子，孩子为自己）
+    GET /api/v1/tasks | rewards | badges                任务、奖励、勋章目录（active=true/false）
+    GET /api/v1/children/<id>/records                   任务记录（confirmed、since）
+    GET /api/v1/children/<id>/redemptions               奖励兑换记录（fulfilled、since）
+    GET /api/v1/children/<id>/badges                    获得的勋章（since）
+    GET /api/v1/children/<id>/streaks                   连续完成记录
+    GET /api/v1/children/<id>/learning-progress         学习进度（completed）
+    GET /api/v1/changes?since=<游标>                     游标之后的合并变更（增量同步，见app/changes.py）
+    POST /api/v1/checkins                               上传离线时排队的打卡
+
+通用参数：fields=id,name（只返回这些字段）、limit（默认50，最多200）、cursor（上一页返回的next_cursor）。
+响应带有根据数据版本号生成的强ETag，数据未变化时携带If-None-Match的请求返回304。
+未登录时返回401。
+"""
+from datetime import datetime, timedelta
+
+from flask import jsonify, request
+from flask_login import current_user
+
+from app import changes, db
+from app.api import api, resources
+from app.models import Child, Task, TaskRecord
+from app.sql_compat import day_bounds
+from app.versioning import conditional_get, user_scopes, visible_child_scopes
+
+# 变更记录的实体对应的资源（返回当前值时使用全部字段）
+CHANGE_RESOURCES = {
+    'records': resources.records,
+    'redemptions': resources.redemptions,
+    'badges': resources.earned_badges,
+    'streaks': resources.streaks,
+    'learning_progress': resources.learning_progress,
+    'children': resources.children,
+}
+CHANGES_LIMIT = 500
+MAX_CHECKINS = 100
+
+
+@api.before_request
+def require_login():
+    # API返回401，而不是重定向到登录页面
+    if not current_user.is_authenticated:
+        return jsonify({'error': '请先登录'}), 401
+
+
+def visible_child_ids():
+    """当前用户可以查看的孩子：家长为自己的全部孩子，孩子为自己"""
+    if hasattr(current_user, 'children'):
+        return [row[0] for row in db.session.query(Child.id).filter(Child.user_id == current_user.id)]
+    return [current_user.id]
+
+
+def _page(resource, child_ids=None):
+    try:
+        data, next_cursor = resource.page(request.args, child_ids)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'data': data, 'next_cursor': next_cursor})
+
+
+def _child_page(resource, child_id):
+    if child_id not in visible_child_ids():
+        return jsonify({'error': '无权访问此数据'}), 403
+    return _page(resource, [child_id])
+
+
+def _catalog_scopes():
+    # 目录数据只与全局版本号有关（ETag总是包含全局版本号）
+    return []
+
+
+def _child_scopes(child_id):
+    # 无权查看的孩子不做条件请求处理，由_child_page返回403（不能通过304探测）
+    return visible_child_scopes(child_id)
+
+
+@api.route('/children')
+@conditional_get(user_scopes)
+def list_children():
+    return _page(resources.children, visible_child_ids())
+
+
+@api.route('/tasks')
+@conditional_get(_catalog_scopes)
+def list_tasks():
+    return _page(resources.tasks)
+
+
+@api.route('/rewards')
+@conditional_get(_catalog_scopes)
+def list_rewards():
+    return _page(resources.rewards)
+
+
+@api.route('/badges')
+@conditional_get(_catalog_scopes)
+def list_badges():
+    return _page(resources.badges)
+
+
+@api.route('/children/<int:child_id>/records')
+@conditional_get(_child_scopes)
+def list_records(child_id):
+    return _child_page(resources.records, child_id)
+
+
+@api.route('/children/<int:child_id>/redemptions')
+@conditional_get(_child_scopes)
+def list_redemptions(child_id):
+    return _child_page(resources.redemptions, child_id)
+
+
+@api.route('/children/<int:child_id>/badges')
+@conditional_get(_child_scopes)
+def list_earned_badges(child_id):
+    return _child_page(resources.earned_badges, child_id)
+
+
+@api.route('/children/<int:child_id>/streaks')
+@conditional_get(_child_scopes)
+def list_streaks(child_id):
+    return _child_page(resources.streaks, child_id)
+
+
+@api.route('/children/<int:child_id>/learning-progress')
+@conditional_get(_child_scopes)
+def list_learning_progress(child_id):
+    return _child_page(resources.learning_progress, child_id)
+
+
+@api.route('/changes')
+@conditional_get(user_scopes)
+def list_changes():
+    """
+    增量同步：返回since游标之后的变更，每行只返回一次（当前值或删除）
+
+    不带since时只返回当前游标：客户端先保存游标，再通过列表接口下载全部数据，之后用该游标同步。
+    返回: {"changes": {实体: {"upserts": [...], "deletes": [ID, ...]}}, "cursor": 新游标, "has_more": 是否还有变更}
+    """
+    if not changes.available(db.session):
+        return jsonify({'error': '变更记录尚未启用，请运行 python init_db.py'}), 503
+
+    # 家长读取整个家庭的变更，孩子只读取自己的
+    if hasattr(current_user, 'children'):
+        family_id, child_id = current_user.id, None
+    else:
+        family_id, child_id = current_user.user_id, current_user.id
+
+    since = request.args.get('since')
+    if not since:
+        cursor = changes.head(db.session, family_id, child_id)
+        return jsonify({'changes': {}, 'cursor': resources.encode_cursor(cursor), 'has_more': False})
+    try:
+        since = resources.decode_cursor(since)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    delta = changes.read(db.session, family_id, since, child_id=child_id, limit=CHANGES_LIMIT)
+    child_ids = visible_child_ids()
+    result = {}
+    for entity in sorted(set(delta.upserts) | set(delta.deletes)):
+        ids = delta.upserts.get(entity, [])
+        rows = CHANGE_RESOURCES[entity].fetch(ids, child_ids) if ids else {}
+        # 读取时已不存在的行（之后被批量删除）按删除返回
+        deleted = delta.deletes.get(entity, []) + [entity_id for entity_id in ids if entity_id not in rows]
+        result[entity] = {'upserts': [rows[entity_id] for entity_id in ids if entity_id in rows],
+                          'deletes': sorted(deleted)}
+    return jsonify({
+        'changes': result,
+        'cursor': resources.encode_cursor(delta.last_id),
+        'has_more': delta.has_more
+    })
+
+
+def _parse_completed_at(value):
+    completed_at = datetime.fromisoformat(value)
+    if completed_at.tzinfo is not None:
+        # 与网页上填写的时间一致，保存为服务器本地时间
+        completed_at = completed_at.astimezone().replace(tzinfo=None)
+    return completed_at
+
+
+@api.route('/checkins', methods=['POST'])
+def upload_checkins():
+    """
+    上传离线时排队的打卡，生成待家长确认的任务记录（确认后发放积分、更新连续天数和勋章）
+
+    请求体: {"checkins": [{"client_id": "客户端标识", "child_id": 1, "task_id": 2, "completed_at": "ISO 8601"}, ...]}
+    同一孩子、任务、日期已有记录时返回duplicate和已有记录的ID，重复上传不会产生重复记录。
+    返回: {"results": [{"client_id", "status": "created"|"duplicate"|"error", "record_id"或"error"}, ...]}
+    """
+    payload = request.get_json(silent=True)
+    items = payload.get('checkins') if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': '请求格式错误'}), 400
+    if len(items) > MAX_CHECKINS:
+        return jsonify({'error': f'每次最多上传{MAX_CHECKINS}条打卡'}), 400
+
+    now = datetime.now()
+    parsed = []
+    results = []
+    for item in items:
+        client_id = item.get('client_id') if isinstance(item, dict) else None
+        try:
+            if not isinstance(item, dict):
+                raise ValueError('请求格式错误')
+            child_id, task_id = int(item['child_id']), int(item['task_id'])
+            completed_at = _parse_completed_at(item['completed_at'])
+        except (KeyError, TypeError, ValueError):
+            results.append({'client_id': client_id, 'status': 'error', 'error': '参数格式错误'})
+            continue
+        if completed_at > now + timedelta(minutes=5):
+            results.append({'client_id': client_id, 'status': 'error', 'error': '完成时间不能晚于当前时间'})
+            continue
+        results.append({'client_id': client_id})
+        parsed.append((len(results) - 1, child_id, task_id, completed_at))
+
+    child_ids = set(visible_child_ids())
+    task_ids = {task_id for _, _, task_id, _ in parsed}
+    active_tasks = {
+        row[0] for row in db.session.query(Task.id).filter(Task.id.in_(task_ids), Task.is_active == True)
+    } if task_ids else set()
+
+    # 一次查询读取涉及日期内已有的记录，用于去重
+    existing = {}
+    targets = [(child_id, completed_at) for _, child_id, _, completed_at in parsed if child_id in child_ids]
+    if targets:
+        start = day_bounds(min(completed_at for _, completed_at in targets).date())[0]
+        end = day_bounds(max(completed_at for _, completed_at in targets).date())[1]
+        rows = db.session.query(TaskRecord.id, TaskRecord.child_id, TaskRecord.task_id, TaskRecord.completed_at).filter(
+            TaskRecord.child_id.in_({child_id for child_id, _ in targets}),
+            TaskRecord.task_id.in_(task_ids),
+            TaskRecord.completed_at >= start,
+            TaskRecord.completed_at < end
+        )
+        for row in rows:
+            existing.setdefault((row.child_id, row.task_id, row.completed_at.date()), row.id)
+
+    created = False
+    for index, child_id, task_id, completed_at in parsed:
+        result = results[index]
+        if child_id not in child_ids:
+            result.update(status='error', error='无权访问此数据')
+            continue
+        if task_id not in active_tasks:
+            result.update(status='error', error='任务不存在或已停用')
+            continue
+        key = (child_id, task_id, completed_at.date())
+        if key in existing:
+            result.update(status='duplicate', record_id=existing[key])
+            continue
+        record = TaskRecord(child_id=child_id, task_id=task_id, completed_at=completed_at, is_confirmed=False)
+        db.session.add(record)
+        # 同一批次中的重复打卡指向这条新记录
+        existing[key] = record
+        result.update(status='created', record_id=record)
+        created = True
+
+    if created:
+        db.session.commit()
+    for result in results:
+        if isinstance(result.get('record_id'), TaskRecord):
+            result['record_id'] = result['record_id'].id
+    return jsonify({'results': results})
@@ -0,0 +1,211 @@
+"""
+静态资源指纹与缓存
+
+build_assets.py 在构建时把 app/static 下的CSS/JS复制为带内容哈希的文件（static/dist/），
+同时生成 .gz 和 .br 预压缩版本以及 manifest.json。模板中使用 asset_url('css/base.css')
+引用资源：有构建清单时返回带指纹的文件名，否则在URL后附加内容哈希参数（开发环境）。
+Bootstrap、Font Awesome、Chart.js等前端依赖固定版本并保存在 static/vendor/ 下，
+通过 vendor_url() 引用，使内网或离线部署不依赖CDN。每个文件的SRI哈希固定在随代码提交的
+static/vendor/vendor.lock.json 中：下载脚本和应用启动时都按它校验本地文件，
+vendor_attrs() 为标签输出 integrity 属性，CDN返回的内容被替换时浏览器拒绝执行。
+带指纹的资源内容永不变化，返回一年有效期的 immutable 缓存头；
+浏览器支持时直接发送预压缩文件，不在请求中压缩。
+"""
+import base64
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+
+from flask import request, send_from_directory, url_for
+from markupsafe import Markup
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = 'manifest.json'
+DIST_DIR = 'dist'
+
+# 带指纹资源的缓存时间（秒）
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# 预压缩文件的扩展名，按优先顺序排列
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+# 前端依赖（固定版本）：名称 -> (static下的本地路径, CDN地址)
+# 本地文件由 fetch_vendor_assets.py 下载，目录名包含版本号
+VENDOR_ASSETS = {
+    'bootstrap.css': (
+        'vendor/bootstrap-5.3.0/css/bootstrap.min.css',
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css'
+    ),
+    'font-awesome.css': (
+        'vendor/font-awesome-4.7.0/css/font-awesome.min.css',
+        'https://cdn.jsdelivr.net/npm/font-awesome@4.7.0/css/font-awesome.min.css'
+    ),
+    'chart.js': (
+        'vendor/chart.js-4.4.0/chart.umd.min.js',
+        'https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.min.js'
+    )
+}
+
+# 前端依赖的哈希锁定文件（static下的路径）：{本地路径: SRI哈希，如 "sha384-..."}
+VENDOR_LOCK = 'vendor/vendor.lock.json'
+SRI_ALGORITHMS = ('sha256', 'sha384', 'sha512')
+
+# 被上述CSS以相对路径引用的文件（Font Awesome字体）
+VENDOR_EXTRA_FILES = [
+    (f'vendor/font-awesome-4.7.0/fonts/{name}', f'https://cdn.jsdelivr.net/npm/font-awesome@4.7.0/fonts/{name}')
+    for name in ('fontawesome-webfont.eot', 'fontawesome-webfont.svg', 'fontawesome-webfont.ttf',
+                 'fontawesome-webfont.woff', 'fontawesome-webfont.woff2', 'FontAwesome.otf')
+]
+
+
+def content_hash(path, length=10):
+    """文件内容的SHA-256哈希前缀"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:length]
+
+
+def sri_hash(data, algorithm='sha384'):
+    """内容的SRI哈希（"算法-base64摘要"），可直接用作integrity属性"""
+    digest = hashlib.new(algorithm, data).digest()
+    return f'{algorithm}-{base64.b64encode(digest).decode("ascii")}'
+
+
+def normalize_pin(value):
+    """锁定文件中的哈希转换为SRI格式（兼容早期版本记录的SHA-256十六进制值）"""
+    if not value:
+        return None
+    if '-' not in value:
+        return 'sha256-' + base64.b64encode(bytes.fromhex(value)).decode('ascii')
+    return value
+
+
+def matches_pin(data, pin):
+    """内容是否与锁定的SRI哈希一致"""
+    algorithm = pin.split('-', 1)[0]
+    return algorithm in SRI_ALGORITHMS and sri_hash(data, algorithm) == pin
+
+
+def load_vendor_lock(static_folder):
+    path = os.path.join(static_folder, VENDOR_LOCK)
+    try:
+        with open(path, encoding='utf-8') as f:
+            lock = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {path: normalize_pin(value) for path, value in lock.items() if normalize_pin(value)}
+
+
+class Assets:
+    """静态资源扩展：模板函数asset_url，以及支持预压缩和长期缓存的static视图"""
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.local_vendor = set()
+        self.vendor_lock = {}
+        self._hashes = {}
+        self.static_folder = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.static_folder = app.static_folder
+        self.manifest = self.load_manifest()
+        self.vendor_lock = load_vendor_lock(self.static_folder)
+        self.local_vendor = {name for name, (path, _) in VENDOR_ASSETS.items() if self._verify_vendor(path)}
+        missing = sorted(set(VENDOR_ASSETS) - self.local_vendor)
+        if missing:
+            logger.warning('前端依赖未下载到本地，将从CDN加载: %s（运行 python fetch_vendor_assets.py）',
+                           ', '.join(missing))
+        unpinned = sorted(name for name, (path, _) in VENDOR_ASSETS.items() if path not in self.vendor_lock)
+        if unpinned:
+            logger.warning('前端依赖没有锁定哈希，无法校验内容: %s（运行 python fetch_vendor_assets.py --pin 并提交 %s）',
+                           ', '.join(unpinned), VENDOR_LOCK)
+        app.jinja_env.globals['asset_url'] = self.asset_url
+        app.jinja_env.globals['vendor_url'] = self.vendor_url
+        app.jinja_env.globals['vendor_attrs'] = self.vendor_attrs
+        # 替换Flask默认的static视图
+        app.view_functions['static'] = self.send_static_file
+        app.extensions['assets'] = self
+
+    def load_manifest(self):
+        path = os.path.join(self.static_folder, DIST_DIR, MANIFEST_NAME)
+        try:
+            with open(path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def asset_url(self, filename):
+        """返回静态资源的带指纹URL"""
+        fingerprinted = self.manifest.get(filename)
+        if fingerprinted:
+            return url_for('static', filename=fingerprinted)
+
+        # 未运行构建脚本时使用内容哈希作为查询参数
+        if filename not in self._hashes:
+            try:
+                self._hashes[filename] = content_hash(os.path.join(self.static_folder, filename))
+            except OSError:
+                self._hashes[filename] = None
+        version = self._hashes[filename]
+        if version is None:
+            return url_for('static', filename=filename)
+        return url_for('static', filename=filename, v=version)
+
+    def _verify_vendor(self, path):
+        """本地文件存在并且与锁定的哈希一致（没有锁定哈希时只检查存在）"""
+        try:
+            with open(os.path.join(self.static_folder, path), 'rb') as f:
+                data = f.read()
+        except OSError:
+            return False
+        pin = self.vendor_lock.get(path)
+        if pin and not matches_pin(data, pin):
+            logger.error('前端依赖 %s 与 %s 中的哈希不一致，改为从CDN加载', path, VENDOR_LOCK)
+            return False
+        return True
+
+    def vendor_url(self, name):
+        """返回前端依赖的URL：优先使用本地文件，未下载时使用固定版本的CDN地址"""
+        path, cdn_url = VENDOR_ASSETS[name]
+        if name in self.local_vendor:
+            return self.asset_url(path)
+        return cdn_url
+
+    def vendor_attrs(self, name):
+        """前端依赖标签的integrity属性（有锁定哈希时），本地文件和CDN地址的内容相同"""
+        pin = self.vendor_lock.get(VENDOR_ASSETS[name][0])
+        if not pin:
+            return Markup('')
+        return Markup(' integrity="{}" crossorigin="anonymous"').format(pin)
+
+    def send_static_file(self, filename):
+        response = None
+        for encoding, suffix in PRECOMPRESSED:
+            if not request.accept_encodings[encoding]:
+                continue
+            if os.path.isfile(os.path.join(self.static_folder, filename + suffix)):
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                response = send_from_directory(self.static_folder, filename + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        if response is None:
+            response = send_from_directory(self.static_folder, filename)
+        response.vary.add('Accept-Encoding')
+
+        # 带指纹的资源可永久缓存
+        if filename.startswith(DIST_DIR + '/') or request.args.get('v'):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        return response
+
+
+assets = Assets()
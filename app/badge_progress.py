@@ -0,0 +1,216 @@
+"""
+勋章进度读模型
+
+ChildBadgeProgress 为每个 (孩子, 任务) 保存最接近获得的未获得勋章：勋章、类型（连续天数或完成次数）、
+所需值、当前值和进度百分比。荣誉墙、勋章分析中的“努力目标”和确认任务后的“还需N天”提示
+都按索引读取这张表，不再在每次请求中对所有勋章逐个计算进度，也不再把进度写到共享的Badge对象上。
+
+进度在写入的同一事务中维护：TaskStreak（连续天数）、任务记录（完成次数）、ChildBadge（获得勋章）
+或 Badge（勋章规则）有变化时，在flush后重新计算受影响的行。
+已有数据用 rebuild_badge_progress.py 生成。
+"""
+from datetime import datetime
+
+from sqlalchemy import event, inspect, or_, select, tuple_
+
+from app import badge_rules
+from app.models import Badge, ChildBadge, ChildBadgeProgress, TaskRecord, TaskStreak
+from app.sharding import ShardedSession
+
+# 各数据库引擎是否已有child_badge_progress表（未运行升级脚本时不影响写入）
+_table_checked = {}
+
+
+def _values(obj, name):
+    """属性当前和修改前的值"""
+    history = inspect(obj).attrs[name].history
+    values = set(history.unchanged or ()) | set(history.added or ()) | set(history.deleted or ())
+    if not values:
+        values = {getattr(obj, name)}
+    return {value for value in values if value is not None}
+
+
+def _collect(objects, pending):
+    pairs, children, tasks = pending
+    for obj in objects:
+        if isinstance(obj, (TaskStreak, TaskRecord)):
+            pairs.update(
+                (child_id, task_id)
+                for child_id in _values(obj, 'child_id') for task_id in _values(obj, 'task_id')
+            )
+        elif isinstance(obj, ChildBadge):
+            children.update(_values(obj, 'child_id'))
+        elif isinstance(obj, Badge):
+            tasks.update(_values(obj, 'task_id'))
+
+
+def _pending(session):
+    return session.info.setdefault('badge_progress', (set(), set(), set()))
+
+
+@event.listens_for(ShardedSession, 'before_flush')
+def _collect_changes(session, flush_context, instances):
+    # 修改和删除的对象在flush前读取（删除后无法再加载过期的属性）
+    _collect(list(session.dirty) + list(session.deleted), _pending(session))
+
+
+@event.listens_for(ShardedSession, 'after_flush')
+def _collect_new(session, flush_context):
+    _collect(session.new, _pending(session))
+
+
+@event.listens_for(ShardedSession, 'after_soft_rollback')
+def _discard_pending(session, previous_transaction):
+    # flush失败回滚后，未处理的孩子和任务不能带入同一会话的下一次flush
+    session.info.pop('badge_progress', None)
+
+
+def _has_progress_table(conn):
+    key = conn.engine.url
+    if key not in _table_checked:
+        _table_checked[key] = inspect(conn).has_table(ChildBadgeProgress.__tablename__)
+    return _table_checked[key]
+
+
+@event.listens_for(ShardedSession, 'after_flush_postexec')
+def _on_after_flush(session, flush_context):
+    # 在flush完成后计算，此时完成次数（app/counters.py）也已更新
+    pairs, children, tasks = session.info.pop('badge_progress', (set(), set(), set()))
+    if not (pairs or children or tasks):
+        return
+    conn = session.connection(bind_arguments={'mapper': ChildBadgeProgress})
+    if not sync(conn, pairs=pairs, children=children, tasks=tasks):
+        return
+    # 进度由SQL更新，丢弃会话中已加载的旧对象
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, ChildBadgeProgress):
+            session.expunge(obj)
+
+
+def sync(conn, pairs=(), children=(), tasks=()):
+    """表存在时重新计算受影响的进度（参数同refresh），返回是否已更新"""
+    if not _has_progress_table(conn):
+        return False
+    refresh(conn, pairs=pairs, children=children, tasks=tasks)
+    return True
+
+
+def next_badge(badges, earned, current_streak, total_completions):
+    """
+    未获得的勋章中进度最高的一个（进度相同时所需值小的优先）
+
+    Returns:
+        (勋章ID, 类型, 所需值, 当前值, 进度百分比)，都已获得时勋章ID为None
+    """
+    best = None
+    for badge in badges:
+        if badge.id in earned:
+            continue
+        # 与颁发勋章的规则一致（app/badge_rules.py），只跟踪按任务累计的连续天数和完成次数规则
+        rule = badge_rules.rule_for(badge)
+        if rule.type == 'task_streak':
+            kind, target, value = 'streak', rule.threshold, current_streak
+        elif rule.type == 'task_completions' and rule.period == 'all':
+            kind, target, value = 'count', rule.threshold, total_completions
+        else:
+            continue
+        if target <= 0:
+            continue
+        percent = min(100.0, value * 100.0 / target)
+        candidate = (badge.id, kind, target, value, percent)
+        if best is None or (percent, -target) > (best[4], -best[2]):
+            best = candidate
+    return best or (None, 'streak', 0, current_streak, 0.0)
+
+
+def refresh(conn, pairs=(), children=(), tasks=(), all_children=False):
+    """
+    重新计算勋章进度
+
+    Args:
+        pairs: 需要更新的 (孩子ID, 任务ID)
+        children: 需要更新全部任务的孩子ID
+        tasks: 需要更新全部孩子的任务ID
+        all_children: 为True时重建整张表
+
+    Returns:
+        写入的行数
+    """
+    table = ChildBadgeProgress.__table__
+    streaks = TaskStreak.__table__
+    if all_children:
+        streak_filter = progress_filter = None
+    else:
+        pairs, children, tasks = list(pairs), list(children), list(tasks)
+        streak_conditions, progress_conditions = [], []
+        if pairs:
+            streak_conditions.append(tuple_(streaks.c.child_id, streaks.c.task_id).in_(pairs))
+            progress_conditions.append(tuple_(table.c.child_id, table.c.task_id).in_(pairs))
+        if children:
+            streak_conditions.append(streaks.c.child_id.in_(children))
+            progress_conditions.append(table.c.child_id.in_(children))
+        if tasks:
+            streak_conditions.append(streaks.c.task_id.in_(tasks))
+            progress_conditions.append(table.c.task_id.in_(tasks))
+        if not streak_conditions:
+            return 0
+        streak_filter, progress_filter = or_(*streak_conditions), or_(*progress_conditions)
+
+    query = select(streaks.c.child_id, streaks.c.task_id, streaks.c.current_streak, streaks.c.total_completions)
+    if streak_filter is not None:
+        query = query.where(streak_filter)
+    rows = conn.execute(query).all()
+
+    # 没有连续记录的 (孩子, 任务) 不保留进度行
+    delete = table.delete()
+    if progress_filter is not None:
+        delete = delete.where(progress_filter)
+    conn.execute(delete)
+    if not rows:
+        return 0
+
+    task_ids = {row.task_id for row in rows}
+    child_ids = {row.child_id for row in rows}
+    badges = {}
+    for badge in conn.execute(
+        select(Badge.id, Badge.task_id, Badge.days_required, Badge.completions_required, Badge.rule_type,
+               Badge.rule_threshold, Badge.rule_period, Badge.category_id, Badge.learning_category_id).where(
+            Badge.task_id.in_(task_ids)
+        )
+    ):
+        badges.setdefault(badge.task_id, []).append(badge)
+    earned = {}
+    for row in conn.execute(
+        select(ChildBadge.child_id, ChildBadge.badge_id).where(ChildBadge.child_id.in_(child_ids))
+    ):
+        earned.setdefault(row.child_id, set()).add(row.badge_id)
+
+    now = datetime.utcnow()
+    values = []
+    for row in rows:
+        badge_id, kind, target, value, percent = next_badge(
+            badges.get(row.task_id, ()), earned.get(row.child_id, set()),
+            row.current_streak or 0, row.total_completions or 0
+        )
+        values.append({
+            'child_id': row.child_id, 'task_id': row.task_id, 'badge_id': badge_id, 'kind': kind,
+            'target': target, 'current_value': value, 'percent': percent, 'updated_at': now
+        })
+    conn.execute(table.insert(), values)
+    return len(values)
+
+
+def get(session, child_id, task_id):
+    """某个任务的勋章进度（会先flush，包含本次请求中尚未提交的修改）"""
+    session.flush()
+    return session.query(ChildBadgeProgress).filter_by(child_id=child_id, task_id=task_id).first()
+
+
+def closest(session, child_id, limit=5):
+    """最接近获得的未获得勋章的进度，按进度降序"""
+    return session.query(ChildBadgeProgress).filter(
+        ChildBadgeProgress.child_id == child_id,
+        ChildBadgeProgress.badge_id.isnot(None)
+    ).order_by(
+        ChildBadgeProgress.percent.desc(), ChildBadgeProgress.target
+    ).limit(limit).all()
@@ -0,0 +1,325 @@
+"""
+勋章规则
+
+每个勋章对应一条规则：规则类型、要求达到的数值、统计周期和范围（任务、任务分类或学习分类）。
+原有的连续天数勋章和完成次数勋章分别对应 task_streak 和 task_completions 规则，
+Badge.rule_type 非空时使用其余字段描述的规则，例如：
+
+    category_points + 分类 + month + 200   本月在某分类获得200积分
+    learning_completed + 50                累计完成50个学习资源
+    category_all_tasks_day + 分类 + 1      有一天完成了该分类的全部任务
+
+每条规则编译为一个聚合查询（GROUP BY 孩子 HAVING 聚合值 >= 要求），返回满足条件且尚未获得该勋章的孩子，
+多条规则用 UNION ALL 合并为一次查询。写入后只评估受影响的规则（award），
+也可以对全部孩子批量评估（evaluate 不指定孩子）。
+新增或修改勋章后用 backfill 按新规则为已满足条件的孩子补发（reevaluate_badges.py 为命令行入口）。
+"""
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import DateTime, and_, exists, func, insert, literal, literal_column, or_, select, union_all, update
+
+from app.models import (Badge, Child, ChildBadge, LearningProgress, LearningResource, Task, TaskRecord,
+                        TaskStreak)
+from app.sql_compat import day_bucket
+
+# 规则类型及说明
+RULE_TYPES = {
+    'task_streak': '连续完成任务的天数',
+    'task_completions': '完成任务的次数',
+    'category_completions': '完成分类任务的次数',
+    'category_points': '完成分类任务获得的积分',
+    'category_all_tasks_day': '完成分类全部任务的天数',
+    'learning_completed': '完成学习资源的个数',
+}
+# 需要关联任务的规则
+TASK_RULES = ('task_streak', 'task_completions')
+# 按任务分类统计的规则（分类为空时统计全部任务）
+CATEGORY_RULES = ('category_completions', 'category_points', 'category_all_tasks_day')
+LEARNING_RULES = ('learning_completed',)
+
+PERIODS = {'all': '累计', 'day': '今天', 'week': '本周', 'month': '本月'}
+
+Rule = namedtuple('Rule', 'badge_id type threshold period task_id category_id learning_category_id')
+# 补发结果：勋章、获得勋章的孩子ID列表、每人奖励的积分
+BackfillResult = namedtuple('BackfillResult', 'badge_id badge_name child_ids points_reward')
+
+
+def rule_for(badge):
+    """勋章对应的规则（未设置rule_type的勋章按连续天数或完成次数）"""
+    if badge.rule_type:
+        return Rule(badge.id, badge.rule_type, badge.rule_threshold or 0, badge.rule_period or 'all',
+                    badge.task_id, badge.category_id, badge.learning_category_id)
+    if badge.completions_required and badge.completions_required > 0:
+        return Rule(badge.id, 'task_completions', badge.completions_required, 'all', badge.task_id, None, None)
+    return Rule(badge.id, 'task_streak', badge.days_required or 0, 'all', badge.task_id, None, None)
+
+
+def describe(badge):
+    rule = rule_for(badge)
+    period = '' if rule.period == 'all' else PERIODS.get(rule.period, '')
+    if rule.type == 'task_streak':
+        return f'连续{rule.threshold}天'
+    if rule.type == 'task_completions':
+        return f'{period}完成{rule.threshold}次'
+    if rule.type in CATEGORY_RULES:
+        scope = f'「{badge.category.name}」分类' if badge.category_id and badge.category else '全部任务'
+        if rule.type == 'category_completions':
+            return f'{period}{scope}完成{rule.threshold}次'
+        if rule.type == 'category_points':
+            return f'{period}{scope}获得{rule.threshold}积分'
+        return f'{period}有{rule.threshold}天完成{scope}的全部任务'
+    if rule.type == 'learning_completed':
+        scope = f'「{badge.learning_category.name}」' if badge.learning_category_id and badge.learning_category else ''
+        return f'{period}完成{rule.threshold}个{scope}学习资源'
+    return RULE_TYPES.get(rule.type, rule.type)
+
+
+def period_start(period, now=None):
+    """统计周期的起始时间，累计时为None"""
+    now = now or datetime.now()
+    today = datetime.combine(now.date(), time.min)
+    if period == 'day':
+        return today
+    if period == 'week':
+        return today - timedelta(days=today.weekday())
+    if period == 'month':
+        return today.replace(day=1)
+    return None
+
+
+def _confirmed_records(rule, *columns):
+    """规则范围内已确认的任务记录"""
+    query = select(*columns).select_from(TaskRecord).join(Task, Task.id == TaskRecord.task_id).where(
+        TaskRecord.is_confirmed == True
+    )
+    if rule.type == 'task_completions':
+        query = query.where(TaskRecord.task_id == rule.task_id)
+    elif rule.category_id:
+        query = query.where(Task.category_id == rule.category_id)
+    start = period_start(rule.period)
+    if start is not None:
+        query = query.where(TaskRecord.completed_at >= start)
+    return query
+
+
+def compile_rule(rule, retroactive=False):
+    """
+    把规则编译为查询
+
+    Args:
+        retroactive: 按历史数据补发（连续天数规则使用历史最长连续天数，而不是当前连续天数）
+
+    Returns:
+        (查询, 孩子ID列)，查询返回满足规则的孩子ID
+    """
+    threshold = rule.threshold
+    if rule.type == 'task_streak':
+        streak = TaskStreak.longest_streak if retroactive else TaskStreak.current_streak
+        query = select(TaskStreak.child_id).where(TaskStreak.task_id == rule.task_id, streak >= threshold)
+        return query, TaskStreak.child_id
+
+    if rule.type == 'task_completions' and rule.period == 'all':
+        # 累计次数直接读取写入时维护的计数（app/counters.py）
+        query = select(TaskStreak.child_id).where(
+            TaskStreak.task_id == rule.task_id, TaskStreak.total_completions >= threshold
+        )
+        return query, TaskStreak.child_id
+
+    if rule.type in ('task_completions', 'category_completions'):
+        query = _confirmed_records(rule, TaskRecord.child_id).group_by(TaskRecord.child_id).having(
+            func.count(TaskRecord.id) >= threshold
+        )
+        return query, TaskRecord.child_id
+
+    if rule.type == 'category_points':
+        points = func.coalesce(TaskRecord.actual_points, Task.points)
+        query = _confirmed_records(rule, TaskRecord.child_id).group_by(TaskRecord.child_id).having(
+            func.coalesce(func.sum(points), 0) >= threshold
+        )
+        return query, TaskRecord.child_id
+
+    if rule.type == 'category_all_tasks_day':
+        active_tasks = select(func.count(Task.id)).where(Task.is_active == True)
+        if rule.category_id:
+            active_tasks = active_tasks.where(Task.category_id == rule.category_id)
+        # 每个孩子完成了分类全部（激活）任务的日期
+        days = _confirmed_records(
+            rule, TaskRecord.child_id.label('child_id'), day_bucket(TaskRecord.completed_at).label('day')
+        ).where(Task.is_active == True).group_by(
+            TaskRecord.child_id, day_bucket(TaskRecord.completed_at)
+        ).having(
+            func.count(TaskRecord.task_id.distinct()) >= active_tasks.scalar_subquery()
+        ).subquery()
+        query = select(days.c.child_id).group_by(days.c.child_id).having(func.count() >= max(threshold, 1))
+        return query, days.c.child_id
+
+    if rule.type == 'learning_completed':
+        query = select(LearningProgress.child_id).join(
+            LearningResource, LearningResource.id == LearningProgress.resource_id
+        ).where(LearningProgress.is_completed == True)
+        if rule.learning_category_id:
+            query = query.where(LearningResource.category_id == rule.learning_category_id)
+        start = period_start(rule.period)
+        if start is not None:
+            # 学习进度没有单独的完成时间，以最后学习时间计
+            query = query.where(LearningProgress.last_accessed >= start)
+        query = query.group_by(LearningProgress.child_id).having(func.count(LearningProgress.id) >= threshold)
+        return query, LearningProgress.child_id
+
+    raise ValueError(f'未知的勋章规则: {rule.type}')
+
+
+def evaluate(session, badges, child_ids=None, retroactive=False):
+    """
+    批量评估勋章规则（所有规则合并为一次查询）
+
+    Args:
+        badges: 需要评估的勋章
+        child_ids: 只评估这些孩子，为None时评估全部孩子
+        retroactive: 按历史数据补发（见compile_rule）
+
+    Returns:
+        {勋章ID: [满足条件且尚未获得该勋章的孩子ID, ...]}
+    """
+    selects = []
+    for badge in badges:
+        rule = rule_for(badge)
+        if rule.type in TASK_RULES and rule.task_id is None:
+            continue
+        query, child_column = compile_rule(rule, retroactive=retroactive)
+        query = query.where(~exists().where(
+            ChildBadge.child_id == child_column, ChildBadge.badge_id == rule.badge_id
+        ))
+        if child_ids is not None:
+            query = query.where(child_column.in_(list(child_ids)))
+        # 勋章ID作为常量列，合并后可以区分每行属于哪条规则
+        selects.append(query.add_columns(literal_column(str(int(rule.badge_id))).label('badge_id')))
+    if not selects:
+        return {}
+
+    statement = selects[0] if len(selects) == 1 else union_all(*selects)
+    matches = {}
+    for child_id, badge_id in session.execute(statement):
+        matches.setdefault(badge_id, []).append(child_id)
+    return {badge_id: sorted(set(children)) for badge_id, children in matches.items()}
+
+
+def affected_badges(session, task_ids=(), learning=False):
+    """受任务记录（或学习进度）变化影响的勋章"""
+    conditions = []
+    task_ids = [task_id for task_id in task_ids if task_id is not None]
+    if task_ids:
+        category_ids = [row[0] for row in session.query(Task.category_id).filter(Task.id.in_(task_ids)).distinct()]
+        conditions.append(and_(or_(Badge.rule_type.is_(None), Badge.rule_type.in_(TASK_RULES)),
+                               Badge.task_id.in_(task_ids)))
+        conditions.append(and_(Badge.rule_type.in_(CATEGORY_RULES),
+                               or_(Badge.category_id.is_(None), Badge.category_id.in_(category_ids))))
+    if learning:
+        conditions.append(Badge.rule_type.in_(LEARNING_RULES))
+    if not conditions:
+        return []
+    return session.query(Badge).filter(or_(*conditions)).order_by(Badge.id).all()
+
+
+def award(session, child, task_ids=(), learning=False):
+    """
+    评估受影响的勋章规则并颁发给孩子（创建ChildBadge并奖励积分，由调用方提交）
+
+    Returns:
+        新获得的勋章列表
+    """
+    # 先写入本次请求中的修改（新记录、连续天数），评估时读取的是数据库中的聚合值
+    session.flush()
+    badges = affected_badges(session, task_ids=task_ids, learning=learning)
+    matches = evaluate(session, badges, child_ids=[child.id])
+    awarded = []
+    for badge in badges:
+        if child.id in matches.get(badge.id, ()):
+            session.add(ChildBadge(child_id=child.id, badge_id=badge.id))
+            child.points += badge.points_reward or 0
+            awarded.append(badge)
+    return awarded
+
+
+def _insert_badge(conn, badge_id, child_ids, now):
+    """
+    为孩子们插入一个勋章，已获得的跳过（(孩子, 勋章)上有唯一索引，并发颁发时以唯一索引为准）
+
+    Returns:
+        实际插入的 [(ChildBadge ID, 孩子ID), ...]
+    """
+    table = ChildBadge.__table__
+    statement = insert(table).from_select(
+        ['child_id', 'badge_id', 'earned_at'],
+        select(Child.id, literal(badge_id), literal(now, DateTime)).where(
+            Child.id.in_(list(child_ids)),
+            ~exists().where(table.c.child_id == Child.id, table.c.badge_id == badge_id)
+        )
+    )
+    if conn.dialect.insert_returning:
+        return conn.execute(statement.returning(table.c.id, table.c.child_id)).all()
+    # 不支持RETURNING的数据库按 (勋章, 孩子) 读取刚插入的行
+    conn.execute(statement)
+    return conn.execute(
+        select(table.c.id, table.c.child_id).where(table.c.badge_id == badge_id, table.c.child_id.in_(list(child_ids)))
+    ).all()
+
+
+def backfill(session, badges, dry_run=False):
+    """
+    按当前规则对全部孩子评估勋章，补发满足条件但尚未获得的勋章（由调用方提交）
+
+    所有勋章的评估合并为一次查询，每个勋章一条 INSERT ... SELECT 和一条积分UPDATE。
+    已获得的勋章不会重复颁发，可以重复运行；只为实际插入的孩子发放积分。
+
+    Returns:
+        [BackfillResult, ...]，只包含有孩子补发的勋章
+    """
+    from app import badge_progress, changes, versioning
+
+    badges = list(badges)
+    matches = evaluate(session, badges, retroactive=True)
+    results = [
+        BackfillResult(badge.id, badge.name, matches[badge.id], badge.points_reward or 0)
+        for badge in badges if matches.get(badge.id)
+    ]
+    if dry_run or not results:
+        return results
+
+    conn = session.connection(bind_arguments={'mapper': ChildBadge})
+    now = datetime.utcnow()
+    awarded = []
+    inserted = []
+    for result in results:
+        rows = _insert_badge(conn, result.badge_id, result.child_ids, now)
+        if not rows:
+            continue
+        awarded.extend(rows)
+        # 只为实际插入的孩子发放积分（其间已由打卡颁发的不再重复奖励）
+        result = result._replace(child_ids=sorted(row.child_id for row in rows))
+        inserted.append(result)
+    results = inserted
+    if not results:
+        return results
+
+    children = Child.__table__
+    for result in results:
+        if result.points_reward:
+            conn.execute(
+                update(children).where(children.c.id.in_(result.child_ids)).values(
+                    points=children.c.points + result.points_reward
+                )
+            )
+
+    # 批量写入不经过flush，手动更新勋章进度、数据版本和变更记录
+    child_ids = {child_id for result in results for child_id in result.child_ids}
+    badge_progress.sync(conn, children=child_ids)
+    versioning.bump_children(conn, child_ids)
+    rewarded = {child_id for result in results if result.points_reward for child_id in result.child_ids}
+    changes.capture(conn, [changes.Change('badges', row.id, row.child_id, 'upsert') for row in awarded] +
+                    [changes.Change('children', child_id, child_id, 'upsert') for child_id in sorted(rewarded)])
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Child) and obj.id in child_ids:
+            session.expire(obj, ['points'])
+    return results
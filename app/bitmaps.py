@@ -0,0 +1,274 @@
+"""
+任务完成位图
+
+每个 (孩子, 任务, 年份) 在 completion_bitmap 表中保存一行366位（46字节）的位图，
+第n位（低位在前）表示该年第n+1天有已确认的完成记录。日历、热力图以及
+“今年哪些天完成了”“当前连续了几天”这类问题只需按索引读取一年的位图，
+计数和连续天数用位运算（popcount、游程）得到，不再扫描TaskRecord。
+
+位图在任务记录写入的同一事务中维护（新增、确认、删除、修改任务或日期、补录过去的日期都会
+在flush后重新核对受影响的日期），已有数据用 rebuild_completion_bitmaps.py 生成。
+"""
+import calendar
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event, inspect, select, update
+
+from app.models import CompletionBitmap, TaskRecord
+from app.sharding import ShardedSession
+
+BITMAP_BYTES = 46
+
+# 各数据库引擎是否已有completion_bitmap表（未运行升级脚本时不影响写入）
+_table_checked = {}
+
+
+def day_bit(day):
+    """日期在当年位图中的位置（1月1日为0）"""
+    return day.timetuple().tm_yday - 1
+
+
+def days_in_year(year):
+    return 366 if calendar.isleap(year) else 365
+
+
+def to_int(bits):
+    return int.from_bytes(bits or b'', 'little')
+
+
+def to_bytes(value):
+    return value.to_bytes(BITMAP_BYTES, 'little')
+
+
+def popcount(bits):
+    """完成的天数"""
+    return bin(to_int(bits)).count('1')
+
+
+def completed_days(bits, year):
+    """位图中完成的日期列表"""
+    value = to_int(bits)
+    start = date(year, 1, 1)
+    result = []
+    while value:
+        low = value & -value
+        result.append(start + timedelta(days=low.bit_length() - 1))
+        value ^= low
+    return result
+
+
+def runs(bits):
+    """连续完成的区间 [(起始位置, 天数), ...]，按日期升序"""
+    value = to_int(bits)
+    result = []
+    while value:
+        start = (value & -value).bit_length() - 1
+        shifted = value >> start
+        # 低位连续1的个数
+        length = ((shifted ^ (shifted + 1)) >> 1).bit_length()
+        result.append((start, length))
+        value &= ~(((1 << length) - 1) << start)
+    return result
+
+
+def longest_run(bits):
+    return max((length for _, length in runs(bits)), default=0)
+
+
+def run_ending_at(bitmaps, day):
+    """
+    截至day（含）的连续完成天数，可跨年
+
+    Args:
+        bitmaps: {年份: 位图}
+        day: 截止日期
+    """
+    count = 0
+    year, position = day.year, day_bit(day)
+    while year in bitmaps:
+        value = to_int(bitmaps[year])
+        while position >= 0 and (value >> position) & 1:
+            count += 1
+            position -= 1
+        if position >= 0:
+            break
+        year -= 1
+        position = days_in_year(year) - 1
+    return count
+
+
+def load(session, child_id, years, task_ids=None):
+    """一次读取孩子若干年份所有（或指定）任务的位图：{任务ID: {年份: 位图}}"""
+    query = session.query(CompletionBitmap.task_id, CompletionBitmap.year, CompletionBitmap.bits).filter(
+        CompletionBitmap.child_id == child_id,
+        CompletionBitmap.year.in_(list(years))
+    )
+    if task_ids is not None:
+        query = query.filter(CompletionBitmap.task_id.in_(task_ids))
+    bitmaps = {}
+    for row in query.all():
+        bitmaps.setdefault(row.task_id, {})[row.year] = row.bits
+    return bitmaps
+
+
+def daily_counts(bitmaps, year):
+    """热力图：每天完成的任务数（长度为当年天数），bitmaps为该年各任务的位图列表"""
+    counts = [0] * days_in_year(year)
+    for bits in bitmaps:
+        for day in completed_days(bits, year):
+            counts[day_bit(day)] += 1
+    return counts
+
+
+# ---- 写入时维护 ----
+
+def _record_keys(record):
+    """任务记录当前和修改前可能对应的 (孩子, 任务, 日期)"""
+    state = inspect(record)
+    values = []
+    for name in ('child_id', 'task_id', 'completed_at'):
+        history = state.attrs[name].history
+        candidates = set(history.unchanged or ()) | set(history.added or ()) | set(history.deleted or ())
+        if not candidates:
+            candidates = {getattr(record, name)}
+        values.append(candidates)
+    return {
+        (child_id, task_id, completed_at.date())
+        for child_id in values[0] for task_id in values[1] for completed_at in values[2]
+        if child_id is not None and task_id is not None and isinstance(completed_at, datetime)
+    }
+
+
+@event.listens_for(ShardedSession, 'before_flush')
+def _collect_changes(session, flush_context, instances):
+    # 修改和删除的记录在flush前读取（删除后无法再加载过期的属性）
+    pending = session.info.setdefault('bitmap_days', set())
+    for obj in list(session.dirty) + list(session.deleted):
+        if isinstance(obj, TaskRecord):
+            pending.update(_record_keys(obj))
+
+
+@event.listens_for(ShardedSession, 'after_soft_rollback')
+def _discard_pending(session, previous_transaction):
+    # flush失败回滚后，未处理的日期不能带入同一会话的下一次flush
+    session.info.pop('bitmap_days', None)
+
+
+def _affected_days(session):
+    keys = session.info.pop('bitmap_days', set())
+    # 新记录在flush后才有默认的完成时间
+    for obj in session.new:
+        if isinstance(obj, TaskRecord):
+            keys.update(_record_keys(obj))
+    affected = {}
+    for child_id, task_id, day in keys:
+        affected.setdefault((child_id, task_id, day.year), set()).add(day)
+    return affected
+
+
+def _has_bitmap_table(conn):
+    key = conn.engine.url
+    if key not in _table_checked:
+        _table_checked[key] = inspect(conn).has_table(CompletionBitmap.__tablename__)
+    return _table_checked[key]
+
+
+def _save(conn, child_id, task_id, year, bits):
+    table = CompletionBitmap.__table__
+    dialect = conn.dialect.name
+    values = {'child_id': child_id, 'task_id': task_id, 'year': year, 'bits': bits}
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table).values(**values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.child_id, table.c.year, table.c.task_id],
+            set_={'bits': stmt.excluded.bits}
+        )
+        conn.execute(stmt)
+        return
+
+    result = conn.execute(
+        update(table).where(
+            table.c.child_id == child_id, table.c.task_id == task_id, table.c.year == year
+        ).values(bits=bits)
+    )
+    if result.rowcount == 0:
+        conn.execute(table.insert().values(**values))
+
+
+def sync_days(conn, child_id, task_id, year, days):
+    """根据已确认的任务记录重新设置位图中指定日期的位"""
+    table = CompletionBitmap.__table__
+    first, last = min(days), max(days)
+    rows = conn.execute(
+        select(TaskRecord.completed_at).where(
+            TaskRecord.child_id == child_id,
+            TaskRecord.task_id == task_id,
+            TaskRecord.is_confirmed == True,
+            TaskRecord.completed_at >= datetime.combine(first, datetime.min.time()),
+            TaskRecord.completed_at < datetime.combine(last + timedelta(days=1), datetime.min.time())
+        )
+    ).all()
+    done = {row.completed_at.date() for row in rows}
+
+    existing = conn.execute(
+        select(table.c.bits).where(
+            table.c.child_id == child_id, table.c.task_id == task_id, table.c.year == year
+        )
+    ).scalar()
+    value = original = to_int(existing)
+    for day in days:
+        if day in done:
+            value |= 1 << day_bit(day)
+        else:
+            value &= ~(1 << day_bit(day))
+    if value != original:
+        _save(conn, child_id, task_id, year, to_bytes(value))
+
+
+@event.listens_for(ShardedSession, 'after_flush')
+def _on_after_flush(session, flush_context):
+    affected = _affected_days(session)
+    if not affected:
+        return
+    conn = session.connection(bind_arguments={'mapper': CompletionBitmap})
+    if not _has_bitmap_table(conn):
+        return
+    for (child_id, task_id, year), days in sorted(affected.items()):
+        sync_days(conn, child_id, task_id, year, days)
+
+
+def rebuild(conn, child_id=None):
+    """
+    根据全部已确认的任务记录重建位图
+
+    Returns:
+        写入的位图行数
+    """
+    query = select(TaskRecord.child_id, TaskRecord.task_id, TaskRecord.completed_at).where(
+        TaskRecord.is_confirmed == True
+    )
+    if child_id is not None:
+        query = query.where(TaskRecord.child_id == child_id)
+
+    bitmaps = {}
+    for row in conn.execute(query):
+        if row.completed_at is None:
+            continue
+        key = (row.child_id, row.task_id, row.completed_at.year)
+        bitmaps[key] = bitmaps.get(key, 0) | 1 << day_bit(row.completed_at.date())
+
+    table = CompletionBitmap.__table__
+    delete = table.delete()
+    if child_id is not None:
+        delete = delete.where(table.c.child_id == child_id)
+    conn.execute(delete)
+    if bitmaps:
+        conn.execute(table.insert(), [
+            {'child_id': key[0], 'task_id': key[1], 'year': key[2], 'bits': to_bytes(value)}
+            for key, value in bitmaps.items()
+        ])
+    return len(bitmaps)
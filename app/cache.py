@@ -0,0 +1,306 @@
+"""
+缓存后端
+
+统一的缓存接口（get/set/delete/clear），值为可pickle的Python对象：
+    MemoryCache   进程内LRU缓存，按条目数和总字节数限制大小（每个worker一份，回收后清空）
+    SQLiteCache   同一主机上所有worker共享的缓存文件（WAL模式并使用内存映射读取），
+                  worker回收后仍然有效
+    RedisCache    Redis兼容的客户端（需安装redis包，或传入任何实现get/set/delete的客户端对象，
+                  例如测试用的本地替身），可跨主机共享
+
+缓存地址：
+    memory://                    进程内LRU
+    sqlite:////path/cache.db     共享SQLite文件
+    redis://host:port/db         Redis
+
+应用中的各个缓存（catalog、analytics、fragment）通过 caches.get(名称) 获取，
+默认使用 CACHE_URL，也可以用 <名称>_CACHE_URL 单独配置，例如 FRAGMENT_CACHE_URL。
+缓存出错（如数据库锁定、Redis连接失败）时视为未命中，不影响请求。
+"""
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend:
+    """缓存后端接口"""
+
+    def get(self, key):
+        """返回缓存的值，不存在时返回None"""
+        raise NotImplementedError
+
+    def set(self, key, value, timeout=None):
+        """写入缓存，timeout为过期秒数（None表示不过期，由容量淘汰）"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def clear_prefix(self, prefix):
+        """删除以prefix开头的所有键"""
+        raise NotImplementedError
+
+
+class MemoryCache(CacheBackend):
+    """线程安全的进程内LRU缓存"""
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data = OrderedDict()  # key -> (序列化后的值, 字节数, 过期时间)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and item[2] is not None and item[2] <= time.time():
+                self._size -= self._data.pop(key)[1]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+        return pickle.loads(item[0])
+
+    def set(self, key, value, timeout=None):
+        # 保存序列化后的副本，调用方修改返回的对象不会影响缓存
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        expires = time.time() + timeout if timeout else None
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+            self._data[key] = (data, len(data), expires)
+            self._size += len(data)
+            while len(self._data) > self.max_entries or self._size > self.max_bytes:
+                _, (_, size, _) = self._data.popitem(last=False)
+                self._size -= size
+
+    def delete(self, key):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= old[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def clear_prefix(self, prefix):
+        with self._lock:
+            for key in [key for key in self._data if key.startswith(prefix)]:
+                self._size -= self._data.pop(key)[1]
+
+
+class SQLiteCache(CacheBackend):
+    """同一主机上多个进程共享的SQLite缓存"""
+
+    # 每写入多少次清理一次过期和超出容量的条目
+    PRUNE_INTERVAL = 200
+
+    def __init__(self, path, max_entries=10000, default_timeout=86400, mmap_size=64 * 1024 * 1024):
+        self.path = path
+        self.max_entries = max_entries
+        self.default_timeout = default_timeout
+        self.mmap_size = mmap_size
+        self._local = threading.local()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _connect(self):
+        # 每个线程一个连接；fork出的worker不能使用父进程的连接
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=1, isolation_level=None, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache '
+            '(key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)'
+        )
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        try:
+            row = self._connect().execute(
+                'SELECT value FROM cache WHERE key = ? AND expires > ?', (key, time.time())
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.debug('共享缓存读取失败: %s', e)
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def set(self, key, value, timeout=None):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        expires = time.time() + (timeout or self.default_timeout)
+        try:
+            conn = self._connect()
+            conn.execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                         (key, sqlite3.Binary(data), expires))
+            self._writes += 1
+            if self._writes % self.PRUNE_INTERVAL == 0:
+                self._prune(conn)
+        except sqlite3.Error as e:
+            logger.debug('共享缓存写入失败: %s', e)
+
+    def _prune(self, conn):
+        conn.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+        # 超出容量时删除最早过期的条目
+        conn.execute(
+            'DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires '
+            'LIMIT max(0, (SELECT count(*) FROM cache) - ?))', (self.max_entries,)
+        )
+
+    def delete(self, key):
+        try:
+            self._connect().execute('DELETE FROM cache WHERE key = ?', (key,))
+        except sqlite3.Error as e:
+            logger.debug('共享缓存删除失败: %s', e)
+
+    def clear(self):
+        self._connect().execute('DELETE FROM cache')
+
+    def clear_prefix(self, prefix):
+        self._connect().execute('DELETE FROM cache WHERE substr(key, 1, ?) = ?', (len(prefix), prefix))
+
+
+class RedisCache(CacheBackend):
+    """Redis兼容的缓存后端"""
+
+    def __init__(self, client=None, url=None, prefix='growth:', default_timeout=86400):
+        if client is None:
+            import redis  # 可选依赖
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self.default_timeout = default_timeout
+
+    def get(self, key):
+        try:
+            data = self.client.get(self.prefix + key)
+        except Exception as e:  # 连接错误等，按未命中处理
+            logger.warning('Redis缓存读取失败: %s', e)
+            return None
+        return pickle.loads(data) if data is not None else None
+
+    def set(self, key, value, timeout=None):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        try:
+            self.client.set(self.prefix + key, data, ex=timeout or self.default_timeout)
+        except Exception as e:
+            logger.warning('Redis缓存写入失败: %s', e)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        self.clear_prefix('')
+
+    def clear_prefix(self, prefix):
+        keys = list(self.client.scan_iter(self.prefix + prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+class NamespacedCache(CacheBackend):
+    """为键加上名称前缀，使多个缓存可以共用一个后端"""
+
+    def __init__(self, backend, namespace):
+        self.backend = backend
+        self.namespace = namespace + ':'
+
+    def get(self, key):
+        return self.backend.get(self.namespace + key)
+
+    def set(self, key, value, timeout=None):
+        self.backend.set(self.namespace + key, value, timeout)
+
+    def delete(self, key):
+        self.backend.delete(self.namespace + key)
+
+    def clear(self):
+        self.backend.clear_prefix(self.namespace)
+
+    def clear_prefix(self, prefix):
+        self.backend.clear_prefix(self.namespace + prefix)
+
+
+def create_cache(url, max_entries=1024, max_bytes=16 * 1024 * 1024):
+    """根据URL创建缓存后端，Redis不可用时退回进程内缓存"""
+    url = url or 'memory://'
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        try:
+            return RedisCache(url=url)
+        except ImportError:
+            logger.warning('未安装redis包，缓存退回进程内LRU（pip install redis）')
+    elif url.startswith('sqlite:///'):
+        return SQLiteCache(url[len('sqlite:///'):], max_entries=max_entries * 10)
+    elif not url.startswith('memory://'):
+        logger.warning('不支持的缓存地址 %s，使用进程内LRU缓存', url)
+    return MemoryCache(max_entries=max_entries, max_bytes=max_bytes)
+
+
+class CacheRegistry:
+    """按名称提供缓存，相同地址的缓存共用一个后端"""
+
+    def __init__(self, app=None):
+        self.config = {}
+        self._backends = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CACHE_URL', os.environ.get('CACHE_URL', 'memory://'))
+        app.config.setdefault('CACHE_MAX_ENTRIES', int(os.environ.get('CACHE_MAX_ENTRIES', 1024)))
+        app.config.setdefault('CACHE_MAX_BYTES', int(os.environ.get('CACHE_MAX_BYTES', 16 * 1024 * 1024)))
+        self.config = app.config
+        app.extensions['caches'] = self
+
+    def url_for(self, name):
+        key = f'{name.upper()}_CACHE_URL'
+        return self.config.get(key) or os.environ.get(key) or self.config.get('CACHE_URL', 'memory://')
+
+    def get(self, name):
+        url = self.url_for(name)
+        with self._lock:
+            backend = self._backends.get(url)
+            if backend is None:
+                backend = create_cache(
+                    url,
+                    max_entries=self.config.get('CACHE_MAX_ENTRIES', 1024),
+                    max_bytes=self.config.get('CACHE_MAX_BYTES', 16 * 1024 * 1024)
+                )
+                self._backends[url] = backend
+        return NamespacedCache(backend, name)
+
+
+caches = CacheRegistry()
@@ -0,0 +1,32 @@
+"""
+目录数据缓存
+
+奖励、勋章等由家长维护、很少变化的目录数据保存在共享缓存（caches.get('catalog')）中，
+缓存键包含代码版本、分片和全局数据版本号，任何目录数据写入或部署新版本后自动失效
+（共享缓存在重启后仍然保留，旧代码序列化的ORM对象不能用新的模型定义读取）。
+返回的是脱离会话的ORM对象（序列化副本），只用于页面展示，修改数据时请直接查询数据库。
+"""
+from flask import current_app, g
+
+from app.cache import caches
+from app.models import Reward
+from app.versioning import GLOBAL_SCOPE, get_versions, template_fingerprint
+
+
+def _cached(name, loader):
+    version = get_versions([GLOBAL_SCOPE])[GLOBAL_SCOPE]
+    key = '{}:{}:{}:{}'.format(
+        template_fingerprint(current_app._get_current_object()), g.get('shard_key', ''), version, name
+    )
+    cache = caches.get('catalog')
+    value = cache.get(key)
+    if value is None:
+        value = loader()
+        cache.set(key, value)
+    return value
+
+
+def active_rewards():
+    """所有激活的奖励"""
+    return _cached('active_rewards', lambda: Reward.query.filter_by(is_active=True).order_by(Reward.id).all())
+
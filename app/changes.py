@@ -0,0 +1,219 @@
+"""
+变更记录（增量同步）
+
+任务记录、兑换记录、获得的勋章、连续记录、学习进度的新增、修改和删除，以及孩子积分的变化，
+在写入的同一事务中向 change_log 追加一行（家庭、孩子、实体、ID、操作），不保存数据本身。
+客户端记住上次同步到的游标（change_log.id），之后只读取游标之后的变更（/api/v1/changes）：
+同一行的多次变更合并为一次，最后一次为删除时返回删除，否则返回该行的当前值。
+
+完成次数（app/counters.py）由SQL更新到TaskStreak上，因此任务记录变化时同时记录对应的连续记录。
+不经过flush的批量写入需要调用 capture（例如 badge_rules.backfill）。
+Query.delete() 的批量删除不产生变更记录：删除孩子时只记录孩子本身的删除，客户端应同时丢弃该孩子的全部数据。
+
+PostgreSQL按插入顺序分配ID，但事务可能以不同的顺序提交，读取方可能先看到较大的ID而跳过之后才提交的较小ID。
+因此写入变更记录前先获取该家庭的事务级咨询锁，同一家庭的写入按顺序提交；SQLite的写入本来就是串行的。
+"""
+import hashlib
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import event, func, inspect, select, text, tuple_
+
+from app.models import ChangeLog, Child, ChildBadge, LearningProgress, RewardRecord, TaskRecord, TaskStreak
+from app.sharding import ShardedSession
+
+# 记录变更的模型及实体名称（与/api/v1的资源名称一致）
+ENTITIES = {
+    TaskRecord: 'records',
+    RewardRecord: 'redemptions',
+    ChildBadge: 'badges',
+    TaskStreak: 'streaks',
+    LearningProgress: 'learning_progress',
+    Child: 'children',
+}
+
+# 各数据库引擎是否已有change_log表（未运行init_db升级时不影响写入）
+_table_checked = {}
+
+# 一条变更：实体、行ID、孩子ID、操作（'upsert' 或 'delete'）
+Change = namedtuple('Change', 'entity entity_id child_id op')
+# 合并后的变更：{实体: 需要返回当前值的ID列表}、{实体: 已删除的ID列表}、读到的最后一条变更ID、之后是否还有变更
+Delta = namedtuple('Delta', 'upserts deletes last_id has_more')
+
+
+def _child_id(obj):
+    return obj.id if isinstance(obj, Child) else obj.child_id
+
+
+def _changed(session, obj):
+    # 孩子只记录积分的变化
+    if isinstance(obj, Child):
+        return inspect(obj).attrs.points.history.has_changes()
+    return session.is_modified(obj)
+
+
+def _pending(session):
+    # 变更列表、已知的 孩子ID -> 家庭ID、受影响的 (孩子, 任务)（对应的连续记录）
+    return session.info.setdefault('change_log', ([], {}, set()))
+
+
+@event.listens_for(ShardedSession, 'before_flush')
+def _collect_changes(session, flush_context, instances):
+    # 修改和删除的对象在flush前读取（删除后无法再加载过期的属性）
+    changes, families, pairs = _pending(session)
+    deleted_children = set()
+    for op, objects in (('upsert', session.dirty), ('delete', session.deleted)):
+        for obj in objects:
+            entity = ENTITIES.get(type(obj))
+            if entity is None or (op == 'upsert' and not _changed(session, obj)):
+                continue
+            changes.append(Change(entity, obj.id, _child_id(obj), op))
+            if isinstance(obj, TaskRecord):
+                pairs.add((obj.child_id, obj.task_id))
+            if isinstance(obj, Child):
+                families[obj.id] = obj.user_id
+            elif op == 'delete':
+                deleted_children.add(obj.child_id)
+
+    # 孩子可能在同一次flush中被删除，先读取家庭
+    deleted_children -= set(families)
+    if deleted_children:
+        with session.no_autoflush:
+            families.update(session.execute(
+                select(Child.id, Child.user_id).where(Child.id.in_(deleted_children))
+            ).all())
+
+
+@event.listens_for(ShardedSession, 'after_flush')
+def _collect_new(session, flush_context):
+    # 新对象在flush后才有ID
+    changes, families, pairs = _pending(session)
+    for obj in session.new:
+        entity = ENTITIES.get(type(obj))
+        if entity is None:
+            continue
+        changes.append(Change(entity, obj.id, _child_id(obj), 'upsert'))
+        if isinstance(obj, TaskRecord):
+            pairs.add((obj.child_id, obj.task_id))
+        elif isinstance(obj, Child):
+            families[obj.id] = obj.user_id
+
+
+@event.listens_for(ShardedSession, 'after_flush_postexec')
+def _on_after_flush(session, flush_context):
+    changes, families, pairs = session.info.pop('change_log', ([], {}, set()))
+    if not changes:
+        return
+    conn = session.connection(bind_arguments={'mapper': ChangeLog})
+    if not _has_change_table(conn):
+        return
+    if pairs:
+        rows = conn.execute(
+            select(TaskStreak.id, TaskStreak.child_id).where(
+                tuple_(TaskStreak.child_id, TaskStreak.task_id).in_(sorted(pairs))
+            )
+        ).all()
+        changes.extend(Change('streaks', row.id, row.child_id, 'upsert') for row in rows)
+    capture(conn, changes, families)
+
+
+@event.listens_for(ShardedSession, 'after_soft_rollback')
+def _discard_pending(session, previous_transaction):
+    # flush失败回滚后，未写入的变更不能带入同一会话的下一次flush
+    session.info.pop('change_log', None)
+
+
+def _has_change_table(conn):
+    key = conn.engine.url
+    if key not in _table_checked:
+        _table_checked[key] = inspect(conn).has_table(ChangeLog.__tablename__)
+    return _table_checked[key]
+
+
+def available(session):
+    """当前数据库是否已有change_log表"""
+    return _has_change_table(session.connection(bind_arguments={'mapper': ChangeLog}))
+
+
+def _lock_id(family_id):
+    return int(hashlib.sha1(f'change_log:{family_id}'.encode('utf-8')).hexdigest()[:15], 16)
+
+
+def capture(conn, changes, families=None):
+    """
+    在调用方的事务中写入变更记录
+
+    Args:
+        changes: Change列表（同一行的重复变更只保留最后一条）
+        families: 已知的 {孩子ID: 家庭ID}，其余的按孩子查询
+
+    Returns:
+        写入的行数
+    """
+    if not _has_change_table(conn):
+        return 0
+    latest = {}
+    for change in changes:
+        latest.pop((change.entity, change.entity_id), None)
+        latest[(change.entity, change.entity_id)] = change
+    if not latest:
+        return 0
+
+    families = dict(families or {})
+    missing = {change.child_id for change in latest.values()} - set(families)
+    if missing:
+        families.update(conn.execute(select(Child.id, Child.user_id).where(Child.id.in_(missing))).all())
+
+    now = datetime.utcnow()
+    values = [
+        {'family_id': families[change.child_id], 'child_id': change.child_id, 'entity': change.entity,
+         'entity_id': change.entity_id, 'op': change.op, 'changed_at': now}
+        for change in latest.values() if families.get(change.child_id) is not None
+    ]
+    if not values:
+        return 0
+    if conn.dialect.name == 'postgresql':
+        # 同一家庭的写入事务按获得锁的顺序提交，读取方不会跳过较小的ID
+        for family_id in sorted({row['family_id'] for row in values}):
+            conn.execute(text('SELECT pg_advisory_xact_lock(:id)'), {'id': _lock_id(family_id)})
+    conn.execute(ChangeLog.__table__.insert(), values)
+    return len(values)
+
+
+def head(session, family_id, child_id=None):
+    """家庭（或孩子）最新一条变更的ID，没有变更时为0"""
+    query = select(func.max(ChangeLog.id)).where(ChangeLog.family_id == family_id)
+    if child_id is not None:
+        query = query.where(ChangeLog.child_id == child_id)
+    return session.execute(query).scalar() or 0
+
+
+def read(session, family_id, since, child_id=None, limit=500):
+    """
+    读取游标之后的变更并按行合并
+
+    Args:
+        since: 上次同步到的变更ID
+        child_id: 只读取该孩子的变更（孩子登录时）
+        limit: 最多读取的变更条数（合并前）
+
+    Returns:
+        Delta
+    """
+    query = select(ChangeLog.id, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op).where(
+        ChangeLog.family_id == family_id, ChangeLog.id > since
+    )
+    if child_id is not None:
+        query = query.where(ChangeLog.child_id == child_id)
+    rows = session.execute(query.order_by(ChangeLog.id).limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    latest = {}
+    for row in rows:
+        latest[(row.entity, row.entity_id)] = row.op
+    upserts, deletes = {}, {}
+    for (entity, entity_id), op in latest.items():
+        target = upserts if op == 'upsert' else deletes
+        target.setdefault(entity, []).append(entity_id)
+    return Delta(upserts, deletes, rows[-1].id if rows else since, has_more)
@@ -0,0 +1,99 @@
+"""
+响应压缩
+
+对HTML、JSON等文本响应按客户端的Accept-Encoding进行Brotli或gzip压缩，
+小于阈值的响应和已压缩的响应（如预压缩的静态文件）不处理。
+Brotli需要安装可选依赖 brotli（pip install Brotli），未安装时只使用gzip。
+
+配置（环境变量）：
+    COMPRESS_ENABLED     是否启用，默认true（由nginx等反向代理压缩时可关闭）
+    COMPRESS_MIN_SIZE    最小压缩字节数，默认500
+    COMPRESS_LEVEL       gzip压缩级别，默认6
+    COMPRESS_BR_QUALITY  Brotli压缩质量，默认5（动态响应不宜使用最高质量）
+"""
+import gzip
+import os
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # 可选依赖
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = frozenset([
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/xml',
+    'text/javascript',
+    'application/javascript',
+    'application/json',
+    'image/svg+xml'
+])
+
+
+class Compress:
+    """在after_request中压缩响应体"""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_ENABLED', os.environ.get('COMPRESS_ENABLED', 'true').lower() == 'true')
+        app.config.setdefault('COMPRESS_MIN_SIZE', int(os.environ.get('COMPRESS_MIN_SIZE', 500)))
+        app.config.setdefault('COMPRESS_LEVEL', int(os.environ.get('COMPRESS_LEVEL', 6)))
+        app.config.setdefault('COMPRESS_BR_QUALITY', int(os.environ.get('COMPRESS_BR_QUALITY', 5)))
+        if app.config['COMPRESS_ENABLED']:
+            app.after_request(self.after_request)
+        app.extensions['compress'] = self
+
+    @staticmethod
+    def choose_encoding():
+        accepted = request.accept_encodings
+        if brotli is not None and accepted['br']:
+            return 'br'
+        if accepted['gzip']:
+            return 'gzip'
+        return None
+
+    def after_request(self, response):
+        config = current_app.config
+
+        if (response.status_code < 200 or response.status_code >= 300
+                or response.status_code == 204
+                or response.direct_passthrough
+                or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+
+        # 响应内容与Accept-Encoding有关，缓存需区分
+        response.vary.add('Accept-Encoding')
+
+        encoding = self.choose_encoding()
+        if encoding is None:
+            return response
+
+        body = response.get_data()
+        if len(body) < config['COMPRESS_MIN_SIZE']:
+            return response
+
+        if encoding == 'br':
+            compressed = brotli.compress(body, quality=config['COMPRESS_BR_QUALITY'])
+        else:
+            compressed = gzip.compress(body, compresslevel=config['COMPRESS_LEVEL'], mtime=0)
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        response.headers['Content-Length'] = str(len(compressed))
+
+        # 不同编码的表示需要不同的强ETag
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f'{etag}-{encoding}', weak=weak)
+        return response
+
+
+compress = Compress()
@@ -0,0 +1,226 @@
+"""
+完成次数计数
+
+TaskStreak.total_completions 保存每个 (孩子, 任务) 已确认的完成次数，
+TaskCompletionMonth 保存按月的完成次数。完成次数勋章和“已完成N次”之类的显示
+直接读取计数，不再对TaskRecord执行COUNT。
+
+计数在任务记录写入的同一事务中以增量方式维护（count = count + n，并发写入也不会丢失）：
+确认、新增已确认记录、删除、修改任务或日期、取消确认都会产生相应的增减。
+新建TaskStreak时按已有记录统计一次初始值。
+reconcile_completion_counts.py 检查计数与TaskRecord是否一致（--fix 修正）。
+"""
+from collections import Counter
+
+from sqlalchemy import event, func, inspect, select, update
+
+from app import db
+from app.models import TaskCompletionMonth, TaskRecord, TaskStreak
+from app.sharding import ShardedSession
+
+# 各数据库引擎是否已有task_completion_month表（未运行升级脚本时只维护总数）
+_table_checked = {}
+
+
+def month_key(value):
+    return value.strftime('%Y-%m')
+
+
+def _state(record, when):
+    """任务记录修改前（'old'）或修改后（'new'）的 (孩子, 任务, 月份)，未确认时返回None"""
+    state = inspect(record)
+    values = []
+    for name in ('child_id', 'task_id', 'completed_at', 'is_confirmed'):
+        history = state.attrs[name].history
+        if when == 'old' and history.deleted:
+            value = history.deleted[0]
+        elif when == 'new' and history.added:
+            value = history.added[0]
+        elif history.unchanged:
+            value = history.unchanged[0]
+        else:
+            value = getattr(record, name)
+        values.append(value)
+    child_id, task_id, completed_at, confirmed = values
+    if not confirmed or child_id is None or task_id is None or completed_at is None:
+        return None
+    return child_id, task_id, month_key(completed_at)
+
+
+@event.listens_for(ShardedSession, 'before_flush')
+def _collect_changes(session, flush_context, instances):
+    # 修改和删除的记录在flush前读取修改前的值
+    deltas = session.info.setdefault('completion_deltas', Counter())
+    for obj in session.dirty:
+        if isinstance(obj, TaskRecord):
+            old, new = _state(obj, 'old'), _state(obj, 'new')
+            if old != new:
+                if old:
+                    deltas[old] -= 1
+                if new:
+                    deltas[new] += 1
+    for obj in session.deleted:
+        if isinstance(obj, TaskRecord):
+            old = _state(obj, 'old')
+            if old:
+                deltas[old] -= 1
+
+
+def _has_month_table(conn):
+    key = conn.engine.url
+    if key not in _table_checked:
+        _table_checked[key] = inspect(conn).has_table(TaskCompletionMonth.__tablename__)
+    return _table_checked[key]
+
+
+def _count_query(child_id, task_id):
+    return select(func.count(TaskRecord.id)).where(
+        TaskRecord.child_id == child_id,
+        TaskRecord.task_id == task_id,
+        TaskRecord.is_confirmed == True
+    ).scalar_subquery()
+
+
+def _add_months(conn, month_deltas):
+    table = TaskCompletionMonth.__table__
+    dialect = conn.dialect.name
+    for (child_id, task_id, month), delta in sorted(month_deltas.items()):
+        values = {'child_id': child_id, 'task_id': task_id, 'month': month, 'count': delta}
+        if dialect in ('sqlite', 'postgresql'):
+            if dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+            else:
+                from sqlalchemy.dialects.postgresql import insert
+            stmt = insert(table).values(**values)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.child_id, table.c.task_id, table.c.month],
+                set_={'count': table.c.count + delta}
+            )
+            conn.execute(stmt)
+            continue
+
+        result = conn.execute(
+            update(table).where(
+                table.c.child_id == child_id, table.c.task_id == task_id, table.c.month == month
+            ).values(count=table.c.count + delta)
+        )
+        if result.rowcount == 0:
+            conn.execute(table.insert().values(**values))
+
+
+@event.listens_for(ShardedSession, 'after_flush')
+def _on_after_flush(session, flush_context):
+    deltas = session.info.pop('completion_deltas', Counter())
+    # 新记录在flush后才有默认的完成时间
+    for obj in session.new:
+        if isinstance(obj, TaskRecord):
+            new = _state(obj, 'new')
+            if new:
+                deltas[new] += 1
+    new_streaks = {(obj.child_id, obj.task_id) for obj in session.new if isinstance(obj, TaskStreak)}
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas and not new_streaks:
+        return
+
+    conn = session.connection(bind_arguments={'mapper': TaskStreak})
+    streaks = TaskStreak.__table__
+
+    # 新建的连续记录按已有记录统计初始值（已包含本次flush写入的记录）
+    for child_id, task_id in new_streaks:
+        conn.execute(
+            update(streaks).where(
+                streaks.c.child_id == child_id, streaks.c.task_id == task_id
+            ).values(total_completions=_count_query(child_id, task_id))
+        )
+
+    totals = Counter()
+    for (child_id, task_id, _), delta in deltas.items():
+        if (child_id, task_id) not in new_streaks:
+            totals[(child_id, task_id)] += delta
+    for (child_id, task_id), delta in sorted(totals.items()):
+        if delta:
+            conn.execute(
+                update(streaks).where(
+                    streaks.c.child_id == child_id, streaks.c.task_id == task_id
+                ).values(total_completions=streaks.c.total_completions + delta)
+            )
+
+    if deltas and _has_month_table(conn):
+        _add_months(conn, deltas)
+
+    session.info['completion_changed'] = new_streaks | set(totals)
+
+
+@event.listens_for(ShardedSession, 'after_flush_postexec')
+def _expire_counts(session, flush_context):
+    # 计数由SQL更新，会话中已加载的TaskStreak需要重新读取
+    changed = session.info.pop('completion_changed', None)
+    if not changed:
+        return
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, TaskStreak) and (obj.child_id, obj.task_id) in changed:
+            session.expire(obj, ['total_completions'])
+
+
+@event.listens_for(ShardedSession, 'after_soft_rollback')
+def _discard_pending(session, previous_transaction):
+    # flush失败回滚后，未写入的增量不能带入同一会话的下一次flush
+    session.info.pop('completion_deltas', None)
+    session.info.pop('completion_changed', None)
+
+
+def monthly_counts(child_id, task_id=None):
+    """按月的完成次数 {(任务ID, 'YYYY-MM'): 次数}"""
+    query = db.session.query(
+        TaskCompletionMonth.task_id, TaskCompletionMonth.month, TaskCompletionMonth.count
+    ).filter(TaskCompletionMonth.child_id == child_id)
+    if task_id is not None:
+        query = query.filter(TaskCompletionMonth.task_id == task_id)
+    return {(row.task_id, row.month): row.count for row in query.all()}
+
+
+def reconcile(conn, fix=False):
+    """
+    根据TaskRecord核对完成次数
+
+    Returns:
+        不一致的列表 [(类型, 键, 记录的值, 实际值), ...]，类型为'total'或'month'
+    """
+    records = conn.execute(
+        select(TaskRecord.child_id, TaskRecord.task_id, TaskRecord.completed_at).where(
+            TaskRecord.is_confirmed == True
+        )
+    ).all()
+    actual_totals = Counter((row.child_id, row.task_id) for row in records)
+    actual_months = Counter(
+        (row.child_id, row.task_id, month_key(row.completed_at)) for row in records if row.completed_at
+    )
+
+    mismatches = []
+    streaks = TaskStreak.__table__
+    for row in conn.execute(select(streaks.c.id, streaks.c.child_id, streaks.c.task_id,
+                                   streaks.c.total_completions)).all():
+        key = (row.child_id, row.task_id)
+        actual = actual_totals.get(key, 0)
+        if row.total_completions != actual:
+            mismatches.append(('total', key, row.total_completions, actual))
+            if fix:
+                conn.execute(update(streaks).where(streaks.c.id == row.id).values(total_completions=actual))
+
+    months = TaskCompletionMonth.__table__
+    stored = {
+        (row.child_id, row.task_id, row.month): row.count
+        for row in conn.execute(select(months.c.child_id, months.c.task_id, months.c.month, months.c.count))
+    }
+    for key in sorted(set(stored) | set(actual_months)):
+        recorded, actual = stored.get(key), actual_months.get(key, 0)
+        if (recorded or 0) != actual:
+            mismatches.append(('month', key, recorded, actual))
+    if fix and any(kind == 'month' for kind, _, _, _ in mismatches):
+        conn.execute(months.delete())
+        if actual_months:
+            conn.execute(months.insert(), [
+                {'child_id': child_id, 'task_id': task_id, 'month': month, 'count': count}
+                for (child_id, task_id, month), count in actual_months.items()
+            ])
+    return mismatches
@@ -0,0 +1,88 @@
+"""
+模板片段缓存
+
+在模板中使用：
+    {% cache 'honor_badges', child.id %} ... {% endcache %}
+    {% cache 'reward_grid', child.id, points %} ... {% endcache %}
+
+缓存键由片段名称、孩子ID、附加参数以及该孩子和全局数据的当前版本号组成，
+数据写入后版本号递增，旧片段不再命中并由LRU淘汰，无需手动清除。
+片段内部用到的数据应当延迟加载（见LazyList），命中缓存时不执行查询。
+
+缓存后端由 app/cache.py 的 caches.get('fragment') 提供（CACHE_URL 或 FRAGMENT_CACHE_URL）。
+"""
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+from app.cache import caches
+
+
+class LazyList:
+    """首次使用时才执行加载函数的列表，用于只在片段缓存未命中时查询数据"""
+
+    def __init__(self, loader):
+        self._loader = loader
+        self._items = None
+
+    @property
+    def items(self):
+        if self._items is None:
+            self._items = list(self._loader())
+        return self._items
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+
+class FragmentCacheExtension(Extension):
+    """{% cache 名称, 孩子ID[, 附加参数...] %}...{% endcache %}"""
+
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render_fragment', [nodes.List(args)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render_fragment(self, args, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+
+        from app.versioning import child_scope, version_key
+        name, child_id, extra = args[0], args[1], args[2:]
+        versions = version_key(child_scope(child_id))
+        key = 'fragment:{}:{}:{}:{}'.format(
+            name, child_id, ':'.join(str(value) for value in extra), versions
+        )
+
+        html = cache.get(key)
+        if html is None:
+            html = str(caller())
+            cache.set(key, html)
+        return Markup(html)
+
+
+def init_fragment_cache(app):
+    """为模板环境注册cache标签并设置缓存后端"""
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.jinja_env.fragment_cache = caches.get('fragment')
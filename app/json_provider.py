@@ -0,0 +1,158 @@
+"""
+JSON序列化
+
+应用的JSON提供者（app.json）：安装了orjson时用orjson编码和解码（pip install orjson），
+否则使用标准库json。两种实现的输出一致：
+- datetime/date/time 输出ISO 8601字符串（与isoformat()相同），视图中不必逐行转换
+- Decimal 输出为数字
+- SQLAlchemy 查询结果行（Row）输出为以列名为键的对象，命名元组输出为数组
+- 对象的键按字母排序
+
+jsonify、模板中的 tojson 以及下面的 json_stream 都使用这里的编码。
+较大的数组用 json_stream 分块编码并流式返回，不必先在内存中拼出完整的响应体。
+设置环境变量 JSON_USE_ORJSON=false 可以强制使用标准库。
+"""
+import dataclasses
+import decimal
+import os
+import uuid
+from datetime import date, datetime, time
+
+from flask import current_app, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # 可选依赖
+    orjson = None
+
+
+def _default(obj):
+    """两种编码器都无法直接处理的类型"""
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    mapping = getattr(obj, '_mapping', None)
+    if mapping is not None:
+        # SQLAlchemy的Row
+        return dict(mapping)
+    if isinstance(obj, tuple):
+        # orjson不直接编码元组的子类（命名元组），与标准库一样输出为数组
+        return list(obj)
+    if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+        return dataclasses.asdict(obj)
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+class JSONProvider(DefaultJSONProvider):
+    """使用orjson（如已安装）的JSON提供者，接口与Flask默认的提供者相同"""
+
+    default = staticmethod(_default)
+
+    def __init__(self, app, use_orjson=True):
+        super().__init__(app)
+        self.use_orjson = use_orjson and orjson is not None
+
+    def _orjson_option(self, kwargs):
+        """把json.dumps的参数换算为orjson选项，无法换算时返回None（使用标准库）"""
+        if not self.use_orjson:
+            return None
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        for name, value in kwargs.items():
+            if name == 'indent':
+                if value not in (None, 2):
+                    return None
+                if value == 2:
+                    option |= orjson.OPT_INDENT_2
+            elif name == 'sort_keys':
+                if value:
+                    option |= orjson.OPT_SORT_KEYS
+            elif name not in ('separators', 'ensure_ascii'):
+                return None
+        if 'sort_keys' not in kwargs and self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return option
+
+    def dumps_bytes(self, obj, **kwargs):
+        """编码为UTF-8字节串"""
+        option = self._orjson_option(kwargs)
+        if option is not None:
+            try:
+                return orjson.dumps(obj, default=_default, option=option)
+            except orjson.JSONEncodeError:
+                # 例如超过64位的整数，交给标准库处理（无法编码的对象同样会抛出TypeError）
+                pass
+        return super().dumps(obj, **kwargs).encode('utf-8')
+
+    def dumps(self, obj, **kwargs):
+        if self._orjson_option(kwargs) is None:
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj, **kwargs).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if self.use_orjson and not kwargs:
+            return orjson.loads(s)
+        return super().loads(s, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if not self.use_orjson:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = 2 if (self.compact is None and self._app.debug) or self.compact is False else None
+        return self._app.response_class(self.dumps_bytes(obj, indent=indent) + b'\n', mimetype=self.mimetype)
+
+
+def init_json(app):
+    """安装JSON提供者（需在首次使用jinja_env之前调用，模板的tojson才会使用它）"""
+    app.config.setdefault('JSON_USE_ORJSON', os.environ.get('JSON_USE_ORJSON', 'true').lower() == 'true')
+    app.json = JSONProvider(app, use_orjson=app.config['JSON_USE_ORJSON'])
+
+
+def _encode(obj):
+    provider = current_app.json
+    if isinstance(provider, JSONProvider):
+        return provider.dumps_bytes(obj)
+    return provider.dumps(obj).encode('utf-8')
+
+
+def stream_array(items, chunk_size=500):
+    """把可迭代对象编码为JSON数组，每chunk_size个元素生成一个字节块"""
+    yield b'['
+    first = True
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield (b'' if first else b',') + _encode(chunk)[1:-1]
+            first = False
+            chunk = []
+    if chunk:
+        yield (b'' if first else b',') + _encode(chunk)[1:-1]
+    yield b']'
+
+
+def json_stream(items, key=None, chunk_size=500, **fields):
+    """
+    流式返回JSON响应
+
+    Args:
+        items: 数组元素（可以是生成器或查询结果，边编码边发送）
+        key: 为空时响应体为数组，否则为 {key: 数组, **fields} 对象
+        chunk_size: 每次编码的元素个数
+        fields: 对象中的其他字段
+    """
+    def generate():
+        if key is None:
+            yield from stream_array(items, chunk_size)
+            return
+        head = _encode(fields) if fields else b'{}'
+        yield head[:-1] + (b',' if fields else b'') + _encode(key) + b':'
+        yield from stream_array(items, chunk_size)
+        yield b'}'
+
+    return current_app.response_class(stream_with_context(generate()), mimetype='application/json')
@@ -0,0 +1,206 @@
+"""
+日志配置
+
+请求线程只把日志记录放入内存队列（QueueHandler），由后台线程（QueueListener）
+负责格式化和写文件，避免同步文件I/O增加请求延迟。
+支持JSON结构化输出（请求ID、端点、状态码、耗时、SQL条数）以及按logger采样。
+
+环境变量：
+    LOG_LEVEL     日志级别，默认INFO
+    LOG_FORMAT    json（默认）或text
+    LOG_FILE      日志文件路径，默认输出到标准错误
+    LOG_SAMPLING  按logger采样比例，如 "app.access=0.1,sqlalchemy.engine=0.01"
+                  （只对WARNING以下的记录采样，警告和错误始终保留）
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import time
+import uuid
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 请求上下文字段，由RequestContextFilter或extra参数写入日志记录
+CONTEXT_FIELDS = ('request_id', 'endpoint', 'method', 'path', 'status', 'latency_ms', 'sql_count')
+
+# 可以安全地在后台线程中格式化的参数类型（不可变，不依赖请求或数据库会话）
+LAZY_ARG_TYPES = (str, int, float, type(None))
+
+access_logger = logging.getLogger('app.access')
+
+_queue_handler = None
+_listener = None
+_handlers = []
+
+
+class AsyncQueueHandler(QueueHandler):
+    """只负责入队的处理器：同进程队列无需序列化，参数都是基本类型时消息格式化推迟到后台线程"""
+
+    def prepare(self, record):
+        args = record.args
+        if args:
+            values = args.values() if isinstance(args, dict) else args
+            if not all(isinstance(value, LAZY_ARG_TYPES) for value in values):
+                # ORM对象、请求相关对象等必须在当前线程格式化：后台线程中会话可能已关闭，
+                # 会触发DetachedInstanceError、在请求外延迟加载或读到已变化的值
+                record.msg = record.getMessage()
+                record.args = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    """把日志记录格式化为单行JSON"""
+
+    def format(self, record):
+        data = {
+            'ts': datetime.utcfromtimestamp(record.created).isoformat(timespec='milliseconds') + 'Z',
+            'level': record.levelname,
+            'logger': record.name,
+            # 基本类型参数的getMessage()在后台线程中执行，不占用请求线程
+            'message': record.getMessage()
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class RequestContextFilter(logging.Filter):
+    """在请求线程中为日志记录补充请求ID和端点"""
+
+    def filter(self, record):
+        if has_request_context():
+            if getattr(record, 'request_id', None) is None:
+                record.request_id = g.get('request_id')
+            if getattr(record, 'endpoint', None) is None:
+                record.endpoint = request.endpoint
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """按logger名称前缀对低级别日志采样"""
+
+    def __init__(self, rates):
+        super().__init__()
+        # 前缀越长越优先匹配
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        for prefix, rate in self.rates:
+            if record.name == prefix or record.name.startswith(prefix + '.'):
+                return random.random() < rate
+        return True
+
+
+def parse_sampling(spec):
+    """解析 "logger=比例,..." 格式的采样配置"""
+    rates = {}
+    for item in (spec or '').split(','):
+        if '=' not in item:
+            continue
+        name, rate = item.split('=', 1)
+        try:
+            rates[name.strip()] = float(rate)
+        except ValueError:
+            continue
+    return rates
+
+
+def setup_logging():
+    """配置根logger使用队列异步输出（每个进程只配置一次）"""
+    global _queue_handler, _handlers
+
+    if _queue_handler is not None:
+        return
+
+    level_name = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    level = getattr(logging, level_name, None)
+    if not isinstance(level, int):
+        level = logging.INFO
+
+    log_file = os.environ.get('LOG_FILE')
+    handler = logging.FileHandler(log_file, encoding='utf-8') if log_file else logging.StreamHandler()
+    if os.environ.get('LOG_FORMAT', 'json').lower() == 'text':
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    else:
+        handler.setFormatter(JsonFormatter())
+    _handlers = [handler]
+
+    _queue_handler = AsyncQueueHandler(queue.SimpleQueue())
+    _queue_handler.addFilter(RequestContextFilter())
+    rates = parse_sampling(os.environ.get('LOG_SAMPLING'))
+    if rates:
+        _queue_handler.addFilter(SamplingFilter(rates))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(_queue_handler)
+    root.setLevel(level)
+
+    _start_listener()
+    # 进程退出前写出队列中剩余的日志
+    atexit.register(stop_logging)
+    if hasattr(os, 'register_at_fork'):
+        # fork出的worker中没有监听线程，需要用新队列重新启动
+        os.register_at_fork(after_in_child=_start_listener)
+
+
+def _start_listener():
+    global _listener
+    # 使用新队列，避免fork前其他线程持有的队列锁
+    _queue_handler.queue = queue.SimpleQueue()
+    _listener = QueueListener(_queue_handler.queue, *_handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    """停止后台线程并写出队列中剩余的日志"""
+    if _listener is not None:
+        _listener.stop()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_sql(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.sql_count = g.get('sql_count', 0) + 1
+
+
+def init_request_logging(app):
+    """为每个请求记录一条结构化访问日志"""
+
+    @app.before_request
+    def start_request_timer():
+        g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex[:16]
+        g.request_started = time.perf_counter()
+        g.sql_count = 0
+
+    @app.after_request
+    def log_request(response):
+        started = g.get('request_started')
+        if started is None:
+            return response
+        access_logger.info(
+            '%s %s %s', request.method, request.path, response.status_code,
+            extra={
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'latency_ms': round((time.perf_counter() - started) * 1000, 2),
+                'sql_count': g.get('sql_count', 0)
+            }
+        )
+        response.headers.setdefault('X-Request-ID', g.request_id)
+        return response
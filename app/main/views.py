@@ -1,18 +1,28 @@
+import logging
 from flask import render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
-from app import db
-from app.models import User, Child, Task, Reward, TaskRecord, RewardRecord, Badge, ChildBadge, TaskStreak, TaskCategory, LearningCategory, LearningResource, LearningProgress
+from app import db, shard_router
+from app.models import User, Child, Task, Reward, TaskRecord, RewardRecord, Badge, ChildBadge, ChildBadgeProgress, TaskStreak, TaskCategory, LearningCategory, LearningResource, LearningProgress
 from datetime import datetime
+from functools import cached_property
+from sqlalchemy.exc import IntegrityError
 from app.main import main
+from app.sql_compat import day_bounds
+from app.versioning import conditional_get, user_scopes, child_scope, get_versions, visible_child_scopes
+from app.fragment_cache import LazyList
+from app.json_provider import json_stream
+from app import catalog
+from app.analytics.engine import recompute_streak
+from app import badge_progress, badge_rules, bitmaps, counters, read_models
+
+logger = logging.getLogger(__name__)
 
 # 登录路由
 @main.route('/login', methods=['GET', 'POST'])
 def login():
     try:
-        print('登录路由被访问')
         if current_user.is_authenticated:
-            print('用户已认证，重定向到仪表盘')
             # 根据用户类型决定重定向目标
             if hasattr(current_user, 'children'):  # 家长用户
                 return redirect(url_for('main.dashboard'))
@@ -22,30 +32,33 @@ def login():
         if request.method == 'POST':
             username = request.form['username']
             password = request.form['password']
-            print(f'接收到登录请求，用户名: {username}')
+            logger.debug('接收到登录请求，用户名: %s', username)
+            
+            # 分片模式下根据目录绑定该用户所在的家庭分片
+            shard_router.activate_for_username(username)
             
             # 先尝试查找家长用户
             user = User.query.filter_by(username=username).first()
             if user and check_password_hash(user.password, password):
                 login_user(user)
-                print('家长登录成功，重定向到仪表盘')
+                shard_router.remember()
+                logger.info('家长登录成功: %s', username)
                 return redirect(url_for('main.dashboard'))
             
             # 再尝试查找孩子用户
             child = Child.query.filter_by(username=username).first()
             if child and check_password_hash(child.password, password):
                 login_user(child)
-                print('孩子登录成功，重定向到孩子仪表盘')
+                shard_router.remember()
+                logger.info('孩子登录成功: %s', username)
                 return redirect(url_for('main.child_dashboard'))
             
             flash('用户名或密码错误')
-            print('登录失败：用户名或密码错误')
+            logger.info('登录失败：用户名或密码错误: %s', username)
         
         return render_template('login.html')
     except Exception as e:
-        print(f'登录路由发生异常: {str(e)}')
-        import traceback
-        print(traceback.format_exc())
+        logger.exception('登录路由发生异常: %s', e)
         return f'发生错误: {str(e)}', 500
 
 # 修改密码路由
@@ -88,9 +101,7 @@ def change_password():
         
         return render_template('change_password.html')
     except Exception as e:
-        print(f'修改密码路由发生异常: {str(e)}')
-        import traceback
-        print(traceback.format_exc())
+        logger.exception('修改密码路由发生异常: %s', e)
         flash('修改密码时发生错误', 'error')
         return redirect(url_for('main.change_password'))
 
@@ -99,6 +110,7 @@ def change_password():
 @login_required
 def logout():
     logout_user()
+    shard_router.forget()
     return redirect(url_for('main.login'))
 
 # 仪表盘路由
@@ -114,20 +126,23 @@ def dashboard():
 # 孩子仪表盘路由
 @main.route('/child_dashboard')
 @login_required
+@conditional_get(lambda: None if hasattr(current_user, 'children') else user_scopes())
 def child_dashboard():
     # 确保是孩子用户
     if hasattr(current_user, 'children'):  # 如果是家长用户访问
         return redirect(url_for('main.dashboard'))
     
-    # 获取当前孩子的任务记录和积分
-    task_records = current_user.task_records.filter_by(is_confirmed=True).all()
-    points = current_user.points
+    # 页面中的勋章、任务记录和奖励区块使用片段缓存，数据延迟到缓存未命中时才查询
+    child = current_user._get_current_object()
+    # 页面只显示最近10条已确认记录，按列查询并带出任务名称
+    task_records = LazyList(lambda: read_models.task_records(child.id, confirmed=True, limit=10))
+    points = child.points
     
     # 获取可用奖励（孩子只能查看活跃的奖励）
-    active_rewards = Reward.query.filter_by(is_active=True).all()
+    active_rewards = LazyList(catalog.active_rewards)
     
     # 获取孩子的勋章
-    badges = current_user.badges.all()
+    badges = LazyList(lambda: read_models.earned_badges(child.id))
     
     return render_template('child_dashboard.html', 
                            points=points, 
@@ -160,13 +175,21 @@ def add_child():
         username = request.form['username']
         password = generate_password_hash(request.form['password'])
         # 检查用户名是否已存在
-        if User.query.filter_by(username=username).first() or Child.query.filter_by(username=username).first():
+        if User.query.filter_by(username=username).first() or Child.query.filter_by(username=username).first() \
+                or shard_router.lookup(username):
             flash('用户名已存在')
             return redirect(url_for('main.add_child'))
         
         child = Child(name=name, age=age, user_id=current_user.id, username=username, password=password)
         db.session.add(child)
-        db.session.commit()
+        # 目录登记与孩子一起提交（其他分片同时注册了该用户名时整体回滚）
+        shard_router.register(username, 2)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('用户名已存在')
+            return redirect(url_for('main.add_child'))
         flash('孩子添加成功')
         return redirect(url_for('main.list_children'))
     return render_template('add_child.html')
@@ -197,12 +220,19 @@ def edit_child(child_id):
         # 如果更新用户名，需要检查唯一性
         if 'username' in request.form and request.form['username'] != child.username:
             new_username = request.form['username']
-            if User.query.filter_by(username=new_username).first() or Child.query.filter_by(username=new_username).first():
+            if User.query.filter_by(username=new_username).first() or Child.query.filter_by(username=new_username).first() \
+                    or shard_router.lookup(new_username):
                 flash('用户名已存在')
                 return redirect(url_for('main.edit_child', child_id=child.id))
+            shard_router.rename(child.username, new_username)
             child.username = new_username
             
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            flash('用户名已存在')
+            return redirect(url_for('main.edit_child', child_id=child.id))
         flash('孩子信息更新成功')
         return redirect(url_for('main.child_detail', child_id=child.id))
     
@@ -225,12 +255,17 @@ def learning_resources():
         if selected_child_id:
             selected_child = Child.query.get(int(selected_child_id))
         elif children:
-            selected_child = children[0]  # 默认选择第一个孩子
+            selected_child = children.first()  # 默认选择第一个孩子
+        # 各分类的学习进度汇总（单次分组查询）
+        overview = LearningProgress.get_category_overview(selected_child.id) if selected_child else {}
         return render_template('learning/index.html', categories=categories, 
-                              children=children, selected_child=selected_child)
+                              children=children, selected_child=selected_child,
+                              overview=overview)
     else:  # 孩子用户
         child = current_user
-        return render_template('learning/index.html', categories=categories, child=child)
+        overview = LearningProgress.get_category_overview(child.id)
+        return render_template('learning/index.html', categories=categories, child=child,
+                              overview=overview)
 
 
 @main.route('/learning/category/<int:category_id>')
@@ -249,10 +284,15 @@ def learning_category(category_id):
     else:  # 孩子用户
         child = current_user
     
-    # 获取孩子的学习进度信息
+    # 获取孩子的学习进度信息（只加载当前分类下资源的进度）
     progress_info = {}
     if child:
-        progress_records = LearningProgress.query.filter_by(child_id=child.id).all()
+        progress_records = LearningProgress.query.join(
+            LearningProgress.resource
+        ).filter(
+            LearningProgress.child_id == child.id,
+            LearningResource.category_id == category_id
+        ).all()
         for record in progress_records:
             progress_info[record.resource_id] = {
                 'progress': record.progress,
@@ -282,23 +322,44 @@ def learning_resource_detail(resource_id):
     # 获取或创建学习进度记录
     progress = None
     if child:
-        progress = LearningProgress.query.filter_by(
-            child_id=child.id,
-            resource_id=resource_id
-        ).first()
-        
-        if not progress and child == current_user:  # 孩子用户可以自动创建进度记录
-            progress = LearningProgress(
+        if child == current_user:  # 孩子用户可以自动创建进度记录
+            progress = _get_or_create_learning_progress(child.id, resource_id)
+        else:
+            progress = LearningProgress.query.filter_by(
                 child_id=child.id,
                 resource_id=resource_id
-            )
-            db.session.add(progress)
-            db.session.commit()
+            ).first()
     
     return render_template('learning/resource.html', resource=resource, 
                           child=child, progress=progress)
 
 
+def _get_or_create_learning_progress(child_id, resource_id):
+    """获取或创建学习进度记录，并发首次访问时依赖唯一索引避免重复记录"""
+    progress = LearningProgress.query.filter_by(
+        child_id=child_id,
+        resource_id=resource_id
+    ).first()
+    if progress:
+        return progress
+    
+    progress = LearningProgress(
+        child_id=child_id,
+        resource_id=resource_id
+    )
+    db.session.add(progress)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # 另一个请求已抢先创建了该记录，回滚后读取已存在的记录
+        db.session.rollback()
+        progress = LearningProgress.query.filter_by(
+            child_id=child_id,
+            resource_id=resource_id
+        ).first()
+    return progress
+
+
 @main.route('/learning/progress/update', methods=['POST'])
 @login_required
 def update_learning_progress():
@@ -312,17 +373,7 @@ def update_learning_progress():
         last_watched_time = int(request.form.get('last_watched_time', 0))
         
         # 获取或创建进度记录
-        record = LearningProgress.query.filter_by(
-            child_id=current_user.id,
-            resource_id=resource_id
-        ).first()
-        
-        if not record:
-            record = LearningProgress(
-                child_id=current_user.id,
-                resource_id=resource_id
-            )
-            db.session.add(record)
+        record = _get_or_create_learning_progress(current_user.id, resource_id)
         
         # 更新进度信息
         record.progress = min(progress, 100.0)  # 限制进度最大为100%
@@ -335,9 +386,13 @@ def update_learning_progress():
             record.is_completed = True
             # 可以在这里添加完成学习资源的积分奖励逻辑
             current_user.points += 10  # 例如完成一个学习资源奖励10积分
+            # 完成学习资源后评估学习类勋章规则
+            new_badges = badge_rules.award(db.session, current_user, learning=True)
+        else:
+            new_badges = []
         
         db.session.commit()
-        return {'success': True}
+        return {'success': True, 'new_badges': [badge.name for badge in new_badges]}
     except Exception as e:
         db.session.rollback()
         return {'success': False, 'message': str(e)}
@@ -354,12 +409,11 @@ def learning_statistics(child_id):
         flash('无权访问此孩子的学习统计')
         return redirect(url_for('main.dashboard'))
     
-    # 获取学习统计数据
-    total_resources = LearningResource.query.filter_by(is_active=True).count()
-    completed_resources = LearningProgress.query.filter_by(
-        child_id=child_id,
-        is_completed=True
-    ).count()
+    # 获取学习统计数据（按分类汇总后合计）
+    overview = LearningProgress.get_category_overview(child_id)
+    total_resources = sum(item['total_resources'] for item in overview.values())
+    completed_resources = sum(item['completed_resources'] for item in overview.values())
+    categories = LearningCategory.query.filter(LearningCategory.id.in_(list(overview.keys()))).all() if overview else []
     
     # 获取最近学习记录
     recent_progress = LearningProgress.query.filter_by(child_id=child_id).order_by(
@@ -372,76 +426,56 @@ def learning_statistics(child_id):
     return render_template('learning/stats.html', child=child,
                           total_resources=total_resources,
                           completed_resources=completed_resources,
-                          recent_progress=recent_progress)
+                          recent_progress=recent_progress,
+                          categories=categories,
+                          overview=overview)
 
 # 删除功能已移至POST方法实现，见文件底部
 
 # 荣誉墙路由
 @main.route('/honor_wall')
 @login_required
+@conditional_get(user_scopes)
 def honor_wall():
     # 检查是否是家长用户
     if hasattr(current_user, 'children'):  # 家长用户
         # 获取当前用户的所有孩子
         children = current_user.children.all()
-        children_with_badges = []
-        
-        for child in children:
-            # 获取孩子获得的所有勋章
-            badges = ChildBadge.query.filter_by(child_id=child.id).all()
-            
-            # 获取孩子的所有任务连续记录
-            streaks = TaskStreak.query.filter_by(child_id=child.id).all()
-            
-            # 计算每个任务距离下一个勋章还需要的天数
-            next_badges = {}
-            for streak in streaks:
-                # 查找该任务的勋章中，天数要求大于当前连续天数且最小的那个
-                next_badge = Badge.query.filter(
-                    Badge.task_id == streak.task_id,
-                    Badge.days_required > streak.current_streak
-                ).order_by(Badge.days_required.asc()).first()
-                
-                if next_badge:
-                    next_badges[streak.task_id] = next_badge
-            
-            children_with_badges.append({
-                'child': child,
-                'badges': badges,
-                'streaks': streaks,
-                'next_badges': next_badges
-            })
-        
+        # 一次读取所有孩子的数据版本号，供片段缓存使用
+        get_versions([child_scope(child.id) for child in children])
+        children_with_badges = [ChildHonors(child) for child in children]
         return render_template('honor_wall.html', children_with_badges=children_with_badges, is_parent=True)
     else:  # 孩子用户
         # 只能查看自己的勋章
-        badges = current_user.badges.all()
-        
-        # 获取自己的所有任务连续记录
-        streaks = TaskStreak.query.filter_by(child_id=current_user.id).all()
-        
-        # 计算每个任务距离下一个勋章还需要的天数
-        next_badges = {}
-        for streak in streaks:
-            # 查找该任务的勋章中，天数要求大于当前连续天数且最小的那个
-            next_badge = Badge.query.filter(
-                Badge.task_id == streak.task_id,
-                Badge.days_required > streak.current_streak
-            ).order_by(Badge.days_required.asc()).first()
-            
-            if next_badge:
-                next_badges[streak.task_id] = next_badge
-        
-        # 创建兼容的结构
-        children_with_badges = [{
-            'child': current_user,
-            'badges': badges,
-            'streaks': streaks,
-            'next_badges': next_badges
-        }]
-        
+        children_with_badges = [ChildHonors(current_user._get_current_object())]
         return render_template('honor_wall.html', children_with_badges=children_with_badges, is_parent=False)
 
+
+class ChildHonors:
+    """荣誉墙中一个孩子的数据，在片段缓存未命中时才查询"""
+
+    def __init__(self, child):
+        self.child = child
+
+    @cached_property
+    def badges(self):
+        # 获取孩子获得的所有勋章
+        return ChildBadge.query.filter_by(child_id=self.child.id).all()
+
+    @cached_property
+    def streaks(self):
+        # 获取孩子的所有任务连续记录
+        return TaskStreak.query.filter_by(child_id=self.child.id).all()
+
+    @cached_property
+    def next_badges(self):
+        # 每个任务的下一个勋章及进度（勋章进度读模型，写入时维护）
+        progress_rows = ChildBadgeProgress.query.filter(
+            ChildBadgeProgress.child_id == self.child.id,
+            ChildBadgeProgress.badge_id.isnot(None)
+        ).all()
+        return {progress.task_id: progress for progress in progress_rows}
+
 # 任务管理路由
 @main.route('/tasks')
 @login_required
@@ -568,11 +602,53 @@ def delete_task(task_id):
 @main.route('/badges')
 @login_required
 def list_badges():
-    badges = Badge.query.join(Task).all()
+    badges = Badge.query.outerjoin(Task, Badge.task_id == Task.id).all()
     # 检查是否是家长用户
     is_parent = hasattr(current_user, 'children')
     return render_template('badges.html', badges=badges, is_parent=is_parent)
 
+def _apply_badge_rule(badge, form):
+    """从表单读取关联任务和勋章规则（规则说明见app/badge_rules.py）"""
+    task_id = form.get('task_id')
+    badge.task_id = int(task_id) if task_id else None
+    rule_type = form.get('rule_type') or None
+    if rule_type and rule_type not in badge_rules.RULE_TYPES:
+        raise ValueError(f'未知的勋章规则: {rule_type}')
+    if badge.task_id is None and (rule_type is None or rule_type in badge_rules.TASK_RULES):
+        raise ValueError('按任务判断的勋章需要选择关联任务')
+    badge.rule_type = rule_type
+    rule_threshold = form.get('rule_threshold', '0')
+    badge.rule_threshold = int(rule_threshold) if rule_threshold else 0
+    rule_period = form.get('rule_period') or 'all'
+    badge.rule_period = rule_period if rule_period in badge_rules.PERIODS else 'all'
+    category_id = form.get('category_id')
+    badge.category_id = int(category_id) if category_id else None
+    learning_category_id = form.get('learning_category_id')
+    badge.learning_category_id = int(learning_category_id) if learning_category_id else None
+
+
+def _backfill_badge(badge):
+    """按新的勋章规则为已满足条件的孩子补发勋章（已获得的不会重复颁发）"""
+    try:
+        for result in badge_rules.backfill(db.session, [badge]):
+            flash(f"已按新规则为 {len(result.child_ids)} 个孩子补发「{result.badge_name}」勋章，"
+                  f"每人奖励 {result.points_reward} 积分")
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.exception('补发勋章失败: %s', e)
+        flash('勋章已保存，但补发勋章时出错，请稍后运行 reevaluate_badges.py')
+
+
+def _badge_form_options():
+    """勋章表单的下拉选项"""
+    return dict(
+        rule_types=badge_rules.RULE_TYPES,
+        periods=badge_rules.PERIODS,
+        categories=TaskCategory.query.order_by(TaskCategory.name).all(),
+        learning_categories=LearningCategory.query.order_by(LearningCategory.name).all()
+    )
+
 @main.route('/badge/add', methods=['GET', 'POST'])
 @login_required
 def add_badge():
@@ -591,8 +667,6 @@ def add_badge():
             icon = request.form.get('icon', '🏆')
             
             # 安全地获取并转换整数字段
-            task_id = int(request.form['task_id'])
-            
             completions_required = request.form.get('completions_required', '0')
             completions_required = int(completions_required) if completions_required else 0
             
@@ -609,15 +683,16 @@ def add_badge():
                 name=name,
                 description=description,
                 icon=icon,
-                task_id=task_id,
                 completions_required=completions_required,
                 days_required=days_required,
                 level=level,
                 points_reward=points_reward
             )
+            _apply_badge_rule(badge, request.form)
             db.session.add(badge)
             db.session.commit()
             flash('徽章添加成功')
+            _backfill_badge(badge)
             return redirect(url_for('main.list_badges'))
         except ValueError as e:
             flash(f'数据格式错误，请确保所有数字字段输入正确: {str(e)}')
@@ -627,7 +702,7 @@ def add_badge():
             flash(f'添加徽章时发生错误: {str(e)}')
             return redirect(url_for('main.add_badge'))
     
-    return render_template('add_badge.html', tasks=tasks)
+    return render_template('add_badge.html', tasks=tasks, **_badge_form_options())
 
 @main.route('/badge/edit/<int:badge_id>', methods=['GET', 'POST'])
 @login_required
@@ -646,7 +721,7 @@ def edit_badge(badge_id):
             badge.name = request.form['name']
             badge.description = request.form.get('description', '')
             badge.icon = request.form.get('icon', '🏆')
-            badge.task_id = int(request.form['task_id'])
+            _apply_badge_rule(badge, request.form)
             
             # 安全地获取并转换整数字段
             completions_required = request.form.get('completions_required', '0')
@@ -662,6 +737,7 @@ def edit_badge(badge_id):
             
             db.session.commit()
             flash('徽章更新成功')
+            _backfill_badge(badge)
             return redirect(url_for('main.list_badges'))
         except ValueError as e:
             flash(f'数据格式错误，请确保所有数字字段输入正确: {str(e)}')
@@ -671,7 +747,7 @@ def edit_badge(badge_id):
             flash(f'更新徽章时发生错误: {str(e)}')
             return redirect(url_for('main.edit_badge', badge_id=badge_id))
     
-    return render_template('edit_badge.html', badge=badge, tasks=tasks)
+    return render_template('edit_badge.html', badge=badge, tasks=tasks, **_badge_form_options())
 
 @main.route('/badge/delete/<int:badge_id>', methods=['POST'])
 @login_required
@@ -756,9 +832,9 @@ def child_detail(child_id):
     if child.parent != current_user:
         flash('无权访问')
         return redirect(url_for('main.dashboard'))
-    task_records = child.task_records.order_by(TaskRecord.completed_at.desc()).all()
-    # 查询积分兑换记录（奖励兑换记录），按兑换时间降序排列
-    reward_records = child.reward_records.order_by(RewardRecord.redeemed_at.desc()).all()
+    # 任务记录和积分兑换记录（奖励兑换记录）只用于展示，按列查询并带出任务、奖励名称，按时间降序排列
+    task_records = read_models.task_records(child.id)
+    reward_records = read_models.reward_records(child.id)
     # 查询可用的奖励（符合MVC模式，在视图层处理数据库查询）
     available_rewards = Reward.query.filter_by(is_active=True).filter(Reward.cost <= child.points).all()
     return render_template('child_detail.html', child=child, task_records=task_records, reward_records=reward_records, available_rewards=available_rewards)
@@ -813,6 +889,9 @@ def confirm_task_record(record_id):
                 )
                 db.session.add(badge)
                 flash(f"系统已为任务 '{record.task.name}' 自动创建了勋章！")
+            # 首次完成该任务时也评估勋章规则（分类、积分等规则可能已经满足）
+            for badge in badge_rules.award(db.session, record.child, task_ids=[record.task_id]):
+                flash(f"🎉 {record.child.name} 获得了「{badge.name}」勋章！额外奖励 {badge.points_reward} 积分！")
         else:
             # 计算与上一次完成的日期差
             if streak.last_completed_date:
@@ -833,61 +912,19 @@ def confirm_task_record(record_id):
             if streak.current_streak > streak.longest_streak:
                 streak.longest_streak = streak.current_streak
             
-            # 检查并颁发勋章
-            # 获取该任务的所有勋章（按要求从低到高排序）
-            badges = Badge.query.filter_by(task_id=record.task_id).all()
-            
-            # 记录是否有新勋章被颁发
-            new_badge_earned = False
-            
-            for badge in badges:
-                # 检查是否已经获得该勋章
-                existing_badge = ChildBadge.query.filter_by(child_id=record.child_id, badge_id=badge.id).first()
-                
-                # 判断是基于完成次数还是连续天数
-                if badge.completions_required > 0:
-                    # 基于完成次数的勋章
-                    # 计算该任务的完成次数
-                    completion_count = db.session.query(func.count(TaskRecord.id)).filter(
-                        TaskRecord.child_id == record.child_id,
-                        TaskRecord.task_id == record.task_id,
-                        TaskRecord.is_confirmed == True
-                    ).scalar()
-                    
-                    # 如果未获得该勋章，且完成次数达到要求
-                    if not existing_badge and completion_count >= badge.completions_required:
-                        # 创建勋章记录
-                        child_badge = ChildBadge(child_id=record.child_id, badge_id=badge.id)
-                        db.session.add(child_badge)
-                        
-                        # 给予积分奖励
-                        record.child.points += badge.points_reward
-                        flash(f"🎉 {record.child.name} 获得了「{badge.name}」勋章！额外奖励 {badge.points_reward} 积分！")
-                        new_badge_earned = True
-                else:
-                    # 基于连续天数的勋章
-                    # 如果未获得该勋章，且连续天数达到要求
-                    if not existing_badge and streak.current_streak >= badge.days_required:
-                        # 创建勋章记录
-                        child_badge = ChildBadge(child_id=record.child_id, badge_id=badge.id)
-                        db.session.add(child_badge)
-                        
-                        # 给予积分奖励
-                        record.child.points += badge.points_reward
-                        flash(f"🎉 {record.child.name} 获得了「{badge.name}」勋章！额外奖励 {badge.points_reward} 积分！")
-                        new_badge_earned = True
+            # 检查并颁发勋章（只评估受本次完成影响的勋章规则，见app/badge_rules.py）
+            new_badges = badge_rules.award(db.session, record.child, task_ids=[record.task_id])
+            for badge in new_badges:
+                flash(f"🎉 {record.child.name} 获得了「{badge.name}」勋章！额外奖励 {badge.points_reward} 积分！")
+            new_badge_earned = bool(new_badges)
             
             # 如果没有新勋章被颁发但连续天数有更新，也显示进度更新信息
             if not new_badge_earned and streak.current_streak > 0:
-                # 查找该任务的下一个勋章
-                next_badge = Badge.query.filter(
-                    Badge.task_id == record.task_id,
-                    Badge.days_required > streak.current_streak
-                ).order_by(Badge.days_required).first()
+                # 该任务的下一个勋章（勋章进度读模型，已包含本次的完成和颁发）
+                progress = badge_progress.get(db.session, record.child.id, record.task_id)
                 
-                if next_badge:
-                    days_remaining = next_badge.days_required - streak.current_streak
-                    flash(f"🔥 {record.child.name} 已连续完成 {record.task.name} {streak.current_streak} 天，距离获得「{next_badge.name}」勋章还需 {days_remaining} 天！")
+                if progress and progress.badge:
+                    flash(f"🔥 {record.child.name} 已连续完成 {record.task.name} {streak.current_streak} 天，距离获得「{progress.badge.name}」勋章还需 {progress.remaining} {progress.unit}！")
                 else:
                     flash(f"🎉 {record.child.name} 已连续完成 {record.task.name} {streak.current_streak} 天，已达到最高连续记录！")
         
@@ -921,77 +958,20 @@ def edit_task_record(record_id):
             completed_at = datetime.strptime(date_str, '%Y-%m-%dT%H:%M')
             task_date = completed_at.date()
             
-            # 检查该任务在同一天是否已经被完成并确认
+            # 检查该任务在同一天是否已经被完成并确认（排除当前记录本身）
+            day_start, day_end = day_bounds(task_date)
             existing_record = TaskRecord.query.filter(
-                TaskRecord.child_id == child_id,
+                TaskRecord.id != record.id,
+                TaskRecord.child_id == record.child_id,
                 TaskRecord.task_id == task_id,
                 TaskRecord.is_confirmed == True,
-                func.date(TaskRecord.completed_at) == task_date
+                TaskRecord.completed_at >= day_start,
+                TaskRecord.completed_at < day_end
             ).first()
             
             if existing_record:
                 flash(f'该任务在{task_date}已经完成过了，每个任务一天只能完成一次')
-                return redirect(url_for('main.add_points'))
-            
-            # 检查是否已经存在当天的相同任务记录
-            existing_record = TaskRecord.query.filter(
-                TaskRecord.child_id == child_id,
-                TaskRecord.task_id == task_id,
-                TaskRecord.is_confirmed == True,
-                func.date(TaskRecord.completed_at) == task_date
-            ).first()
-            
-            if existing_record:
-                flash(f'{child.name}今天已经完成过{task.name}任务了！')
-                return redirect(url_for('main.add_points'))
-            
-            # 检查是否已经存在当天的相同任务记录
-            existing_record = TaskRecord.query.filter(
-                TaskRecord.child_id == child_id,
-                TaskRecord.task_id == task_id,
-                TaskRecord.is_confirmed == True,
-                func.date(TaskRecord.completed_at) == task_date
-            ).first()
-            
-            if existing_record:
-                flash(f'{child.name}今天已经完成过{task.name}任务了！')
-                return redirect(url_for('main.add_points'))
-            
-            # 检查是否已经存在当天的相同任务记录
-            existing_record = TaskRecord.query.filter(
-                TaskRecord.child_id == child_id,
-                TaskRecord.task_id == task_id,
-                TaskRecord.is_confirmed == True,
-                func.date(TaskRecord.completed_at) == task_date
-            ).first()
-            
-            if existing_record:
-                flash(f'{child.name}今天已经完成过{task.name}任务了！')
-                return redirect(url_for('main.add_points'))
-            
-            # 检查是否已经存在当天的相同任务记录
-            existing_record = TaskRecord.query.filter(
-                TaskRecord.child_id == child_id,
-                TaskRecord.task_id == task_id,
-                TaskRecord.is_confirmed == True,
-                func.date(TaskRecord.completed_at) == task_date
-            ).first()
-            
-            if existing_record:
-                flash(f'{child.name}今天已经完成过{task.name}任务了！')
-                return redirect(url_for('main.add_points'))
-            
-            # 检查是否已经存在当天的相同任务记录
-            existing_record = TaskRecord.query.filter(
-                TaskRecord.child_id == child_id,
-                TaskRecord.task_id == task_id,
-                TaskRecord.is_confirmed == True,
-                func.date(TaskRecord.completed_at) == task_date
-            ).first()
-            
-            if existing_record:
-                flash(f'{child.name}今天已经完成过{task.name}任务了！')
-                return redirect(url_for('main.add_points'))
+                return redirect(url_for('main.edit_task_record', record_id=record.id))
             
             # 获取新任务信息
             new_task = Task.query.get_or_404(task_id)
@@ -1017,29 +997,11 @@ def edit_task_record(record_id):
                     # 对于原任务，需要重新计算连续记录
                     old_streak = TaskStreak.query.filter_by(child_id=record.child_id, task_id=old_task_id).first()
                     if old_streak:
-                        # 重新计算原任务的连续天数（这里简化处理，实际可能需要重新计算所有记录）
-                        # 获取该任务的所有已确认记录
-                        old_records = TaskRecord.query.filter_by(
-                            child_id=record.child_id,
-                            task_id=old_task_id,
-                            is_confirmed=True
-                        ).order_by(TaskRecord.completed_at.desc()).all()
-                        
-                        if old_records:
-                            # 重新计算连续天数逻辑（简化版）
-                            last_date = old_records[0].completed_at.date()
-                            current_streak = 1
-                            
-                            for r in old_records[1:]:
-                                r_date = r.completed_at.date()
-                                if (last_date - r_date).days == 1:
-                                    current_streak += 1
-                                    last_date = r_date
-                                else:
-                                    break
-                            
-                            old_streak.current_streak = current_streak
-                            old_streak.last_completed_date = old_records[0].completed_at.date()
+                        # 根据原任务剩余的已确认记录重新计算连续天数
+                        run = recompute_streak(record.child_id, old_task_id)
+                        if run:
+                            old_streak.current_streak = run.current
+                            old_streak.last_completed_date = run.last_date
                     
                 # 对于新任务，获取或创建连续记录
                 streak = TaskStreak.query.filter_by(child_id=record.child_id, task_id=task_id).first()
@@ -1071,73 +1033,19 @@ def edit_task_record(record_id):
                         db.session.add(badge)
                 else:
                     # 重新计算连续天数（基于所有已确认的记录）
-                    # 获取该任务的所有已确认记录
-                    all_records = TaskRecord.query.filter_by(
-                        child_id=record.child_id,
-                        task_id=task_id,
-                        is_confirmed=True
-                    ).order_by(TaskRecord.completed_at.desc()).all()
+                    run = recompute_streak(record.child_id, task_id)
                     
-                    if all_records:
-                        # 重新计算连续天数
-                        last_date = all_records[0].completed_at.date()
-                        current_streak = 1
-                        
-                        for r in all_records[1:]:
-                            r_date = r.completed_at.date()
-                            if (last_date - r_date).days == 1:
-                                current_streak += 1
-                                last_date = r_date
-                            else:
-                                break
-                        
-                        streak.current_streak = current_streak
-                        streak.last_completed_date = all_records[0].completed_at.date()
+                    if run:
+                        streak.current_streak = run.current
+                        streak.last_completed_date = run.last_date
                         
                         # 更新最长连续天数
-                        if current_streak > streak.longest_streak:
-                            streak.longest_streak = current_streak
-                    
-                    # 检查并颁发勋章
-                    badges = Badge.query.filter_by(task_id=task_id).all()
-                    new_badge_earned = False
+                        if run.longest > streak.longest_streak:
+                            streak.longest_streak = run.longest
                     
-                    for badge in badges:
-                        # 检查是否已经获得该勋章
-                        existing_badge = ChildBadge.query.filter_by(child_id=record.child_id, badge_id=badge.id).first()
-                        
-                        # 判断是基于完成次数还是连续天数
-                        if badge.completions_required > 0:
-                            # 基于完成次数的勋章
-                            # 计算该任务的完成次数
-                            completion_count = db.session.query(func.count(TaskRecord.id)).filter(
-                                TaskRecord.child_id == record.child_id,
-                                TaskRecord.task_id == task_id,
-                                TaskRecord.is_confirmed == True
-                            ).scalar()
-                            
-                            # 如果未获得该勋章，且完成次数达到要求
-                            if not existing_badge and completion_count >= badge.completions_required:
-                                # 创建勋章记录
-                                child_badge = ChildBadge(child_id=record.child_id, badge_id=badge.id)
-                                db.session.add(child_badge)
-                                
-                                # 给予积分奖励
-                                record.child.points += badge.points_reward
-                                flash(f"🎉 {record.child.name} 获得了「{badge.name}」勋章！额外奖励 {badge.points_reward} 积分！")
-                                new_badge_earned = True
-                        else:
-                            # 基于连续天数的勋章
-                            # 如果未获得该勋章，且连续天数达到要求
-                            if not existing_badge and streak.current_streak >= badge.days_required:
-                                # 创建勋章记录
-                                child_badge = ChildBadge(child_id=record.child_id, badge_id=badge.id)
-                                db.session.add(child_badge)
-                                
-                                # 给予积分奖励
-                                record.child.points += badge.points_reward
-                                flash(f"🎉 {record.child.name} 获得了「{badge.name}」勋章！额外奖励 {badge.points_reward} 积分！")
-                                new_badge_earned = True
+                    # 检查并颁发勋章（只评估受本次修改影响的勋章规则）
+                    for badge in badge_rules.award(db.session, record.child, task_ids=[task_id]):
+                        flash(f"🎉 {record.child.name} 获得了「{badge.name}」勋章！额外奖励 {badge.points_reward} 积分！")
             
             db.session.commit()
             flash('任务记录更新成功')
@@ -1198,6 +1106,8 @@ def delete_task_record(record_id):
 # 获取过滤后的任务列表API
 @main.route('/api/get_filtered_tasks', methods=['GET'])
 @login_required
+@conditional_get(lambda: visible_child_scopes(request.args.get('child_id', type=int))
+                 if hasattr(current_user, 'children') else None)
 def get_filtered_tasks():
     # 只有家长用户可以访问
     if not hasattr(current_user, 'children'):
@@ -1210,46 +1120,103 @@ def get_filtered_tasks():
     # 导入需要的模块
     from datetime import datetime
     from sqlalchemy import func
-    import json
     
     # 验证参数
     if not child_id or not date_str:
         return jsonify({'error': '参数不完整'}), 400
+    # 只能查看自己的孩子
+    if db.session.query(Child.id).filter_by(id=child_id, user_id=current_user.id).first() is None:
+        return jsonify({'error': '权限不足'}), 403
     
     try:
         # 解析日期
         task_date = datetime.strptime(date_str, '%Y-%m-%d').date()
         
-        # 获取当天已完成的任务ID列表
-        completed_tasks = TaskRecord.query.filter(
+        # 当天已确认完成的任务
+        day_start, day_end = day_bounds(task_date)
+        completed = db.session.query(TaskRecord.task_id).filter(
             TaskRecord.child_id == child_id,
             TaskRecord.is_confirmed == True,
-            func.date(TaskRecord.completed_at) == task_date
-        ).with_entities(TaskRecord.task_id).all()
-        
-        # 提取任务ID
-        completed_task_ids = [task.task_id for task in completed_tasks]
+            TaskRecord.completed_at >= day_start,
+            TaskRecord.completed_at < day_end
+        )
         
-        # 过滤任务列表，只显示未完成的任务
-        tasks = Task.query.filter(
+        # 只按列查询未完成的任务，结果行直接编码为JSON对象
+        tasks = db.session.query(
+            Task.id, Task.name, func.coalesce(TaskCategory.name, '').label('category'), Task.points
+        ).outerjoin(
+            TaskCategory, TaskCategory.id == Task.category_id
+        ).filter(
             Task.is_active == True,
-            ~Task.id.in_(completed_task_ids)
-        ).all() if completed_task_ids else Task.query.filter_by(is_active=True).all()
+            ~Task.id.in_(completed.scalar_subquery())
+        ).order_by(Task.id).all()
         
-        # 转换为JSON格式
-        task_list = [{
-            'id': task.id,
-            'name': task.name,
-            'category': task.category,
-            'points': task.points
-        } for task in tasks]
-        
-        return jsonify({'tasks': task_list})
+        return json_stream(tasks, key='tasks')
     except ValueError:
         return jsonify({'error': '日期格式错误'}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# 完成日历/热力图API
+@main.route('/api/calendar/<int:child_id>', methods=['GET'])
+@login_required
+@conditional_get(visible_child_scopes)
+def completion_calendar(child_id):
+    """
+    返回孩子某一年每个任务的完成位图和每天的完成任务数
+
+    参数: year（默认今年）、task_id（可选，只返回该任务并附带完成日期列表）
+    位图为十六进制字符串，第n位（低位在前）表示该年第n+1天已完成
+    """
+    from datetime import date, timedelta
+    
+    child = Child.query.get_or_404(child_id)
+    if hasattr(current_user, 'children'):
+        if child.parent != current_user:
+            return jsonify({'error': '权限不足'}), 403
+    elif current_user.id != child.id:
+        return jsonify({'error': '权限不足'}), 403
+    
+    year = request.args.get('year', date.today().year, type=int)
+    task_id = request.args.get('task_id', type=int)
+    task_ids = [task_id] if task_id else None
+    
+    # 同时读取上一年的位图，连续天数可以跨年计算
+    all_bitmaps = bitmaps.load(db.session, child.id, [year - 1, year], task_ids)
+    task_names = dict(db.session.query(Task.id, Task.name).filter(Task.id.in_(list(all_bitmaps))).all()) if all_bitmaps else {}
+    
+    # 截至今天（或所选年份的最后一天）的连续天数，今天尚未完成时按昨天计算
+    as_of = min(date.today(), date(year, 12, 31))
+    # 按月的完成次数由计数表提供
+    monthly = counters.monthly_counts(child.id, task_id)
+    tasks = []
+    for tid, by_year in sorted(all_bitmaps.items()):
+        bits = by_year.get(year)
+        if bits is None:
+            continue
+        item = {
+            'task_id': tid,
+            'task_name': task_names.get(tid, ''),
+            'bitmap': bits.hex(),
+            'count': bitmaps.popcount(bits),
+            'longest_streak': bitmaps.longest_run(bits),
+            'current_streak': max(bitmaps.run_ending_at(by_year, as_of),
+                                  bitmaps.run_ending_at(by_year, as_of - timedelta(days=1))),
+            'monthly_counts': {month: count for (month_task, month), count in monthly.items()
+                               if month_task == tid and month.startswith(f'{year}-') and count}
+        }
+        if task_id:
+            item['days'] = [day.isoformat() for day in bitmaps.completed_days(bits, year)]
+        tasks.append(item)
+    
+    return jsonify({
+        'child_id': child.id,
+        'year': year,
+        'days_in_year': bitmaps.days_in_year(year),
+        'tasks': tasks,
+        'heatmap': bitmaps.daily_counts([by_year[year] for by_year in all_bitmaps.values() if year in by_year], year)
+    })
+
 # 给孩子添加积分
 @main.route('/add_points', methods=['GET', 'POST'])
 @login_required
@@ -1354,6 +1321,9 @@ def add_points():
                     )
                     db.session.add(badge)
                     flash(f"系统已为任务 '{task.name}' 自动创建了勋章！")
+                # 首次完成该任务时也评估勋章规则（分类、积分等规则可能已经满足）
+                for badge in badge_rules.award(db.session, child, task_ids=[task_id]):
+                    flash(f"🎉 {child.name} 获得了「{badge.name}」勋章！额外奖励 {badge.points_reward} 积分！")
             else:
                 # 计算与上一次完成的日期差
                 if streak.last_completed_date:
@@ -1374,61 +1344,19 @@ def add_points():
                 if streak.current_streak > streak.longest_streak:
                     streak.longest_streak = streak.current_streak
                 
-                # 检查并颁发勋章
-                # 获取该任务的所有勋章
-                badges = Badge.query.filter_by(task_id=task_id).all()
-                
-                # 记录是否有新勋章被颁发
-                new_badge_earned = False
-                
-                for badge in badges:
-                    # 检查是否已经获得该勋章
-                    existing_badge = ChildBadge.query.filter_by(child_id=child_id, badge_id=badge.id).first()
-                    
-                    # 判断是基于完成次数还是连续天数
-                    if badge.completions_required > 0:
-                        # 基于完成次数的勋章
-                        # 计算该任务的完成次数
-                        completion_count = db.session.query(func.count(TaskRecord.id)).filter(
-                            TaskRecord.child_id == child_id,
-                            TaskRecord.task_id == task_id,
-                            TaskRecord.is_confirmed == True
-                        ).scalar()
-                        
-                        # 如果未获得该勋章，且完成次数达到要求
-                        if not existing_badge and completion_count >= badge.completions_required:
-                            # 创建勋章记录
-                            child_badge = ChildBadge(child_id=child_id, badge_id=badge.id)
-                            db.session.add(child_badge)
-                            
-                            # 给予积分奖励
-                            child.points += badge.points_reward
-                            flash(f"🎉 {child.name} 获得了「{badge.name}」勋章！额外奖励 {badge.points_reward} 积分！")
-                            new_badge_earned = True
-                    else:
-                        # 基于连续天数的勋章
-                        # 如果未获得该勋章，且连续天数达到要求
-                        if not existing_badge and streak.current_streak >= badge.days_required:
-                            # 创建勋章记录
-                            child_badge = ChildBadge(child_id=child_id, badge_id=badge.id)
-                            db.session.add(child_badge)
-                            
-                            # 给予积分奖励
-                            child.points += badge.points_reward
-                            flash(f"🎉 {child.name} 获得了「{badge.name}」勋章！额外奖励 {badge.points_reward} 积分！")
-                            new_badge_earned = True
+                # 检查并颁发勋章（只评估受本次完成影响的勋章规则，见app/badge_rules.py）
+                new_badges = badge_rules.award(db.session, child, task_ids=[task_id])
+                for badge in new_badges:
+                    flash(f"🎉 {child.name} 获得了「{badge.name}」勋章！额外奖励 {badge.points_reward} 积分！")
+                new_badge_earned = bool(new_badges)
                 
                 # 如果没有新勋章被颁发但连续天数有更新，也显示进度更新信息
                 if not new_badge_earned and streak.current_streak > 0:
-                    # 查找该任务的下一个勋章
-                    next_badge = Badge.query.filter(
-                        Badge.task_id == task_id,
-                        Badge.days_required > streak.current_streak
-                    ).order_by(Badge.days_required).first()
+                    # 该任务的下一个勋章（勋章进度读模型，已包含本次的完成和颁发）
+                    progress = badge_progress.get(db.session, child.id, task_id)
                     
-                    if next_badge:
-                        days_remaining = next_badge.days_required - streak.current_streak
-                        flash(f"🔥 {child.name} 已连续完成 {task.name} {streak.current_streak} 天，距离获得「{next_badge.name}」勋章还需 {days_remaining} 天！")
+                    if progress and progress.badge:
+                        flash(f"🔥 {child.name} 已连续完成 {task.name} {streak.current_streak} 天，距离获得「{progress.badge.name}」勋章还需 {progress.remaining} {progress.unit}！")
                     else:
                         flash(f"🎉 {child.name} 已连续完成 {task.name} {streak.current_streak} 天，已达到最高连续记录！")
             
@@ -1454,6 +1382,7 @@ def add_points():
 
 @main.route('/child/<int:child_id>/progress')
 @login_required
+@conditional_get(visible_child_scopes)
 def child_progress(child_id):
     child = Child.query.filter_by(id=child_id, user_id=current_user.id).first_or_404()
     
@@ -1501,7 +1430,7 @@ def child_progress(child_id):
     
     # 计算积分目标进度
     reward_goals = []
-    available_rewards = Reward.query.filter_by(is_active=True).order_by(Reward.cost).all()
+    available_rewards = sorted(catalog.active_rewards(), key=lambda reward: reward.cost)
     for reward in available_rewards:
         reward_goals.append({
             'name': reward.name,
@@ -1617,6 +1546,7 @@ def delete_child(child_id):
         # 再删除奖励记录
         RewardRecord.query.filter_by(child_id=child_id).delete()
         # 最后删除孩子
+        shard_router.unregister(child.username)
         db.session.delete(child)
         db.session.commit()
         flash('孩子信息已删除')
@@ -1629,9 +1559,10 @@ def delete_child(child_id):
 # 积分商城
 @main.route('/mall')
 @login_required
+@conditional_get(user_scopes)
 def mall():
     # 获取所有激活的奖励（用于积分商城展示）
-    available_rewards = Reward.query.filter_by(is_active=True).all()
+    available_rewards = catalog.active_rewards()
     
     # 检查是否是家长用户
     if hasattr(current_user, 'children'):  # 家长用户
@@ -1705,8 +1636,7 @@ def redeem_reward(child_id, reward_id):
     except Exception as e:
         db.session.rollback()
         flash(f'兑换过程中发生错误: {str(e)}')
-        import logging
-        logging.error(f'奖励兑换失败: {str(e)}')
+        logger.error('奖励兑换失败: %s', e)
     
     # 根据用户类型重定向
     if hasattr(current_user, 'children'):  # 家长用户
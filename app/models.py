@@ -1,11 +1,15 @@
 from datetime import datetime, date, timedelta
-from app import db, login_manager
+from app import db, login_manager, shard_router
 from flask_login import UserMixin
-from sqlalchemy import func, and_, extract
+from sqlalchemy import func, and_, case, extract
+from sqlalchemy.orm import joinedload
+from app.sql_compat import day_bucket, month_bucket
 
 # 用户登录加载函数
 @login_manager.user_loader
 def load_user(user_id):
+    # 分片模式下先绑定会话中记录的家庭分片
+    shard_router.activate_from_session()
     # 格式: type_id:id，type_id 1表示家长，2表示孩子
     if ':' in user_id:
         type_id, actual_id = user_id.split(':', 1)
@@ -16,6 +20,19 @@ def load_user(user_id):
     # 处理纯数字ID（兼容旧格式）
     return User.query.get(int(user_id))
 
+class ShardDirectory(db.Model):
+    """分片目录模型：用户名到家庭分片的映射（保存在全局数据库，仅分片模式使用）"""
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(64), unique=True, nullable=False)  # 家长或孩子的登录用户名
+    user_type = db.Column(db.Integer, nullable=False)  # 1表示家长，2表示孩子（与get_id格式一致）
+    shard_key = db.Column(db.String(64), nullable=False, index=True)  # 家庭分片标识
+
+class DataVersion(db.Model):
+    """数据版本模型：每次写入时递增，用于生成ETag（范围：global、family:<家长ID>、child:<孩子ID>）"""
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(64), unique=True, nullable=False)  # 版本范围
+    version = db.Column(db.Integer, nullable=False, default=0)  # 当前版本号
+
 class User(UserMixin, db.Model):
     """家长用户模型"""
     id = db.Column(db.Integer, primary_key=True)
@@ -77,6 +94,10 @@ class Reward(db.Model):
 
 class TaskRecord(db.Model):
     """任务完成记录模型"""
+    # 按孩子分页读取（/api/v1的游标按ID）
+    __table_args__ = (
+        db.Index('ix_task_record_child_id', 'child_id', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     child_id = db.Column(db.Integer, db.ForeignKey('child.id'), nullable=False)
     task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
@@ -86,6 +107,9 @@ class TaskRecord(db.Model):
 
 class RewardRecord(db.Model):
     """奖励兑换记录模型"""
+    __table_args__ = (
+        db.Index('ix_reward_record_child_id', 'child_id', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     child_id = db.Column(db.Integer, db.ForeignKey('child.id'), nullable=False)
     reward_id = db.Column(db.Integer, db.ForeignKey('reward.id'), nullable=False)
@@ -98,17 +122,36 @@ class Badge(db.Model):
     name = db.Column(db.String(128), nullable=False)  # 勋章名称
     description = db.Column(db.Text)  # 勋章描述
     icon = db.Column(db.String(64), default='🌟')  # 勋章图标，默认使用emoji
-    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)  # 关联的任务
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id'))  # 关联的任务（分类、积分、学习规则的勋章可以为空）
     task = db.relationship('Task', backref='badges', lazy='joined')  # 添加与Task的关联关系
     days_required = db.Column(db.Integer, default=30)  # 连续完成天数要求
     completions_required = db.Column(db.Integer, default=0)  # 完成次数要求，0表示使用连续天数
     level = db.Column(db.String(32), nullable=False, default='初级')  # 勋章等级：初级、中级、高级、毕业
     points_reward = db.Column(db.Integer, default=10)  # 获得勋章奖励的积分
+    # 勋章规则（见app/badge_rules.py），为空时按上面的连续天数或完成次数判断
+    rule_type = db.Column(db.String(32))  # 规则类型，如category_points、learning_completed
+    rule_threshold = db.Column(db.Integer, default=0)  # 规则要求达到的数值
+    rule_period = db.Column(db.String(16), default='all')  # 统计周期：all、day、week、month
+    category_id = db.Column(db.Integer, db.ForeignKey('task_category.id'))  # 任务分类规则的分类（为空表示全部任务）
+    learning_category_id = db.Column(db.Integer, db.ForeignKey('learning_category.id'))  # 学习规则的分类
+    category = db.relationship('TaskCategory')
+    learning_category = db.relationship('LearningCategory')
     # 关联到孩子获得的勋章
     child_badges = db.relationship('ChildBadge', backref='badge', lazy='dynamic')
 
+    @property
+    def rule_description(self):
+        """获得条件的文字描述"""
+        from app import badge_rules
+        return badge_rules.describe(self)
+
 class ChildBadge(db.Model):
     """孩子获得的勋章模型"""
+    __table_args__ = (
+        db.Index('ix_child_badge_child_id', 'child_id', 'id'),
+        # 每个勋章每个孩子只能获得一次（补发与打卡时的颁发同时进行时不会重复奖励）
+        db.Index('ix_child_badge_child_badge', 'child_id', 'badge_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     child_id = db.Column(db.Integer, db.ForeignKey('child.id'), nullable=False)
     badge_id = db.Column(db.Integer, db.ForeignKey('badge.id'), nullable=False)
@@ -123,6 +166,10 @@ def add_analysis_methods(cls):
     # 获取指定时间段内完成的任务数量
     @classmethod
     def get_task_completion_by_period(cls, child_id, start_date=None, end_date=None):
+        from app.analytics import engine
+        if engine.available:
+            return engine.task_completion_by_period(child_id, start_date, end_date)
+        
         query = db.session.query(
             func.count(TaskRecord.id).label('task_count'),
             Task.category_id,
@@ -146,11 +193,15 @@ def add_analysis_methods(cls):
     # 获取积分获取趋势
     @classmethod
     def get_points_trend(cls, child_id, days=30):
+        from app.analytics import engine
+        if engine.available:
+            return engine.points_trend(child_id, days)
+        
         start_date = datetime.utcnow() - timedelta(days=days)
         
         # 按天分组统计获得的积分，优先使用actual_points字段
         daily_points = db.session.query(
-            func.date(TaskRecord.completed_at).label('date'),
+            day_bucket(TaskRecord.completed_at).label('date'),
             func.sum(func.coalesce(TaskRecord.actual_points, Task.points)).label('daily_points')
         ).join(
             TaskRecord.task
@@ -158,25 +209,30 @@ def add_analysis_methods(cls):
             TaskRecord.child_id == child_id,
             TaskRecord.is_confirmed == True,
             TaskRecord.completed_at >= start_date
-        ).group_by(func.date(TaskRecord.completed_at)).all()
+        ).group_by(day_bucket(TaskRecord.completed_at)).all()
         
         return daily_points
     
     # 获取任务连续完成统计
     @classmethod
     def get_streak_statistics(cls, child_id):
-        # 获取所有任务的连续完成情况
-        streaks = TaskStreak.query.filter_by(child_id=child_id).all()
-        
-        # 获取当前活跃的连续记录（当前streak>0）
-        active_streaks = [s for s in streaks if s.current_streak > 0]
+        # 获取所有任务的连续完成情况（同时加载任务，结果可以缓存）
+        streaks = TaskStreak.query.options(joinedload(TaskStreak.task)).filter_by(child_id=child_id).all()
         
-        # 获取最大的连续天数记录
-        max_streak = max([s.longest_streak for s in streaks]) if streaks else 0
+        from app.analytics import engine
+        if engine.available:
+            # 根据完成记录计算活跃的连续记录数和最大连续天数
+            active_streaks_count, max_streak = engine.streak_summary(child_id)
+        else:
+            # 获取当前活跃的连续记录（当前streak>0）
+            active_streaks_count = len([s for s in streaks if s.current_streak > 0])
+            
+            # 获取最大的连续天数记录
+            max_streak = max([s.longest_streak for s in streaks]) if streaks else 0
         
         return {
             'streaks': streaks,
-            'active_streaks_count': len(active_streaks),
+            'active_streaks_count': active_streaks_count,
             'max_streak': max_streak
         }
     
@@ -196,8 +252,8 @@ def add_analysis_methods(cls):
             ChildBadge.child_id == child_id
         ).group_by(Badge.level).all()
         
-        # 计算最近获得的勋章
-        recent_badges = ChildBadge.query.filter_by(child_id=child_id).order_by(
+        # 计算最近获得的勋章（同时加载勋章，结果可以缓存）
+        recent_badges = ChildBadge.query.options(joinedload(ChildBadge.badge)).filter_by(child_id=child_id).order_by(
             ChildBadge.earned_at.desc()
         ).limit(5).all()
         
@@ -220,11 +276,12 @@ def add_analysis_methods(cls):
         Returns:
             包含勋章分析数据的字典
         """
+        from app import read_models
         start_date = datetime.utcnow() - timedelta(days=days)
         
-        # 获取所有勋章信息
-        all_badges = Badge.query.all()
-        earned_badges = ChildBadge.query.filter_by(child_id=child_id).all()
+        # 获取所有勋章信息（按列查询，勋章和任务名称已连接好，按获得时间降序）
+        all_badges = read_models.all_badges()
+        earned_badges = read_models.earned_badges(child_id)
         earned_badge_ids = {badge.badge_id for badge in earned_badges}
         
         # 分类统计：已获得 vs 未获得
@@ -253,30 +310,25 @@ def add_analysis_methods(cls):
             for row in badges_by_level_query
         ]
         
-        # 最近获得的勋章（时间范围内）
-        recent_badges_query = ChildBadge.query.filter_by(child_id=child_id).filter(
-            ChildBadge.earned_at >= start_date
-        ).order_by(ChildBadge.earned_at.desc()).all()
-        
-        # 将ChildBadge对象转换为可序列化的字典
+        # 最近获得的勋章（时间范围内），从已获得的勋章中筛选
         recent_badges_in_period = [
             {
                 'id': badge.id,
                 'badge_id': badge.badge_id,
-                'badge_name': badge.badge.name,
-                'badge_level': badge.badge.level,
-                'earned_at': badge.earned_at.isoformat()
+                'badge_name': badge.badge_name,
+                'badge_level': badge.badge_level,
+                'earned_at': badge.earned_at
             }
-            for badge in recent_badges_query
+            for badge in earned_badges if badge.earned_at and badge.earned_at >= start_date
         ]
         
-        # 勋章获取趋势（按月统计） - 使用SQLite兼容的strftime函数
+        # 勋章获取趋势（按月统计） - 使用跨数据库的按月分组表达式
         badge_trend_query = db.session.query(
-            func.strftime('%Y-%m', ChildBadge.earned_at).label('month'),
+            month_bucket(ChildBadge.earned_at).label('month'),
             func.count(ChildBadge.id).label('badge_count')
         ).filter(
             ChildBadge.child_id == child_id
-        ).group_by(func.strftime('%Y-%m', ChildBadge.earned_at)).order_by('month').all()
+        ).group_by(month_bucket(ChildBadge.earned_at)).order_by('month').all()
         
         # 将Row对象转换为字典，使其可以JSON序列化
         badge_acquisition_trend = [
@@ -288,23 +340,27 @@ def add_analysis_methods(cls):
         ]
         
         # 找出最接近获得的未获得勋章 - 基于任务完成情况的智能分析
-        closest_badges = cls._find_closest_badges(child_id, all_badges, earned_badge_ids)
+        closest_badges = cls._find_closest_badges(child_id)
         
         # 格式化返回数据，确保数据结构清晰一致
         # 将closest_badges转换为可序列化的字典
         closest_badges_serializable = [
             {
-                'id': badge.id,
-                'name': badge.name,
-                'task_id': badge.task_id,
-                'task_name': badge.task.name if badge.task else '',
-                'days_required': badge.days_required,
-                'level': badge.level,
-                'points_reward': badge.points_reward,
-                'progress': getattr(badge, 'progress', 0),
-                'current_streak': getattr(badge, 'current_streak', 0)
+                'id': progress.badge.id,
+                'name': progress.badge.name,
+                'icon': progress.badge.icon,
+                'task_id': progress.task_id,
+                'task_name': progress.badge.task.name if progress.badge.task else '',
+                'days_required': progress.badge.days_required,
+                'level': progress.badge.level,
+                'points_reward': progress.badge.points_reward,
+                'kind': progress.kind,
+                'target': progress.target,
+                'unit': progress.unit,
+                'progress': progress.percent,
+                'current_streak': progress.current_value
             }
-            for badge in closest_badges[:5]  # 限制返回数量
+            for progress in closest_badges
         ]
         
         # 将all_badges转换为可序列化的字典
@@ -313,7 +369,7 @@ def add_analysis_methods(cls):
                 'id': badge.id,
                 'name': badge.name,
                 'task_id': badge.task_id,
-                'task_name': badge.task.name if badge.task else '',
+                'task_name': badge.task_name or '',
                 'days_required': badge.days_required,
                 'level': badge.level,
                 'points_reward': badge.points_reward,
@@ -322,14 +378,14 @@ def add_analysis_methods(cls):
             for badge in all_badges
         ]
         
-        # 将earned_badges转换为可序列化的字典
+        # 已获得的勋章（earned_at由JSON编码器输出为ISO 8601字符串）
         earned_badges_serializable = [
             {
                 'id': child_badge.id,
                 'badge_id': child_badge.badge_id,
-                'badge_name': child_badge.badge.name,
-                'badge_level': child_badge.badge.level,
-                'earned_at': child_badge.earned_at.isoformat()
+                'badge_name': child_badge.badge_name,
+                'badge_level': child_badge.badge_level,
+                'earned_at': child_badge.earned_at
             }
             for child_badge in earned_badges
         ]
@@ -348,49 +404,22 @@ def add_analysis_methods(cls):
         }
     
     @classmethod
-    def _find_closest_badges(cls, child_id, all_badges, earned_badge_ids):
+    def _find_closest_badges(cls, child_id, limit=5):
         """
-        智能分析找出最接近获得条件的未获得勋章
-        
-        策略：
-        1. 过滤出未获得的勋章
-        2. 计算每个任务的当前连续完成天数
-        3. 基于连续完成天数与勋章要求的比例进行排序
-        
+        找出最接近获得条件的未获得勋章
+
+        每个任务的下一个勋章及进度由勋章进度读模型（ChildBadgeProgress）在写入时维护，
+        这里只按(孩子, 进度)索引读取，不修改勋章对象。
+
         Args:
             child_id: 孩子ID
-            all_badges: 所有勋章列表
-            earned_badge_ids: 已获得的勋章ID集合
-            
+            limit: 返回数量
+
         Returns:
-            排序后的接近获得的勋章列表
+            按进度降序排列的ChildBadgeProgress列表
         """
-        unearned_badges = [badge for badge in all_badges if badge.id not in earned_badge_ids]
-        
-        # 计算每个任务的当前连续完成天数
-        task_streaks = {}
-        streaks = TaskStreak.query.filter_by(child_id=child_id).all()
-        for streak in streaks:
-            task_streaks[streak.task_id] = streak.current_streak
-        
-        # 对未获得勋章进行评分和排序
-        badges_with_progress = []
-        for badge in unearned_badges:
-            # 获取该任务的连续完成天数（如果有）
-            current_streak = task_streaks.get(badge.task_id, 0)
-            # 计算完成进度比例
-            progress_percentage = min(100, (current_streak / badge.days_required) * 100) if badge.days_required > 0 else 0
-            
-            # 添加进度信息到勋章对象
-            badge.progress = progress_percentage
-            badge.current_streak = current_streak
-            badges_with_progress.append((badge, progress_percentage))
-        
-        # 按进度百分比降序排序
-        badges_with_progress.sort(key=lambda x: x[1], reverse=True)
-        
-        # 返回排序后的勋章列表
-        return [badge for badge, _ in badges_with_progress]
+        from app import badge_progress
+        return badge_progress.closest(db.session, child_id, limit)
     
     # 获取任务完成率统计
     @classmethod
@@ -401,13 +430,17 @@ def add_analysis_methods(cls):
         active_tasks_count = Task.query.filter_by(is_active=True).count()
         
         # 计算已完成的不同任务数量
-        completed_tasks_count = db.session.query(
-            func.count(func.distinct(TaskRecord.task_id))
-        ).filter(
-            TaskRecord.child_id == child_id,
-            TaskRecord.is_confirmed == True,
-            TaskRecord.completed_at >= start_date
-        ).scalar() or 0
+        from app.analytics import engine
+        if engine.available:
+            completed_tasks_count = engine.completed_task_count(child_id, days)
+        else:
+            completed_tasks_count = db.session.query(
+                func.count(func.distinct(TaskRecord.task_id))
+            ).filter(
+                TaskRecord.child_id == child_id,
+                TaskRecord.is_confirmed == True,
+                TaskRecord.completed_at >= start_date
+            ).scalar() or 0
         
         # 计算完成率
         completion_rate = (completed_tasks_count / active_tasks_count * 100) if active_tasks_count > 0 else 0
@@ -421,6 +454,10 @@ def add_analysis_methods(cls):
     # 获取任务分类分布
     @classmethod
     def get_task_category_distribution(cls, child_id, start_date, end_date=None):
+        from app.analytics import engine
+        if engine.available:
+            return engine.task_category_distribution(child_id, start_date, end_date)
+        
         query = db.session.query(
             TaskCategory.name.label('category_name'),
             func.count(TaskRecord.id).label('count')
@@ -491,18 +528,22 @@ def add_analysis_methods(cls):
     @classmethod
     def get_habit_timeline(cls, child_id, days=30):
         from datetime import datetime
+        from app.analytics import engine
+        if engine.available:
+            # 按天计数和7天滚动完成率由记录数组直接得到，不再逐日拼接
+            return engine.habit_timeline(child_id, days)
         
         start_date = date.today() - timedelta(days=days)
         end_date = date.today()
         
-        # 将date对象转换为datetime对象用于查询
-        start_datetime = datetime.combine(start_date, datetime.min.time())
+        # 将date对象转换为datetime对象用于查询（多取6天用于计算7天滚动完成率）
+        start_datetime = datetime.combine(start_date - timedelta(days=6), datetime.min.time())
         end_datetime = datetime.combine(end_date, datetime.max.time())
         
         # 查询指定时间范围内的任务完成记录，按日期分组
         # 修复日期比较问题，确保能正确获取任务完成数据
         daily_completions = db.session.query(
-            func.date(TaskRecord.completed_at).label('date'),
+            day_bucket(TaskRecord.completed_at).label('date'),
             func.count(TaskRecord.id).label('completed_count'),
             func.count(func.distinct(TaskRecord.task_id)).label('unique_tasks')
         ).filter(
@@ -510,7 +551,7 @@ def add_analysis_methods(cls):
             TaskRecord.is_confirmed == True,
             TaskRecord.completed_at >= start_datetime,
             TaskRecord.completed_at <= end_datetime
-        ).group_by(func.date(TaskRecord.completed_at)).all()
+        ).group_by(day_bucket(TaskRecord.completed_at)).all()
         
         # 创建字典以便快速查找，确保日期类型一致
         completion_dict = {str(item.date): {'completed_count': item.completed_count, 'unique_tasks': item.unique_tasks} 
@@ -523,11 +564,17 @@ def add_analysis_methods(cls):
             date_str = str(current_date)
             completion_data = completion_dict.get(date_str, None)
             
+            # 最近7天中有完成记录的天数比例
+            active_days = sum(
+                1 for offset in range(7) if str(current_date - timedelta(days=offset)) in completion_dict
+            )
+            
             timeline.append({
                 'date': current_date,
                 'completed_count': completion_data['completed_count'] if completion_data else 0,
                 'unique_tasks': completion_data['unique_tasks'] if completion_data else 0,
-                'has_completions': completion_data is not None
+                'has_completions': completion_data is not None,
+                'rolling_rate': active_days / 7
             })
             current_date += timedelta(days=1)
         
@@ -593,12 +640,16 @@ Child.get_id = lambda self: f'2:{self.id}'
 
 class TaskStreak(db.Model):
     """任务连续完成记录模型"""
+    __table_args__ = (
+        db.Index('ix_task_streak_child_id', 'child_id', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     child_id = db.Column(db.Integer, db.ForeignKey('child.id'), nullable=False)
     task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
     current_streak = db.Column(db.Integer, default=0)  # 当前连续天数
     last_completed_date = db.Column(db.Date)  # 最后完成日期
     longest_streak = db.Column(db.Integer, default=0)  # 最长连续天数记录
+    total_completions = db.Column(db.Integer, nullable=False, default=0)  # 已确认的完成次数（写入时维护，见app/counters.py）
     
     # 关联任务
     task = db.relationship('Task', backref=db.backref('streaks', lazy='dynamic'))
@@ -624,6 +675,71 @@ class TaskStreak(db.Model):
             days_lost = (today - self.last_completed_date).days
             return f"已中断 {days_lost} 天，最长记录 {self.longest_streak} 天"
 
+class TaskCompletionMonth(db.Model):
+    """每月完成次数模型：每个(孩子, 任务, 月份)一行，与total_completions一同维护"""
+    __table_args__ = (
+        db.Index('ix_task_completion_month_child_task_month', 'child_id', 'task_id', 'month', unique=True),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    child_id = db.Column(db.Integer, db.ForeignKey('child.id'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
+    month = db.Column(db.String(7), nullable=False)  # 'YYYY-MM'
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+class ChildBadgeProgress(db.Model):
+    """勋章进度读模型：每个(孩子, 任务)一行，记录最接近获得的未获得勋章及进度（写入时维护，见app/badge_progress.py）"""
+    # 按(孩子, 任务)定位维护，“最接近获得的勋章”按(孩子, 进度)顺序读取
+    __table_args__ = (
+        db.Index('ix_child_badge_progress_child_task', 'child_id', 'task_id', unique=True),
+        db.Index('ix_child_badge_progress_child_percent', 'child_id', 'percent'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    child_id = db.Column(db.Integer, db.ForeignKey('child.id'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
+    badge_id = db.Column(db.Integer, db.ForeignKey('badge.id'))  # 下一个勋章，该任务的勋章都已获得时为空
+    kind = db.Column(db.String(16), nullable=False, default='streak')  # 'streak'连续天数 或 'count'完成次数
+    target = db.Column(db.Integer, nullable=False, default=0)  # 所需天数或次数
+    current_value = db.Column(db.Integer, nullable=False, default=0)  # 当前连续天数或完成次数
+    percent = db.Column(db.Float, nullable=False, default=0)  # 进度百分比（0-100）
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    badge = db.relationship('Badge', lazy='joined')
+
+    @property
+    def remaining(self):
+        """还需要的天数或次数"""
+        return max(self.target - self.current_value, 0)
+
+    @property
+    def unit(self):
+        return '次' if self.kind == 'count' else '天'
+
+class CompletionBitmap(db.Model):
+    """任务完成位图模型：每个(孩子, 任务, 年份)一行，第n位表示该年第n+1天有已确认的完成记录"""
+    # 日历按(孩子, 年份)读取全部任务，维护时按(孩子, 任务, 年份)定位
+    __table_args__ = (
+        db.Index('ix_completion_bitmap_child_year_task', 'child_id', 'year', 'task_id', unique=True),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    child_id = db.Column(db.Integer, db.ForeignKey('child.id'), nullable=False)
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id'), nullable=False)
+    year = db.Column(db.Integer, nullable=False)
+    bits = db.Column(db.LargeBinary(46), nullable=False)  # 366位，低位在前
+
+class ChangeLog(db.Model):
+    """变更记录模型：孩子数据每次写入时在同一事务中追加一行，客户端按ID增量同步（见app/changes.py）"""
+    # 按(家庭, ID)顺序读取某个家庭游标之后的变更
+    __table_args__ = (
+        db.Index('ix_change_log_family_id', 'family_id', 'id'),
+    )
+    id = db.Column(db.Integer, primary_key=True)  # 递增，作为同步游标
+    family_id = db.Column(db.Integer, nullable=False)  # 家长用户ID
+    child_id = db.Column(db.Integer, nullable=False)
+    entity = db.Column(db.String(32), nullable=False)  # records、redemptions、badges、streaks、learning_progress、children
+    entity_id = db.Column(db.Integer, nullable=False)
+    op = db.Column(db.String(8), nullable=False)  # 'upsert' 或 'delete'
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 # 将分析方法添加到Child类
 add_analysis_methods(Child)
 
@@ -658,6 +774,10 @@ class LearningResource(db.Model):
 
 class LearningProgress(db.Model):
     """孩子的学习进度模型"""
+    # 每个孩子对每个资源只保留一条进度记录，唯一索引同时服务于按(孩子, 资源)的查找
+    __table_args__ = (
+        db.Index('ix_learning_progress_child_resource', 'child_id', 'resource_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     child_id = db.Column(db.Integer, db.ForeignKey('child.id'), nullable=False)  # 孩子ID
     resource_id = db.Column(db.Integer, db.ForeignKey('learning_resource.id'), nullable=False)  # 资源ID
@@ -667,4 +787,44 @@ class LearningProgress(db.Model):
     last_accessed = db.Column(db.DateTime, default=datetime.utcnow)  # 最后访问时间
     access_count = db.Column(db.Integer, default=0)  # 访问次数
     # 关联到孩子
-    child = db.relationship('Child', backref=db.backref('learning_progress', lazy='dynamic'))
\ No newline at end of file
+    child = db.relationship('Child', backref=db.backref('learning_progress', lazy='dynamic'))
+
+    @classmethod
+    def get_category_overview(cls, child_id):
+        """
+        按学习分类汇总孩子的学习进度（单次分组查询）
+
+        Args:
+            child_id: 孩子ID
+
+        Returns:
+            以分类ID为键的字典，值包含资源总数、已开始数、已完成数、平均进度和最后学习时间
+        """
+        rows = db.session.query(
+            LearningResource.category_id,
+            func.count(LearningResource.id).label('total_resources'),
+            func.count(cls.id).label('started_resources'),
+            func.sum(case((cls.is_completed == True, 1), else_=0)).label('completed_resources'),
+            func.sum(func.coalesce(cls.progress, 0)).label('progress_sum'),
+            func.max(cls.last_accessed).label('last_accessed')
+        ).outerjoin(
+            cls, and_(
+                cls.resource_id == LearningResource.id,
+                cls.child_id == child_id
+            )
+        ).filter(
+            LearningResource.is_active == True
+        ).group_by(LearningResource.category_id).all()
+
+        overview = {}
+        for row in rows:
+            total = row.total_resources or 0
+            overview[row.category_id] = {
+                'total_resources': total,
+                'started_resources': row.started_resources or 0,
+                'completed_resources': row.completed_resources or 0,
+                # 未开始的资源按0%计入平均进度
+                'average_progress': (row.progress_sum or 0) / total if total else 0,
+                'last_accessed': row.last_accessed
+            }
+        return overview
@@ -0,0 +1,85 @@
+"""
+只读列表的投影查询
+
+任务记录、兑换记录、勋章等列表页面只显示少数几列，这里按列查询并直接连接出任务、分类、
+奖励和勋章名称，返回轻量的命名元组（__slots__为空，不进入会话的identity map，也没有延迟加载），
+代替逐行构建完整的ORM对象再通过关系属性取名称。需要修改数据时请查询ORM模型。
+"""
+from collections import namedtuple
+
+from app import db
+from app.models import Badge, ChildBadge, Reward, RewardRecord, Task, TaskCategory, TaskRecord
+
+
+class TaskRecordRow(namedtuple('TaskRecordRow', 'id child_id task_id task_name task_points category_name '
+                                                'completed_at is_confirmed actual_points')):
+    """任务记录及其任务、分类名称"""
+    __slots__ = ()
+
+    @property
+    def points(self):
+        """实际获得的积分（未单独设置时为任务积分）"""
+        return self.actual_points or self.task_points
+
+
+RewardRecordRow = namedtuple('RewardRecordRow', 'id reward_id reward_name reward_description reward_level '
+                                                'reward_cost redeemed_at is_fulfilled')
+EarnedBadgeRow = namedtuple('EarnedBadgeRow', 'id badge_id badge_name badge_icon badge_description '
+                                              'badge_level earned_at')
+BadgeRow = namedtuple('BadgeRow', 'id name task_id task_name days_required level points_reward')
+
+
+def task_records(child_id, confirmed=None, since=None, limit=None):
+    """孩子的任务记录，按完成时间降序"""
+    query = db.session.query(
+        TaskRecord.id, TaskRecord.child_id, TaskRecord.task_id, Task.name, Task.points, TaskCategory.name,
+        TaskRecord.completed_at, TaskRecord.is_confirmed, TaskRecord.actual_points
+    ).join(
+        Task, Task.id == TaskRecord.task_id
+    ).outerjoin(
+        TaskCategory, TaskCategory.id == Task.category_id
+    ).filter(TaskRecord.child_id == child_id)
+    if confirmed is not None:
+        query = query.filter(TaskRecord.is_confirmed == confirmed)
+    if since is not None:
+        query = query.filter(TaskRecord.completed_at >= since)
+    query = query.order_by(TaskRecord.completed_at.desc(), TaskRecord.id.desc())
+    if limit is not None:
+        query = query.limit(limit)
+    return [TaskRecordRow(*row) for row in query]
+
+
+def reward_records(child_id, since=None):
+    """孩子的奖励兑换记录，按兑换时间降序"""
+    query = db.session.query(
+        RewardRecord.id, RewardRecord.reward_id, Reward.name, Reward.description, Reward.level, Reward.cost,
+        RewardRecord.redeemed_at, RewardRecord.is_fulfilled
+    ).join(
+        Reward, Reward.id == RewardRecord.reward_id
+    ).filter(RewardRecord.child_id == child_id)
+    if since is not None:
+        query = query.filter(RewardRecord.redeemed_at >= since)
+    return [RewardRecordRow(*row) for row in query.order_by(RewardRecord.redeemed_at.desc())]
+
+
+def earned_badges(child_id, since=None):
+    """孩子获得的勋章，按获得时间降序"""
+    query = db.session.query(
+        ChildBadge.id, ChildBadge.badge_id, Badge.name, Badge.icon, Badge.description, Badge.level,
+        ChildBadge.earned_at
+    ).join(
+        Badge, Badge.id == ChildBadge.badge_id
+    ).filter(ChildBadge.child_id == child_id)
+    if since is not None:
+        query = query.filter(ChildBadge.earned_at >= since)
+    return [EarnedBadgeRow(*row) for row in query.order_by(ChildBadge.earned_at.desc())]
+
+
+def all_badges():
+    """所有勋章及关联任务名称"""
+    query = db.session.query(
+        Badge.id, Badge.name, Badge.task_id, Task.name, Badge.days_required, Badge.level, Badge.points_reward
+    ).outerjoin(
+        Task, Task.id == Badge.task_id
+    ).order_by(Badge.id)
+    return [BadgeRow(*row) for row in query]
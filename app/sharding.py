@@ -0,0 +1,167 @@
+"""
+家庭分片存储
+
+分片模式下，每个家长账户及其孩子的数据保存在独立的SQLite文件中，
+全局数据库只保存用户名到分片的目录（ShardDirectory）。
+请求开始时根据会话中的分片标识把数据库会话绑定到对应的分片引擎，
+这样不同家庭的写入不再争用同一个数据库写锁。
+"""
+import os
+import threading
+import uuid
+
+from flask import g, has_app_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine
+
+# 保存在全局数据库中的表（其余表都保存在各家庭分片中）
+GLOBAL_TABLES = {'shard_directory'}
+
+# 会话中保存分片标识的键
+SESSION_KEY = 'shard'
+
+
+class ShardedSession(Session):
+    """根据当前请求绑定的分片（或分析只读快照）选择数据库引擎的会话"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            engine = g.get('snapshot_engine') or g.get('shard_engine')
+            if engine is not None and not _is_global(mapper):
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def _is_global(mapper):
+    if mapper is None:
+        return False
+    table = getattr(getattr(mapper, 'local_table', None), 'name', None)
+    if table is None:
+        # mapper参数也可能直接是模型类
+        table = getattr(getattr(mapper, '__table__', None), 'name', None)
+    return table in GLOBAL_TABLES
+
+
+class ShardRouter:
+    """管理家庭分片引擎及用户名目录"""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.shard_dir = None
+        self._engines = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+        app.config.setdefault('SHARDING_ENABLED', os.environ.get('SHARDING_ENABLED', 'False').lower() == 'true')
+        app.config.setdefault('SHARD_DIRECTORY', os.environ.get('SHARD_DIRECTORY', os.path.join(basedir, 'shards')))
+        self.enabled = app.config['SHARDING_ENABLED']
+        self.shard_dir = app.config['SHARD_DIRECTORY']
+        app.extensions['shard_router'] = self
+
+        if self.enabled:
+            os.makedirs(self.shard_dir, exist_ok=True)
+
+            @app.before_request
+            def bind_shard():
+                self.activate_from_session()
+
+    def shard_path(self, shard_key):
+        return os.path.join(self.shard_dir, f'{shard_key}.sqlite')
+
+    def get_engine(self, shard_key):
+        """获取（必要时创建）分片引擎，首次创建时建立分片表结构"""
+        engine = self._engines.get(shard_key)
+        if engine is not None:
+            return engine
+        with self._lock:
+            engine = self._engines.get(shard_key)
+            if engine is None:
+                from app import db
+                engine = create_engine(f'sqlite:///{self.shard_path(shard_key)}')
+                tables = [t for t in db.metadata.sorted_tables if t.name not in GLOBAL_TABLES]
+                db.metadata.create_all(engine, tables=tables)
+                self._engines[shard_key] = engine
+        return engine
+
+    def create_shard(self):
+        """创建新的家庭分片，返回分片标识"""
+        shard_key = uuid.uuid4().hex[:12]
+        self.get_engine(shard_key)
+        return shard_key
+
+    def activate(self, shard_key):
+        """把当前请求的数据库会话绑定到指定分片"""
+        if not self.enabled or not shard_key:
+            return
+        if g.get('shard_key') == shard_key:
+            return
+        g.shard_key = shard_key
+        g.shard_engine = self.get_engine(shard_key)
+
+    def activate_from_session(self):
+        if self.enabled:
+            self.activate(session.get(SESSION_KEY))
+
+    def activate_for_username(self, username):
+        """登录时根据用户名查找并绑定分片，返回分片标识（未找到返回None）"""
+        if not self.enabled:
+            return None
+        entry = self.lookup(username)
+        if entry is None:
+            return None
+        self.activate(entry.shard_key)
+        return entry.shard_key
+
+    def remember(self):
+        """登录成功后把当前分片写入会话，供后续请求和load_user使用"""
+        if self.enabled and g.get('shard_key'):
+            session[SESSION_KEY] = g.shard_key
+
+    def forget(self):
+        session.pop(SESSION_KEY, None)
+
+    # 目录操作（非分片模式下均为空操作）
+    # 写入操作只加入会话，由调用方与用户/孩子的修改一起提交：提交前的flush中任一方违反唯一约束时
+    # 整体回滚，不会留下目录中没有登记（无法登录）的孩子，或目录与分片中不一致的用户名
+    def lookup(self, username):
+        if not self.enabled:
+            return None
+        from app.models import ShardDirectory
+        return ShardDirectory.query.filter_by(username=username).first()
+
+    def register(self, username, user_type, shard_key=None):
+        if not self.enabled:
+            return
+        from app import db
+        from app.models import ShardDirectory
+        db.session.add(ShardDirectory(
+            username=username,
+            user_type=user_type,
+            shard_key=shard_key or g.shard_key
+        ))
+
+    def rename(self, old_username, new_username):
+        if not self.enabled:
+            return
+        entry = self.lookup(old_username)
+        if entry is not None:
+            entry.username = new_username
+
+    def unregister(self, username):
+        if not self.enabled:
+            return
+        from app import db
+        entry = self.lookup(username)
+        if entry is not None:
+            db.session.delete(entry)
+
+    def dispose_all(self):
+        """释放所有分片引擎的连接（例如在fork之后）"""
+        for engine in list(self._engines.values()):
+            engine.dispose(close=False)
+
+
+shard_router = ShardRouter()
@@ -0,0 +1,117 @@
+"""
+单飞（single-flight）请求合并
+
+同一个键的计算正在进行时，其他调用方等待其结果，而不是重复执行同样的查询。
+进程内使用线程事件等待；可选的跨进程锁（文件锁或PostgreSQL咨询锁）让其他worker
+在计算完成后从共享缓存读取结果。
+"""
+import contextlib
+import hashlib
+import os
+import pickle
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows下没有fcntl，跨进程文件锁不可用
+    fcntl = None
+
+from sqlalchemy import text
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """进程内的请求合并"""
+
+    def __init__(self, timeout=30):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn):
+        """
+        执行fn并返回其结果；相同key的计算正在进行时等待该结果
+
+        等待方得到的是结果的副本（ORM对象不能在不同请求的会话之间共享）。
+        等待超时后自行计算。
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if call.done.wait(self.timeout) and call.error is None:
+                return pickle.loads(pickle.dumps(call.result, protocol=pickle.HIGHEST_PROTOCOL))
+            return fn()
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+
+def _key_hash(key):
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+@contextlib.contextmanager
+def file_lock(directory, key, timeout=30):
+    """同一主机上跨进程的互斥锁，超时后不再等待（返回False）"""
+    if fcntl is None:
+        yield True
+        return
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, _key_hash(key) + '.lock')
+    with open(path, 'w') as lock_file:
+        deadline = time.monotonic() + timeout
+        acquired = False
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                acquired = True
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    break
+                time.sleep(0.05)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+@contextlib.contextmanager
+def advisory_lock(session, key, timeout=30):
+    """PostgreSQL咨询锁（跨主机的worker之间互斥），其他数据库不加锁"""
+    if session.get_bind().dialect.name != 'postgresql':
+        yield True
+        return
+    lock_id = int(_key_hash(key)[:15], 16)
+    deadline = time.monotonic() + timeout
+    acquired = False
+    while True:
+        acquired = session.execute(text('SELECT pg_try_advisory_lock(:id)'), {'id': lock_id}).scalar()
+        if acquired or time.monotonic() >= deadline:
+            break
+        time.sleep(0.05)
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            session.execute(text('SELECT pg_advisory_unlock(:id)'), {'id': lock_id})
@@ -0,0 +1,74 @@
+"""
+跨数据库的SQL辅助函数
+
+分析查询需要按天、按月分组，而SQLite、PostgreSQL、MySQL的日期函数各不相同。
+这里的表达式在编译时根据方言生成对应的SQL，并统一返回字符串
+（按天为'YYYY-MM-DD'，按月为'YYYY-MM'），保证模板和调用方拿到的数据格式一致。
+"""
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import String, func, literal_column
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+
+class day_bucket(FunctionElement):
+    """按天分组的日期表达式，结果为'YYYY-MM-DD'字符串"""
+    type = String()
+    name = 'day_bucket'
+    inherit_cache = True
+
+
+class month_bucket(FunctionElement):
+    """按月分组的日期表达式，结果为'YYYY-MM'字符串"""
+    type = String()
+    name = 'month_bucket'
+    inherit_cache = True
+
+
+def _render(compiler, fn, element, fmt, **kw):
+    # 格式字符串用literal_column渲染，由编译器按驱动的参数风格处理百分号转义
+    return compiler.process(fn(*element.clauses, literal_column("'%s'" % fmt)), **kw)
+
+
+@compiles(day_bucket)
+def _day_bucket_default(element, compiler, **kw):
+    # PostgreSQL及其他支持to_char的数据库
+    return _render(compiler, func.to_char, element, 'YYYY-MM-DD', **kw)
+
+
+@compiles(day_bucket, 'sqlite')
+def _day_bucket_sqlite(element, compiler, **kw):
+    return compiler.process(func.date(*element.clauses), **kw)
+
+
+@compiles(day_bucket, 'mysql')
+def _day_bucket_mysql(element, compiler, **kw):
+    return _render(compiler, func.date_format, element, '%Y-%m-%d', **kw)
+
+
+@compiles(month_bucket)
+def _month_bucket_default(element, compiler, **kw):
+    return _render(compiler, func.to_char, element, 'YYYY-MM', **kw)
+
+
+@compiles(month_bucket, 'sqlite')
+def _month_bucket_sqlite(element, compiler, **kw):
+    # SQLite的strftime格式参数在前
+    return compiler.process(func.strftime(literal_column("'%Y-%m'"), *element.clauses), **kw)
+
+
+@compiles(month_bucket, 'mysql')
+def _month_bucket_mysql(element, compiler, **kw):
+    return _render(compiler, func.date_format, element, '%Y-%m', **kw)
+
+
+def day_bounds(day):
+    """
+    返回某一天的起止时间 [start, end)
+
+    用于替代 func.date(column) == day 这类比较：范围比较在所有数据库上含义一致，
+    并且可以使用日期列上的索引。
+    """
+    start = datetime.combine(day, time.min)
+    return start, start + timedelta(days=1)
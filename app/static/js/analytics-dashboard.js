@@ -0,0 +1,312 @@
+// 数据分析仪表盘图表
+// 图表数据由页面中id为dashboardData的JSON数据块提供，本文件不含模板变量，可长期缓存
+(function () {
+    const dataElement = document.getElementById('dashboardData');
+    if (!dataElement) {
+        return;
+    }
+    const dashboardData = JSON.parse(dataElement.textContent);
+
+    // 统一图表样式配置
+    Chart.defaults.font.family = '-apple-system, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif';
+    Chart.defaults.color = '#495057';
+    Chart.defaults.plugins.legend.position = 'top';
+    Chart.defaults.plugins.legend.labels.usePointStyle = true;
+    Chart.defaults.plugins.legend.labels.padding = 20;
+    Chart.defaults.plugins.tooltip.backgroundColor = 'rgba(0, 0, 0, 0.7)';
+    Chart.defaults.plugins.tooltip.padding = 12;
+    Chart.defaults.plugins.tooltip.titleFont.size = 14;
+    Chart.defaults.plugins.tooltip.bodyFont.size = 13;
+
+    // 连续完成天数趋势图
+    function renderStreakChart(streakNames) {
+        const streakCanvas = document.getElementById('streakChart');
+        if (!streakCanvas || !streakNames.length) {
+            return;
+        }
+        const datasets = streakNames.map(function (name, index) {
+            const n = index + 1;
+            return {
+                label: name,
+                data: [1, 2, 3, 4, 5, 6, 7],
+                borderColor: `rgba(${n * 60}, ${n * 80}, ${255 - n * 40}, 1)`,
+                backgroundColor: `rgba(${n * 60}, ${n * 80}, ${255 - n * 40}, 0.1)`,
+                tension: 0.1
+            };
+        });
+
+        new Chart(streakCanvas.getContext('2d'), {
+            type: 'line',
+            data: {
+                labels: ['周一', '周二', '周三', '周四', '周五', '周六', '周日'],
+                datasets: datasets
+            },
+            options: {
+                responsive: true,
+                maintainAspectRatio: false,
+                scales: {
+                    y: {
+                        beginAtZero: true,
+                        title: {
+                            display: true,
+                            text: '连续天数'
+                        }
+                    }
+                }
+            }
+        });
+    }
+
+    // 任务分类分布饼图
+    function renderCategoryChart(categories) {
+        const categoryCanvas = document.getElementById('categoryChart');
+        if (!categoryCanvas || !categories.labels.length) {
+            return;
+        }
+        const categoryColors = [
+            'rgba(255, 99, 132, 0.8)',
+            'rgba(54, 162, 235, 0.8)',
+            'rgba(255, 206, 86, 0.8)',
+            'rgba(75, 192, 192, 0.8)',
+            'rgba(153, 102, 255, 0.8)',
+            'rgba(255, 159, 64, 0.8)'
+        ];
+
+        new Chart(categoryCanvas.getContext('2d'), {
+            type: 'doughnut',
+            data: {
+                labels: categories.labels,
+                datasets: [{
+                    data: categories.counts,
+                    backgroundColor: categoryColors,
+                    borderColor: 'white',
+                    borderWidth: 2,
+                    hoverOffset: 10
+                }]
+            },
+            options: {
+                responsive: true,
+                maintainAspectRatio: false,
+                cutout: '65%',
+                plugins: {
+                    legend: {
+                        position: 'right',
+                        labels: {
+                            padding: 20,
+                            font: {
+                                size: 13
+                            }
+                        }
+                    },
+                    tooltip: {
+                        callbacks: {
+                            label: function (context) {
+                                const total = context.dataset.data.reduce((a, b) => a + b, 0);
+                                const percentage = ((context.parsed / total) * 100).toFixed(1);
+                                return `${context.label}: ${context.raw} 个任务 (${percentage}%)`;
+                            }
+                        }
+                    }
+                },
+                animation: {
+                    animateRotate: true,
+                    animateScale: true,
+                    duration: 2000,
+                    easing: 'easeOutQuart'
+                }
+            }
+        });
+    }
+
+    // 积分获取趋势线图
+    function renderPointsTrendChart(pointsTrend) {
+        const pointsCanvas = document.getElementById('pointsTrendChart');
+        if (!pointsCanvas || !pointsTrend.labels.length) {
+            return;
+        }
+
+        new Chart(pointsCanvas.getContext('2d'), {
+            type: 'line',
+            data: {
+                labels: pointsTrend.labels,
+                datasets: [{
+                    label: '每日积分',
+                    data: pointsTrend.points,
+                    backgroundColor: 'rgba(75, 192, 192, 0.2)',
+                    borderColor: 'rgba(75, 192, 192, 1)',
+                    borderWidth: 3,
+                    tension: 0.4,
+                    fill: true,
+                    pointBackgroundColor: 'rgba(75, 192, 192, 1)',
+                    pointRadius: 5,
+                    pointHoverRadius: 7,
+                    pointHoverBackgroundColor: 'white',
+                    pointHoverBorderColor: 'rgba(75, 192, 192, 1)',
+                    pointHoverBorderWidth: 2
+                }]
+            },
+            options: {
+                responsive: true,
+                maintainAspectRatio: false,
+                scales: {
+                    y: {
+                        beginAtZero: true,
+                        grid: {
+                            color: 'rgba(0, 0, 0, 0.05)'
+                        },
+                        ticks: {
+                            stepSize: 5
+                        },
+                        title: {
+                            display: true,
+                            text: '积分',
+                            font: {
+                                size: 14,
+                                weight: 'bold'
+                            }
+                        }
+                    },
+                    x: {
+                        grid: {
+                            display: false
+                        },
+                        title: {
+                            display: true,
+                            text: '日期',
+                            font: {
+                                size: 14,
+                                weight: 'bold'
+                            }
+                        }
+                    }
+                },
+                plugins: {
+                    legend: {
+                        display: false
+                    },
+                    tooltip: {
+                        callbacks: {
+                            label: function (context) {
+                                return `每日积分: ${context.parsed.y} 分`;
+                            }
+                        }
+                    }
+                },
+                interaction: {
+                    intersect: false,
+                    mode: 'index'
+                },
+                animation: {
+                    duration: 2000,
+                    easing: 'easeOutQuart'
+                }
+            }
+        });
+    }
+
+    // 习惯养成趋势图（使用时间范围内的所有数据）
+    function renderHabitChart(habitTimeline) {
+        const habitCanvas = document.getElementById('habitTrendChart');
+        if (!habitCanvas || !habitTimeline.labels.length) {
+            return;
+        }
+
+        new Chart(habitCanvas.getContext('2d'), {
+            type: 'line',
+            data: {
+                labels: habitTimeline.labels,
+                datasets: [{
+                    label: '每日完成任务数',
+                    data: habitTimeline.completed,
+                    backgroundColor: 'rgba(255, 99, 132, 0.2)',
+                    borderColor: 'rgba(255, 99, 132, 1)',
+                    borderWidth: 3,
+                    tension: 0.4,
+                    fill: true,
+                    pointBackgroundColor: 'rgba(255, 99, 132, 1)',
+                    pointRadius: 5,
+                    pointHoverRadius: 7,
+                    pointHoverBackgroundColor: 'white',
+                    pointHoverBorderColor: 'rgba(255, 99, 132, 1)',
+                    pointHoverBorderWidth: 2
+                }]
+            },
+            options: {
+                responsive: true,
+                maintainAspectRatio: false,
+                scales: {
+                    y: {
+                        beginAtZero: true,
+                        grid: {
+                            color: 'rgba(0, 0, 0, 0.05)'
+                        },
+                        title: {
+                            display: true,
+                            text: '完成任务数',
+                            font: {
+                                size: 14,
+                                weight: 'bold'
+                            }
+                        },
+                        ticks: {
+                            stepSize: 1,
+                            // 确保y轴范围至少到1，即使所有数据都是0
+                            callback: function (value) {
+                                if (value >= 0) return value;
+                                return '';
+                            }
+                        }
+                    },
+                    x: {
+                        grid: {
+                            display: false
+                        },
+                        title: {
+                            display: true,
+                            text: '日期',
+                            font: {
+                                size: 14,
+                                weight: 'bold'
+                            }
+                        }
+                    }
+                },
+                plugins: {
+                    tooltip: {
+                        mode: 'index',
+                        intersect: false,
+                        backgroundColor: 'rgba(0, 0, 0, 0.8)',
+                        titleColor: 'white',
+                        bodyColor: 'white',
+                        borderColor: 'rgba(255, 99, 132, 1)',
+                        borderWidth: 1,
+                        displayColors: false,
+                        callbacks: {
+                            label: function (context) {
+                                return `完成任务数: ${context.parsed.y}`;
+                            }
+                        }
+                    },
+                    legend: {
+                        display: true,
+                        position: 'top'
+                    }
+                },
+                interaction: {
+                    mode: 'nearest',
+                    axis: 'x',
+                    intersect: false
+                },
+                animation: {
+                    duration: 1000,
+                    easing: 'easeOutQuart'
+                }
+            }
+        });
+    }
+
+    renderStreakChart(dashboardData.streaks);
+    renderCategoryChart(dashboardData.categories);
+    renderPointsTrendChart(dashboardData.points_trend);
+    renderHabitChart(dashboardData.habit_timeline);
+})();
@@ -0,0 +1,5 @@
+// 移动端导航菜单切换
+function toggleMenu() {
+    const navMenu = document.getElementById('navMenu');
+    navMenu.style.display = navMenu.style.display === 'flex' ? 'none' : 'flex';
+}
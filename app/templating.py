@@ -0,0 +1,56 @@
+"""
+模板编译缓存与预热
+
+模板编译结果保存到文件系统字节码缓存（FileSystemBytecodeCache），新启动或被回收后
+重新创建的worker直接加载编译好的字节码。应用创建时预先加载 app/templates 和
+app/analytics/templates 中的全部模板，首个请求不再承担编译耗时；
+配合gunicorn的preload_app，预热只在主进程中进行一次，worker在fork后直接继承。
+
+配置（环境变量）：
+    TEMPLATE_CACHE_DIR  字节码缓存目录，默认为项目目录下的 .jinja_cache
+    TEMPLATE_WARMUP     是否在启动时预编译全部模板，默认true
+"""
+import logging
+import os
+import time
+
+from jinja2 import FileSystemBytecodeCache, TemplateError
+from jinja2.utils import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+def init_templates(app):
+    """为app.jinja_env配置字节码缓存"""
+    basedir = os.path.abspath(os.path.dirname(os.path.dirname(__file__)))
+    app.config.setdefault('TEMPLATE_CACHE_DIR',
+                          os.environ.get('TEMPLATE_CACHE_DIR', os.path.join(basedir, '.jinja_cache')))
+    app.config.setdefault('TEMPLATE_WARMUP', os.environ.get('TEMPLATE_WARMUP', 'true').lower() == 'true')
+
+    cache_dir = app.config['TEMPLATE_CACHE_DIR']
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+    except OSError as e:
+        logger.warning('无法创建模板缓存目录 %s: %s', cache_dir, e)
+        return
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+
+def warm_templates(app):
+    """预先加载（编译）全部模板，返回成功加载的数量"""
+    env = app.jinja_env
+    names = [name for name in env.list_templates() if name.endswith('.html')]
+    # 保证全部模板都能留在内存缓存中
+    if isinstance(env.cache, LRUCache) and env.cache.capacity < len(names):
+        env.cache.capacity = len(names) * 2
+
+    started = time.perf_counter()
+    loaded = 0
+    for name in names:
+        try:
+            env.get_template(name)
+            loaded += 1
+        except TemplateError as e:
+            logger.warning('模板 %s 预编译失败: %s', name, e)
+    logger.debug('已预编译模板 %d 个，耗时 %.1f ms', loaded, (time.perf_counter() - started) * 1000)
+    return loaded
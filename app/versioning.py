@@ -0,0 +1,263 @@
+"""
+数据版本与条件请求（ETag / 304）
+
+每次写入数据库时，在同一事务内递增受影响范围的版本号：
+    global          任务、奖励、勋章、学习资源等所有家庭共享的数据
+    family:<id>     家长账户及其所有孩子的数据
+    child:<id>      单个孩子的数据（任务记录、勋章、连续记录、积分、学习进度等）
+页面和JSON接口根据相关范围的版本号生成强ETag，浏览器携带匹配的If-None-Match时
+直接返回304，不再执行视图中的查询和模板渲染。
+"""
+import hashlib
+import os
+from datetime import date
+from functools import wraps
+
+from flask import current_app, g, has_request_context, make_response, request, session
+from flask_login import current_user
+from sqlalchemy import event, inspect, select, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from app.models import Child, DataVersion, ShardDirectory, User
+from app.sharding import ShardedSession
+
+GLOBAL_SCOPE = 'global'
+
+# 不影响页面内容的模型
+_IGNORED_MODELS = (DataVersion, ShardDirectory)
+
+# 各数据库引擎是否已有data_version表（未运行init_db升级时不影响写入）
+_table_checked = {}
+
+
+def family_scope(user_id):
+    return f'family:{user_id}'
+
+
+def child_scope(child_id):
+    return f'child:{child_id}'
+
+
+def user_scopes():
+    """当前登录用户对应的版本范围：家长为家庭范围，孩子为自身范围"""
+    if hasattr(current_user, 'children'):
+        return [family_scope(current_user.id)]
+    return [child_scope(current_user.id)]
+
+
+def visible_child_scopes(child_id):
+    """
+    URL中指定孩子的版本范围（conditional_get的scopes_func）
+
+    孩子不存在或当前用户无权查看时返回None，不做条件请求处理，由视图自己的权限检查返回403或跳转，
+    否则其他家庭的用户可以通过304探测孩子的数据是否变化。
+    """
+    try:
+        child_id = int(child_id)
+    except (TypeError, ValueError):
+        return None
+    if hasattr(current_user, 'children'):
+        owner = db.session.query(Child.user_id).filter(Child.id == child_id).scalar()
+        if owner is None or owner != current_user.id:
+            return None
+    elif child_id != current_user.id:
+        return None
+    return [child_scope(child_id)]
+
+
+def _affected_scopes(session):
+    """根据本次flush中变更的对象计算需要递增的版本范围"""
+    scopes = set()
+    child_ids = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, _IGNORED_MODELS):
+            continue
+        if isinstance(obj, Child):
+            scopes.add(child_scope(obj.id))
+            scopes.add(family_scope(obj.user_id))
+        elif isinstance(obj, User):
+            scopes.add(family_scope(obj.id))
+        elif getattr(obj, 'child_id', None) is not None:
+            child_ids.add(obj.child_id)
+        else:
+            scopes.add(GLOBAL_SCOPE)
+
+    if child_ids:
+        scopes.update(child_scope(child_id) for child_id in child_ids)
+        rows = session.execute(
+            select(Child.user_id).where(Child.id.in_(child_ids))
+        ).all()
+        scopes.update(family_scope(row.user_id) for row in rows)
+    return scopes
+
+
+def _has_version_table(conn):
+    key = conn.engine.url
+    if key not in _table_checked:
+        _table_checked[key] = inspect(conn).has_table(DataVersion.__tablename__)
+    return _table_checked[key]
+
+
+def _bump_versions(conn, scopes):
+    table = DataVersion.__table__
+    dialect = conn.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert
+        stmt = insert(table).values([{'scope': scope, 'version': 1} for scope in scopes])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.scope],
+            set_={'version': table.c.version + 1}
+        )
+        conn.execute(stmt)
+        return
+
+    for scope in scopes:
+        result = conn.execute(
+            update(table).where(table.c.scope == scope).values(version=table.c.version + 1)
+        )
+        if result.rowcount == 0:
+            conn.execute(table.insert().values(scope=scope, version=1))
+
+
+@event.listens_for(ShardedSession, 'after_flush')
+def _on_after_flush(session, flush_context):
+    scopes = _affected_scopes(session)
+    if not scopes:
+        return
+    conn = session.connection(bind_arguments={'mapper': DataVersion})
+    if _has_version_table(conn):
+        _bump_versions(conn, sorted(scopes))
+        # 本请求中已读取的版本号失效
+        if has_request_context():
+            g.pop('data_versions', None)
+
+
+def bump_children(conn, child_ids):
+    """
+    递增孩子及其家庭的版本号
+
+    用于不经过ORM对象的批量写入（例如补发勋章），普通写入在flush时自动递增。
+    """
+    child_ids = sorted(set(child_ids))
+    if not child_ids or not _has_version_table(conn):
+        return
+    scopes = {child_scope(child_id) for child_id in child_ids}
+    rows = conn.execute(select(Child.user_id).where(Child.id.in_(child_ids))).all()
+    scopes.update(family_scope(row.user_id) for row in rows)
+    _bump_versions(conn, sorted(scopes))
+    if has_request_context():
+        g.pop('data_versions', None)
+
+
+def get_versions(scopes):
+    """
+    一次查询读取多个范围的版本号（不存在的范围视为0）
+
+    请求内读取过的版本号保存在g.data_versions中，ETag和多个模板片段共用，写入后自动失效。
+    """
+    known = g.setdefault('data_versions', {}) if has_request_context() else {}
+    missing = [scope for scope in scopes if scope not in known]
+    if missing:
+        rows = db.session.query(DataVersion.scope, DataVersion.version).filter(
+            DataVersion.scope.in_(missing)
+        ).all()
+        known.update(dict.fromkeys(missing, 0))
+        known.update({row.scope: row.version for row in rows})
+    return {scope: known[scope] for scope in scopes}
+
+
+def version_key(scope):
+    """缓存键中的版本部分（模板片段、分析结果）：代码版本、分片、全局和指定范围的版本号"""
+    versions = get_versions([GLOBAL_SCOPE, scope])
+    return '{}:{}:{}:{}'.format(
+        template_fingerprint(current_app._get_current_object()),
+        g.get('shard_key', ''),
+        versions[GLOBAL_SCOPE],
+        versions[scope]
+    )
+
+
+def template_fingerprint(app):
+    """模板和代码的最后修改时间（或环境变量ETAG_SALT），部署新版本后ETag随之变化"""
+    fingerprint = app.extensions.get('etag_fingerprint')
+    if fingerprint is None:
+        latest = 0
+        for dirpath, _, filenames in os.walk(app.root_path):
+            for filename in filenames:
+                if filename.endswith(('.html', '.py')):
+                    latest = max(latest, os.path.getmtime(os.path.join(dirpath, filename)))
+        fingerprint = os.environ.get('ETAG_SALT') or str(int(latest))
+        app.extensions['etag_fingerprint'] = fingerprint
+    return fingerprint
+
+
+def compute_etag(scopes, extra=''):
+    versions = get_versions([GLOBAL_SCOPE] + list(scopes))
+    parts = [
+        template_fingerprint(current_app._get_current_object()),
+        current_user.get_id() if current_user.is_authenticated else '',
+        request.full_path,
+        # 分析数据和连续状态与当天日期有关
+        date.today().isoformat(),
+        extra,
+        ','.join(f'{scope}={versions[scope]}' for scope in sorted(versions))
+    ]
+    return hashlib.sha1('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def _matching_etag(etag):
+    """返回If-None-Match中与etag匹配的值（包括压缩后带编码后缀的版本）"""
+    for candidate in (etag, f'{etag}-br', f'{etag}-gzip'):
+        if candidate in request.if_none_match:
+            return candidate
+    return None
+
+
+def conditional_get(scopes_func, vary=None):
+    """
+    为GET请求添加ETag支持的装饰器（放在login_required之后）
+
+    Args:
+        scopes_func: 接收视图参数、返回版本范围列表的函数；返回None时不做条件请求处理
+        vary: 可选，返回额外影响页面内容的字符串的函数（如分析快照的生成时间）
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # 有待显示的提示消息时必须重新渲染页面
+            if request.method != 'GET' or session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            scopes = scopes_func(**kwargs)
+            if scopes is None:
+                return view(*args, **kwargs)
+
+            try:
+                etag = compute_etag(scopes, vary() if vary else '')
+            except SQLAlchemyError:
+                # data_version表尚未创建（未运行init_db升级）时退化为普通请求
+                db.session.rollback()
+                return view(*args, **kwargs)
+
+            matched = _matching_etag(etag)
+            if matched:
+                response = current_app.response_class(status=304)
+                etag = matched
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                if g.get('data_as_of') is not None:
+                    # 页面使用了旧数据（后台正在重新计算），不能让浏览器按当前版本号缓存
+                    response.headers['Cache-Control'] = 'private, no-store'
+                    return response
+            response.set_etag(etag)
+            # 私有缓存，每次使用前向服务器验证
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator
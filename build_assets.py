@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+静态资源构建脚本
+
+把 app/static 下的CSS和JS文件复制为带内容哈希的文件（app/static/dist/），
+生成gzip和Brotli（需安装brotli）预压缩版本，并写出 manifest.json 供 asset_url() 使用。
+部署或修改静态文件后运行: python build_assets.py
+"""
+
+import gzip
+import json
+import logging
+import os
+import shutil
+import sys
+
+from app.assets import DIST_DIR, MANIFEST_NAME, content_hash
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('build_assets')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'app', 'static')
+
+# 需要构建的资源类型
+ASSET_EXTENSIONS = ('.css', '.js')
+
+# 被CSS以相对路径引用的文件（如字体），按原路径复制到dist目录
+COPY_EXTENSIONS = ('.woff', '.woff2', '.ttf', '.eot', '.otf', '.svg')
+
+# 已经是压缩格式、无需预压缩的文件
+COMPRESSED_EXTENSIONS = ('.woff', '.woff2')
+
+
+def iter_sources(extensions):
+    """遍历static目录（dist目录除外）中指定类型的文件，返回相对路径"""
+    for dirpath, dirnames, filenames in os.walk(STATIC_DIR):
+        if dirpath == STATIC_DIR and DIST_DIR in dirnames:
+            dirnames.remove(DIST_DIR)
+        for filename in sorted(filenames):
+            if filename.endswith(extensions):
+                yield os.path.relpath(os.path.join(dirpath, filename), STATIC_DIR).replace(os.sep, '/')
+
+
+def precompress(path):
+    """以最高压缩级别生成 .gz 和 .br 文件"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path + '.gz', 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    if brotli is not None:
+        with open(path + '.br', 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+
+
+def build():
+    dist_dir = os.path.join(STATIC_DIR, DIST_DIR)
+    # 清除上次构建的结果
+    shutil.rmtree(dist_dir, ignore_errors=True)
+    os.makedirs(dist_dir)
+
+    # 字体等文件保持原文件名（所在目录带版本号），使CSS中的相对路径在dist中仍然有效
+    for source in iter_sources(COPY_EXTENSIONS):
+        target_path = os.path.join(dist_dir, source)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        shutil.copyfile(os.path.join(STATIC_DIR, source), target_path)
+        if not source.endswith(COMPRESSED_EXTENSIONS):
+            precompress(target_path)
+
+    manifest = {}
+    for source in iter_sources(ASSET_EXTENSIONS):
+        source_path = os.path.join(STATIC_DIR, source)
+        name, ext = os.path.splitext(source)
+        target = f'{DIST_DIR}/{name}.{content_hash(source_path)}{ext}'
+        target_path = os.path.join(STATIC_DIR, target)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        shutil.copyfile(source_path, target_path)
+        precompress(target_path)
+        manifest[source] = target
+        logger.info('%s -> %s', source, target)
+
+    with open(os.path.join(dist_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    if brotli is None:
+        logger.warning('未安装brotli，只生成了gzip预压缩文件（pip install Brotli）')
+    logger.info('构建完成，共 %d 个文件', len(manifest))
+    return manifest
+
+
+def main():
+    build()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+家庭分片创建脚本
+
+分片模式（SHARDING_ENABLED=true）下，每个家长账户及其孩子保存在独立的SQLite文件中。
+此脚本用于创建新的家庭分片及其家长账户，或把现有的单库数据导入为一个分片。
+
+运行方式:
+    SHARDING_ENABLED=true python create_family_shard.py <用户名> <密码>
+    SHARDING_ENABLED=true python create_family_shard.py --import-legacy
+"""
+
+import argparse
+import logging
+import shutil
+import sys
+
+from werkzeug.security import generate_password_hash
+
+from app import create_app, db, shard_router
+from app.models import User, Child
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('create_family_shard')
+
+
+def create_family(username, password):
+    """创建新的家庭分片并在其中创建家长账户"""
+    if shard_router.lookup(username):
+        logger.error(f'用户名 {username} 已存在')
+        return False
+
+    shard_key = shard_router.create_shard()
+    shard_router.activate(shard_key)
+
+    user = User(username=username, password=generate_password_hash(password))
+    db.session.add(user)
+    shard_router.register(username, 1, shard_key)
+    db.session.commit()
+
+    logger.info(f'家庭分片 {shard_key} 已创建，家长账户: {username}')
+    return True
+
+
+def import_legacy(database_path):
+    """把现有的单库数据复制为一个分片，并登记其中所有家长和孩子的用户名"""
+    shard_key = shard_router.create_shard()
+    # create_shard已建立空表结构，这里用现有数据库整体覆盖
+    shard_router.get_engine(shard_key).dispose()
+    shutil.copyfile(database_path, shard_router.shard_path(shard_key))
+    shard_router.activate(shard_key)
+
+    usernames = [(u.username, 1) for u in User.query.all()] + \
+                [(c.username, 2) for c in Child.query.all()]
+    for username, user_type in usernames:
+        if shard_router.lookup(username):
+            logger.warning(f'用户名 {username} 已在目录中，跳过')
+            continue
+        shard_router.register(username, user_type, shard_key)
+    db.session.commit()
+
+    logger.info(f'已导入 {database_path} 为分片 {shard_key}，登记用户名 {len(usernames)} 个')
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='创建家庭分片')
+    parser.add_argument('username', nargs='?', help='家长用户名')
+    parser.add_argument('password', nargs='?', help='家长密码')
+    parser.add_argument('--import-legacy', action='store_true', help='把现有单库数据导入为一个分片')
+    args = parser.parse_args()
+
+    app = create_app()
+    if not app.config['SHARDING_ENABLED']:
+        print('错误: 请先设置环境变量 SHARDING_ENABLED=true')
+        return 1
+
+    with app.app_context():
+        # 确保全局数据库中存在分片目录表
+        db.create_all()
+        if args.import_legacy:
+            database_path = db.engine.url.database
+            success = import_legacy(database_path)
+        elif args.username and args.password:
+            success = create_family(args.username, args.password)
+        else:
+            parser.print_help()
+            return 1
+
+    return 0 if success else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
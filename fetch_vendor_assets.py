@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+前端依赖下载脚本
+
+把固定版本的Bootstrap、Font Awesome（含字体）和Chart.js下载到 app/static/vendor/，
+使内网或离线部署时页面不再依赖CDN。每个文件都按随代码提交的 app/static/vendor/vendor.lock.json
+中的SRI哈希校验，哈希不一致或没有锁定哈希的文件不会写入。
+版本和地址定义在 app/assets.py 的 VENDOR_ASSETS 中。升级版本时修改地址后运行 --pin，
+核对下载的文件后提交新的 vendor.lock.json。
+
+运行方式（在可以访问外网的机器上执行，然后把 app/static/vendor 目录随代码一起部署）:
+    python fetch_vendor_assets.py [--force] [--pin]
+    python build_assets.py
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import urllib.request
+
+from app.assets import VENDOR_ASSETS, VENDOR_EXTRA_FILES, VENDOR_LOCK, load_vendor_lock, matches_pin, sri_hash
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('fetch_vendor_assets')
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(BASE_DIR, 'app', 'static')
+LOCK_PATH = os.path.join(STATIC_DIR, VENDOR_LOCK)
+
+
+def download(url):
+    with urllib.request.urlopen(url, timeout=30) as response:
+        return response.read()
+
+
+def fetch_all(force=False, pin=False):
+    lock = load_vendor_lock(STATIC_DIR)
+    files = [(path, url) for path, url in VENDOR_ASSETS.values()] + VENDOR_EXTRA_FILES
+    failed = 0
+    pinned = 0
+
+    for path, url in files:
+        local_path = os.path.join(STATIC_DIR, path)
+        if os.path.isfile(local_path) and not force:
+            with open(local_path, 'rb') as f:
+                data = f.read()
+            source = '本地文件'
+        else:
+            try:
+                data = download(url)
+            except OSError as e:
+                logger.error('下载失败 %s: %s', url, e)
+                failed += 1
+                continue
+            source = url
+
+        if path in lock:
+            if not matches_pin(data, lock[path]):
+                logger.error('校验失败 %s（%s）: 期望 %s，实际 %s', path, source, lock[path], sri_hash(data))
+                failed += 1
+                continue
+        elif pin:
+            lock[path] = sri_hash(data)
+            pinned += 1
+            logger.info('已锁定 %s: %s', path, lock[path])
+        else:
+            logger.error('%s 没有锁定哈希，未写入（核对来源后运行 --pin 记录哈希）', path)
+            failed += 1
+            continue
+
+        if source == url:
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            with open(local_path, 'wb') as f:
+                f.write(data)
+            logger.info('已下载: %s (%d 字节)', path, len(data))
+        else:
+            logger.info('已存在，校验通过: %s', path)
+
+    if pinned:
+        os.makedirs(os.path.dirname(LOCK_PATH), exist_ok=True)
+        with open(LOCK_PATH, 'w', encoding='utf-8') as f:
+            json.dump(lock, f, indent=2, sort_keys=True)
+            f.write('\n')
+        logger.info('已更新 %s，请核对后随代码提交', VENDOR_LOCK)
+    return failed == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='下载固定版本的前端依赖')
+    parser.add_argument('--force', action='store_true', help='重新下载已存在的文件')
+    parser.add_argument('--pin', action='store_true', help='为没有锁定哈希的文件记录当前内容的哈希')
+    args = parser.parse_args()
+
+    if not fetch_all(force=args.force, pin=args.pin):
+        return 1
+    logger.info('完成，请运行 python build_assets.py 生成带指纹的文件')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
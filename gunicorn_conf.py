@@ -31,6 +31,18 @@ errorlog = '/www/wwwlogs/python/成长奖励系统/gunicorn_error.log'
 # critical:严重错误消息；
 loglevel = 'info' 
 
+# WSGI应用入口
+wsgi_app = 'wsgi:application'
+
+# 在主进程中预加载应用，worker通过写时复制共享已导入的模块和编译结果
+preload_app = True
+
+# fork之后释放继承自主进程的数据库连接，每个worker使用自己的连接池
+def post_fork(server, worker):
+    from wsgi import application
+    from app import dispose_engines
+    dispose_engines(application)
+
 # 自定义设置项请写到该处
 # 最好以上面相同的格式 <注释 + 换行 + key = value> 进行书写， 
 # PS: gunicorn 的配置文件是python扩展形式，即".py"文件，需要注意遵从python语法，
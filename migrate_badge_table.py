@@ -1,52 +1,99 @@
-from app import create_app, db
-from sqlalchemy import text
+from app import create_app, db, shard_router
+from app.models import Badge, ChildBadge
+from sqlalchemy import MetaData, inspect, text
+import glob
+import os
 import sys
 
 # 创建应用实例
 app = create_app()
 
+# 需要补充的字段：字段名 -> 列定义（SQLite和PostgreSQL通用）
+BADGE_COLUMNS = [
+    ('level', "VARCHAR(32) NOT NULL DEFAULT '初级'"),
+    ('points_reward', 'INTEGER DEFAULT 10'),
+    ('completions_required', 'INTEGER DEFAULT 0'),
+    # 勋章规则（见app/badge_rules.py）
+    ('rule_type', 'VARCHAR(32)'),
+    ('rule_threshold', 'INTEGER DEFAULT 0'),
+    ('rule_period', "VARCHAR(16) DEFAULT 'all'"),
+    ('category_id', 'INTEGER REFERENCES task_category (id)'),
+    ('learning_category_id', 'INTEGER REFERENCES learning_category (id)'),
+]
+
+def relax_task_id(engine):
+    """规则勋章可以不关联任务：去掉task_id的NOT NULL约束"""
+    columns = {col['name']: col for col in inspect(engine).get_columns('badge')}
+    if columns['task_id']['nullable']:
+        print("task_id字段已允许为空")
+        return
+    with engine.begin() as conn:
+        if engine.dialect.name != 'sqlite':
+            conn.execute(text("ALTER TABLE badge ALTER COLUMN task_id DROP NOT NULL"))
+        else:
+            # SQLite不能修改列约束，按模型新建表后复制数据再替换
+            metadata = MetaData()
+            # 外键引用的表需要在同一个MetaData中
+            for table in db.metadata.sorted_tables:
+                if table.name != 'badge':
+                    table.to_metadata(metadata)
+            new_table = Badge.__table__.to_metadata(metadata, name='badge_new')
+            new_table.create(conn)
+            names = ', '.join(name for name in columns if name in new_table.c)
+            conn.execute(text(f"INSERT INTO badge_new ({names}) SELECT {names} FROM badge"))
+            conn.execute(text("DROP TABLE badge"))
+            conn.execute(text("ALTER TABLE badge_new RENAME TO badge"))
+    print("task_id字段已改为允许为空")
+
+def add_child_badge_unique_index(engine):
+    """每个孩子每个勋章只保留一条获得记录，并创建 (孩子, 勋章) 唯一索引"""
+    inspector = inspect(engine)
+    if not inspector.has_table('child_badge'):
+        return
+    index = next(index for index in ChildBadge.__table__.indexes if index.name == 'ix_child_badge_child_badge')
+    if index.name in {item['name'] for item in inspector.get_indexes('child_badge')}:
+        print("勋章唯一索引已存在")
+        return
+    with engine.begin() as conn:
+        # 重复的获得记录保留最早的一条（重复发放的积分不回收）
+        removed = conn.execute(text(
+            "DELETE FROM child_badge WHERE id NOT IN "
+            "(SELECT keep_id FROM (SELECT MIN(id) AS keep_id FROM child_badge GROUP BY child_id, badge_id) AS keep)"
+        )).rowcount
+        if removed:
+            print(f"已删除{removed}条重复的勋章获得记录")
+        index.create(conn)
+    print("已创建勋章唯一索引")
+
+def migrate_engine(engine):
+    # 通过检查表结构判断字段是否存在，而不依赖特定数据库的错误信息
+    existing_columns = {col['name'] for col in inspect(engine).get_columns('badge')}
+
+    for column_name, column_def in BADGE_COLUMNS:
+        if column_name in existing_columns:
+            print(f"{column_name}字段已存在")
+            continue
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE badge ADD COLUMN {column_name} {column_def}"))
+        print(f"已添加{column_name}字段")
+
+    relax_task_id(engine)
+    add_child_badge_unique_index(engine)
+
 def migrate_badge_table():
     with app.app_context():
         try:
-            # 直接使用db.session执行SQL
-            # 添加level字段
-            try:
-                db.session.execute(text("ALTER TABLE badge ADD COLUMN level VARCHAR(32) NOT NULL DEFAULT '初级'"))
-                db.session.commit()
-                print("已添加level字段")
-            except Exception as e:
-                db.session.rollback()
-                if 'duplicate column name' in str(e).lower() or 'duplicate column' in str(e).lower():
-                    print("level字段已存在")
-                else:
-                    raise
-            
-            # 添加points_reward字段
-            try:
-                db.session.execute(text("ALTER TABLE badge ADD COLUMN points_reward INTEGER DEFAULT 10"))
-                db.session.commit()
-                print("已添加points_reward字段")
-            except Exception as e:
-                db.session.rollback()
-                if 'duplicate column name' in str(e).lower() or 'duplicate column' in str(e).lower():
-                    print("points_reward字段已存在")
-                else:
-                    raise
-            
-            # 添加completions_required字段
-            try:
-                db.session.execute(text("ALTER TABLE badge ADD COLUMN completions_required INTEGER DEFAULT 0"))
-                db.session.commit()
-                print("已添加completions_required字段")
-            except Exception as e:
-                db.session.rollback()
-                if 'duplicate column name' in str(e).lower() or 'duplicate column' in str(e).lower():
-                    print("completions_required字段已存在")
-                else:
-                    raise
-            
+            if shard_router.enabled:
+                # 分片模式下依次处理每个家庭分片
+                for path in sorted(glob.glob(os.path.join(shard_router.shard_dir, '*.sqlite'))):
+                    shard_key = os.path.splitext(os.path.basename(path))[0]
+                    print(f"处理分片 {shard_key}")
+                    migrate_engine(shard_router.get_engine(shard_key))
+            else:
+                migrate_engine(db.engine)
+
             print("数据库迁移完成！")
-            
+
         except Exception as e:
             print(f"数据库迁移时发生错误: {str(e)}")
             import traceback
@@ -54,4 +101,4 @@ def migrate_badge_table():
             sys.exit(1)
 
 if __name__ == '__main__':
-    migrate_badge_table()
\ No newline at end of file
+    migrate_badge_table()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+启动耗时分析脚本
+
+在独立的Python进程中导入wsgi模块（与gunicorn/uWSGI的worker启动过程一致），
+输出总启动耗时以及按累计导入时间排序的模块列表（基于 python -X importtime）。
+运行方式: python profile_startup.py [--top 20]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# worker启动耗时目标（毫秒）
+TARGET_MS = 200
+
+BOOT_SNIPPET = (
+    'import time; t = time.perf_counter(); import wsgi; '
+    'print("BOOT_MS=%.1f" % ((time.perf_counter() - t) * 1000))'
+)
+
+
+def run_import_profile():
+    """导入wsgi并收集-X importtime输出，返回(启动耗时毫秒, [(累计微秒, 自身微秒, 模块名)])"""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ)
+    # 只统计导入耗时，不输出调试日志
+    env.setdefault('LOG_LEVEL', 'WARNING')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', BOOT_SNIPPET],
+        cwd=base_dir, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        print(result.stderr)
+        raise SystemExit('导入wsgi失败')
+
+    boot_ms = None
+    for line in result.stdout.splitlines():
+        if line.startswith('BOOT_MS='):
+            boot_ms = float(line.split('=', 1)[1])
+
+    modules = []
+    for line in result.stderr.splitlines():
+        # 格式: import time:   self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        try:
+            self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+            modules.append((int(cumulative_us), int(self_us), name.rstrip()))
+        except ValueError:
+            continue
+    return boot_ms, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description='分析worker启动耗时')
+    parser.add_argument('--top', type=int, default=20, help='显示累计耗时最多的模块数量')
+    args = parser.parse_args()
+
+    boot_ms, modules = run_import_profile()
+
+    print('=== 导入耗时（按累计时间排序）===')
+    print(f'{"累计(ms)":>10} {"自身(ms)":>10}  模块')
+    for cumulative_us, self_us, name in sorted(modules, reverse=True)[:args.top]:
+        print(f'{cumulative_us / 1000:>10.1f} {self_us / 1000:>10.1f}  {name}')
+
+    # 项目自身模块（app包和wsgi入口）的导入耗时，其余为第三方库
+    project_us = sum(self_us for _, self_us, name in modules
+                     if name.strip() in ('wsgi', 'app') or name.strip().startswith('app.'))
+    third_party_us = sum(self_us for _, self_us, _ in modules) - project_us
+
+    print()
+    print(f'项目模块导入耗时: {project_us / 1000:.1f} ms')
+    print(f'第三方库导入耗时: {third_party_us / 1000:.1f} ms')
+    print(f'wsgi导入及应用创建总耗时: {boot_ms:.1f} ms（目标 < {TARGET_MS} ms）')
+    print('提示: gunicorn启用preload_app后以上耗时只在主进程发生一次，worker在fork后无需重新导入')
+    return 0 if boot_ms is not None and boot_ms < TARGET_MS else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
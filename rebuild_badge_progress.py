@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+重建勋章进度
+
+创建child_badge_progress表（如不存在），并根据连续记录、完成次数、勋章规则和已获得的勋章
+重新计算每个 (孩子, 任务) 的下一个勋章及进度。之后的写入会自动维护进度，
+只需在升级后或怀疑数据不一致时运行一次。分片模式下依次处理每个家庭分片。
+运行方式: python rebuild_badge_progress.py
+"""
+
+import glob
+import logging
+import os
+import sys
+
+from app import create_app, db, shard_router
+from app import badge_progress
+from app.models import ChildBadgeProgress
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('rebuild_badge_progress')
+
+
+def rebuild_engine(engine, label):
+    ChildBadgeProgress.__table__.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        count = badge_progress.refresh(conn, all_children=True)
+    logger.info(f'{label}: 写入 {count} 行勋章进度')
+
+
+def main():
+    app = create_app()
+    with app.app_context():
+        if shard_router.enabled:
+            paths = sorted(glob.glob(os.path.join(shard_router.shard_dir, '*.sqlite')))
+            for path in paths:
+                shard_key = os.path.splitext(os.path.basename(path))[0]
+                rebuild_engine(shard_router.get_engine(shard_key), f'分片 {shard_key}')
+            logger.info(f'共处理 {len(paths)} 个家庭分片')
+        else:
+            rebuild_engine(db.engine, '主数据库')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
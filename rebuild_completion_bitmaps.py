@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+重建任务完成位图
+
+创建completion_bitmap表（如不存在），并根据全部已确认的任务记录重新生成每个
+(孩子, 任务, 年份) 的完成位图。之后的新增、确认、修改和删除会自动维护位图，
+只需在升级后或怀疑数据不一致时运行一次。分片模式下依次处理每个家庭分片。
+运行方式: python rebuild_completion_bitmaps.py
+"""
+
+import glob
+import logging
+import os
+import sys
+
+from app import create_app, db, shard_router
+from app import bitmaps
+from app.models import CompletionBitmap
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('rebuild_completion_bitmaps')
+
+
+def rebuild_engine(engine, label):
+    CompletionBitmap.__table__.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        count = bitmaps.rebuild(conn)
+    logger.info(f'{label}: 写入 {count} 行完成位图')
+
+
+def main():
+    app = create_app()
+    with app.app_context():
+        if shard_router.enabled:
+            paths = sorted(glob.glob(os.path.join(shard_router.shard_dir, '*.sqlite')))
+            for path in paths:
+                shard_key = os.path.splitext(os.path.basename(path))[0]
+                rebuild_engine(shard_router.get_engine(shard_key), f'分片 {shard_key}')
+            logger.info(f'共处理 {len(paths)} 个家庭分片')
+        else:
+            rebuild_engine(db.engine, '主数据库')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
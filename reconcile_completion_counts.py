@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+核对任务完成次数
+
+检查TaskStreak.total_completions和按月完成次数（task_completion_month表）是否与
+已确认的任务记录一致，--fix 时按任务记录修正。缺少计数列或计数表时先创建，
+因此升级后运行一次 --fix 即可完成初始化。分片模式下依次处理每个家庭分片。
+运行方式: python reconcile_completion_counts.py [--fix]
+"""
+
+import argparse
+import glob
+import logging
+import os
+import sys
+
+from sqlalchemy import inspect, text
+
+from app import create_app, db, shard_router
+from app import counters
+from app.models import TaskCompletionMonth
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('reconcile_completion_counts')
+
+
+def ensure_schema(engine):
+    """添加total_completions列和task_completion_month表（如不存在）"""
+    columns = [col['name'] for col in inspect(engine).get_columns('task_streak')]
+    if 'total_completions' not in columns:
+        logger.info('添加total_completions列到task_streak表')
+        with engine.begin() as conn:
+            conn.execute(text('ALTER TABLE task_streak ADD COLUMN total_completions INTEGER NOT NULL DEFAULT 0'))
+    TaskCompletionMonth.__table__.create(engine, checkfirst=True)
+
+
+def reconcile_engine(engine, label, fix):
+    ensure_schema(engine)
+    with engine.begin() as conn:
+        mismatches = counters.reconcile(conn, fix=fix)
+    for kind, key, recorded, actual in mismatches[:20]:
+        logger.info(f'{label}: {kind} {key} 记录 {recorded}，实际 {actual}')
+    if len(mismatches) > 20:
+        logger.info(f'{label}: ……共 {len(mismatches)} 处不一致')
+    if not mismatches:
+        logger.info(f'{label}: 完成次数与任务记录一致')
+    elif fix:
+        logger.info(f'{label}: 已修正 {len(mismatches)} 处不一致')
+    return len(mismatches)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='核对任务完成次数')
+    parser.add_argument('--fix', action='store_true', help='按任务记录修正不一致的计数')
+    args = parser.parse_args()
+
+    app = create_app()
+    total = 0
+    with app.app_context():
+        if shard_router.enabled:
+            for path in sorted(glob.glob(os.path.join(shard_router.shard_dir, '*.sqlite'))):
+                shard_key = os.path.splitext(os.path.basename(path))[0]
+                total += reconcile_engine(shard_router.get_engine(shard_key), f'分片 {shard_key}', args.fix)
+        else:
+            total += reconcile_engine(db.engine, '主数据库', args.fix)
+    # 只检查时发现不一致返回1，便于在计划任务中报警
+    return 1 if total and not args.fix else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
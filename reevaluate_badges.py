@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+按当前规则重新评估勋章
+
+对全部孩子评估指定（或全部）勋章的规则，为已满足条件但尚未获得的孩子补发勋章并奖励积分，
+例如降低了勋章要求、或新增的勋章对孩子已有的历史记录已经满足时。
+所有勋章的评估合并为一次查询，已获得的勋章不会重复颁发，可以重复运行。
+新增或修改勋章时网页会自动对该勋章执行一次。分片模式下依次处理每个家庭分片。
+运行方式: python reevaluate_badges.py [--badge 勋章ID ...] [--dry-run]
+"""
+
+import argparse
+import glob
+import logging
+import os
+import sys
+
+from sqlalchemy.orm import Session
+
+from app import create_app, db, shard_router
+from app import badge_rules
+from app.models import Badge
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('reevaluate_badges')
+
+
+def reevaluate_engine(engine, label, badge_ids, dry_run):
+    with Session(engine) as session:
+        query = session.query(Badge).order_by(Badge.id)
+        if badge_ids:
+            query = query.filter(Badge.id.in_(badge_ids))
+        badges = query.all()
+        results = badge_rules.backfill(session, badges, dry_run=dry_run)
+        if not dry_run:
+            session.commit()
+
+    action = '可补发' if dry_run else '已补发'
+    for result in results:
+        logger.info(f'{label}: {action}「{result.badge_name}」(ID {result.badge_id}) 给 '
+                    f'{len(result.child_ids)} 个孩子 {result.child_ids}，每人 {result.points_reward} 积分')
+    if not results:
+        logger.info(f'{label}: 评估 {len(badges)} 个勋章，没有需要补发的勋章')
+    return sum(len(result.child_ids) for result in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按当前规则重新评估勋章并补发')
+    parser.add_argument('--badge', type=int, action='append', dest='badge_ids', help='只评估指定的勋章ID（可重复）')
+    parser.add_argument('--dry-run', action='store_true', help='只报告需要补发的勋章，不写入')
+    args = parser.parse_args()
+
+    app = create_app()
+    total = 0
+    with app.app_context():
+        if shard_router.enabled:
+            for path in sorted(glob.glob(os.path.join(shard_router.shard_dir, '*.sqlite'))):
+                shard_key = os.path.splitext(os.path.basename(path))[0]
+                total += reevaluate_engine(shard_router.get_engine(shard_key), f'分片 {shard_key}',
+                                           args.badge_ids, args.dry_run)
+        else:
+            total += reevaluate_engine(db.engine, '主数据库', args.badge_ids, args.dry_run)
+    logger.info(f'共{"可" if args.dry_run else "已"}补发 {total} 枚勋章')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+刷新数据分析只读快照
+
+启用ANALYTICS_SNAPSHOT_ENABLED后，分析页面读取的快照会在过期时由请求在后台刷新；
+也可以通过计划任务（如cron）定期运行此脚本，让快照始终保持新鲜。
+运行方式: ANALYTICS_SNAPSHOT_ENABLED=true python refresh_analytics_snapshot.py
+"""
+
+import sys
+import logging
+from app import create_app
+from app.analytics.snapshot import analytics_snapshot
+
+# 配置日志
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('refresh_analytics_snapshot')
+
+
+def main():
+    create_app()
+    if not analytics_snapshot.enabled:
+        print('错误: 分析快照未启用，请设置 ANALYTICS_SNAPSHOT_ENABLED=true（仅支持SQLite数据库）')
+        return 1
+
+    if analytics_snapshot.refresh():
+        logger.info(f'快照已写入 {analytics_snapshot.path}')
+    else:
+        logger.info('其他进程正在刷新快照，跳过')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())